@@ -0,0 +1,139 @@
+"""
+Бенчмарк запуска CLI: сколько стоит импорт run.py и `run.py --help`.
+
+    python bench_startup.py               # 5 повторов, топ-10 модулей
+    python bench_startup.py --repeat 10 --top 20
+
+Импорт меряется через `python -X importtime -c "import run"` (в отдельном
+процессе, кэш байткода уже прогрет первым прогоном), --help — по времени
+процесса целиком. Берётся медиана повторов.
+
+Каждый прогон дописывается строкой JSON в --out (по умолчанию bench_startup.jsonl):
+ревизия git, время импорта и --help, тяжёлые модули. Если в файле уже есть
+прогон, печатается изменение относительно последнего.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Зависимости, которые не должны грузиться при импорте run.py
+HEAVY_MODULES = ["gspread", "google.oauth2", "playwright", "pandas", "openpyxl", "requests", "asyncio"]
+
+
+def _importtime(module: str) -> list[tuple[str, int, int]]:
+    """
+    [(модуль, собственное мкс, накопленное мкс)] из -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def _help_seconds() -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "run.py", "--help"],
+        capture_output=True,
+        check=True,
+        cwd=ROOT,
+    )
+    return time.perf_counter() - started
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=ROOT,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def bench(repeat: int, top: int) -> dict:
+    _importtime("run")  # прогрев __pycache__
+
+    totals = []
+    last: list[tuple[str, int, int]] = []
+    for _ in range(repeat):
+        last = _importtime("run")
+        totals.append(next(cumulative for name, _, cumulative in last if name == "run"))
+    help_runs = [_help_seconds() for _ in range(repeat)]
+
+    loaded = {name for name, _, _ in last}
+    heaviest = sorted(last, key=lambda row: row[1], reverse=True)[:top]
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "import_ms": round(statistics.median(totals) / 1000, 1),
+        "help_ms": round(statistics.median(help_runs) * 1000, 1),
+        "modules": len(last),
+        "heavy_loaded": [name for name in HEAVY_MODULES if name in loaded],
+        "top_self_ms": {name: round(self_us / 1000, 1) for name, self_us, _ in heaviest},
+    }
+
+
+def _previous(out_path: str) -> dict | None:
+    if not os.path.exists(out_path):
+        return None
+    previous = None
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                previous = json.loads(line)
+            except ValueError:
+                continue
+    return previous
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска run.py (-X importtime)")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов замера (берётся медиана)")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых тяжёлых модулей показать")
+    parser.add_argument("--out", default="bench_startup.jsonl", help="Файл результатов (JSON lines); пусто — не писать")
+    args = parser.parse_args()
+
+    previous = _previous(args.out) if args.out else None
+    record = bench(args.repeat, args.top)
+
+    line = f"🚀 import run: {record['import_ms']:.1f} мс, run.py --help: {record['help_ms']:.1f} мс, модулей {record['modules']}"
+    if previous and previous.get("import_ms"):
+        change = (record["import_ms"] / previous["import_ms"] - 1) * 100
+        line += f" ({change:+.1f}% к {previous.get('revision') or 'прошлому прогону'})"
+    print(line)
+    if record["heavy_loaded"]:
+        print(f"⚠️ При импорте грузятся: {', '.join(record['heavy_loaded'])}")
+    for name, self_ms in record["top_self_ms"].items():
+        print(f"   {self_ms:7.1f} мс  {name}")
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Бенчмарк ядра сравнения (sync_diff.compute_changes) на синтетических данных.
+
+    python bench_sync.py                                  # 1, 10, 100, 1000 сотрудников × 1 месяц
+    python bench_sync.py --employees 1 100 --months 12    # год на сотрудника
+
+На каждого сотрудника и месяц генерируются данные сайта и лист месяца B:L
+(часть дней совпадает, часть расходится на несколько минут, часть пустая —
+её дозаполняет сайт). Генерация в замер не входит.
+
+Каждый прогон дописывается строкой JSON в --out (по умолчанию bench_sync.jsonl):
+ревизия git, параметры, лучшее время из --repeat, месяцев/с, дней/с и пик
+памяти по tracemalloc. Если в файле уже есть прогон с теми же параметрами,
+печатается изменение относительно последнего из них.
+"""
+from __future__ import annotations
+
+import argparse
+import calendar
+import json
+import os
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from sync_diff import Interval, compute_changes, minutes_text
+
+
+def _month_data(rnd: random.Random, year: int, month: int) -> tuple[dict, list[list[str]]]:
+    site_by_date = {}
+    base_values = [["Дата", "Вход", "Выход"] + [""] * 8]
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        d = datetime(year, month, day)
+        start = rnd.randint(5 * 60, 12 * 60)
+        end = min(start + rnd.randint(7 * 60, 9 * 60), 23 * 60 + 59)
+        intervals = [Interval(start, end if rnd.random() > 0.05 else -1)]
+        if rnd.random() < 0.15:
+            bonus_start = min(end + rnd.randint(30, 90), 23 * 60)
+            intervals.append(Interval(bonus_start, min(bonus_start + 120, 23 * 60 + 59)))
+        site_by_date[d] = intervals
+
+        row = [d.strftime("%d.%m.%Y" if rnd.random() < 0.7 else "%d/%m/%Y")] + [""] * 10
+        roll = rnd.random()
+        if roll < 0.6:
+            row[1], row[2] = minutes_text(start), minutes_text(end)
+        elif roll < 0.8:
+            row[1], row[2] = minutes_text(start + rnd.randint(-15, 15)), minutes_text(end)
+        if len(intervals) > 1 and rnd.random() < 0.5:
+            row[9], row[10] = minutes_text(intervals[1].start), minutes_text(intervals[1].end)
+        base_values.append(row)
+    return site_by_date, base_values
+
+
+def make_dataset(employees: int, months: int, seed: int = 1) -> list[tuple[dict, list[list[str]]]]:
+    """
+    Список (site_by_date, base_values) — по одному на сотрудника и месяц.
+    """
+    rnd = random.Random(seed)
+    dataset = []
+    for _ in range(employees):
+        for m in range(months):
+            dataset.append(_month_data(rnd, 2025 + m // 12, m % 12 + 1))
+    return dataset
+
+
+def _run(dataset) -> int:
+    rows = 0
+    for site_by_date, base_values in dataset:
+        _, changes_rows = compute_changes(site_by_date, base_values)
+        rows += len(changes_rows)
+    return rows
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def bench(employees: int, months: int, repeat: int) -> dict:
+    dataset = make_dataset(employees, months)
+    days = sum(len(site) for site, _ in dataset)
+
+    best = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = _run(dataset)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    _run(dataset)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "employees": employees,
+        "months": months,
+        "days": days,
+        "changes_rows": rows,
+        "seconds": round(best, 6),
+        "months_per_s": round(len(dataset) / best, 1),
+        "days_per_s": round(days / best, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def _previous(out_path: str) -> dict[tuple[int, int], dict]:
+    previous = {}
+    if not os.path.exists(out_path):
+        return previous
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            previous[(record.get("employees"), record.get("months"))] = record
+    return previous
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк sync_diff.compute_changes")
+    parser.add_argument("--employees", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--months", type=int, default=1, help="Месяцев на сотрудника")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов замера (берётся лучший)")
+    parser.add_argument("--out", default="bench_sync.jsonl", help="Файл результатов (JSON lines); пусто — не писать")
+    args = parser.parse_args()
+
+    previous = _previous(args.out) if args.out else {}
+    for employees in args.employees:
+        record = bench(employees, args.months, args.repeat)
+        line = (
+            f"👥 {employees:>5} × {args.months} мес: {record['seconds'] * 1000:9.1f} мс, "
+            f"{record['days_per_s']:>10.0f} дней/с, пик {record['peak_kib']:>9.1f} КиБ"
+        )
+        before = previous.get((employees, args.months))
+        if before and before.get("seconds"):
+            change = (record["seconds"] / before["seconds"] - 1) * 100
+            line += f" ({change:+.1f}% к {before.get('revision') or 'прошлому прогону'})"
+        print(line)
+        if args.out:
+            with open(args.out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
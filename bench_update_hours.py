@@ -0,0 +1,140 @@
+"""
+Бенчмарк сопоставления строк в update_hours.py: старый перебор против индекса.
+
+    python bench_update_hours.py                 # год: 365 дней, лист на 40 столбцов
+    python bench_update_hours.py --days 730 --repeat 5
+
+Старая реализация (legacy_updates) — копия цикла update_hours.run до перехода
+на индекс: get_all_values всего листа и для каждой строки выгрузки поиск
+подстроки по всем строкам листа, время через pd.to_datetime на каждую ячейку.
+Новая — update_hours.compute_updates по одному столбцу B.
+
+Печатает время обеих, ускорение, объём прочитанного из таблицы (JSON
+get_all_values против col_values(2)) и проверяет, что обновления совпадают
+(старая версия писала "nan" в пустые ячейки — при сравнении это "").
+Результат дописывается строкой JSON в --out (по умолчанию bench_update_hours.jsonl).
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+from datetime import datetime, time as dtime, timedelta
+
+import pandas as pd
+
+from update_hours import _format_time, compute_updates
+
+
+def legacy_updates(df_clean: pd.DataFrame, all_values: list[list[str]]) -> list[dict]:
+    updates = []
+    for index, row in df_clean.iterrows():
+        date_str = str(row['תאריך']).split()[0]
+        try:
+            date_obj = pd.to_datetime(date_str)
+            formatted_date = date_obj.strftime('%d/%m/%Y')
+        except:  # noqa: E722 — как в исходном коде
+            formatted_date = date_str
+
+        entry_time = _format_time(row["כניסה"])
+        exit_time = _format_time(row["יציאה"])
+
+        for i, sheet_row in enumerate(all_values):
+            if len(sheet_row) > 1 and (formatted_date in sheet_row[1] or date_str in sheet_row[1]):
+                row_num = i + 1
+                updates.append({
+                    "range": f"C{row_num}:D{row_num}",
+                    "values": [[entry_time, exit_time]],
+                })
+                print(f"Обновлено: {formatted_date}")
+                break
+    return updates
+
+
+def make_data(days: int, columns: int, seed: int = 1) -> tuple[pd.DataFrame, list[list[str]]]:
+    """
+    (выгрузка сайта, значения листа): лист — заголовок и по строке на день с датой
+    в B и заметками в остальных столбцах; выгрузка — 1–2 интервала на день,
+    даты то ячейкой-датой, то текстом, время то объектом time, то текстом.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2025, 1, 1)
+
+    sheet = [["", "Дата", "Вход", "Выход"] + [f"Заметка {c}" for c in range(columns - 4)]]
+    for day in range(days):
+        d = start + timedelta(days=day)
+        sheet.append(["", d.strftime("%d/%m/%Y"), "", ""] + [f"текст {rnd.randint(0, 999)}" for _ in range(columns - 4)])
+
+    rows = []
+    for day in range(days):
+        d = start + timedelta(days=day)
+        for _ in range(1 if rnd.random() < 0.8 else 2):
+            hh, mm = rnd.randint(6, 12), rnd.randint(0, 59)
+            date_cell = d if rnd.random() < 0.5 else d.strftime("%d/%m/%Y")
+            entry = dtime(hh, mm) if rnd.random() < 0.5 else f"{hh:02d}:{mm:02d}"
+            exit_ = f"{hh + 8:02d}:{mm:02d}:00" if rnd.random() < 0.95 else float("nan")
+            rows.append({"תאריך": date_cell, "כניסה": entry, "יציאה": exit_})
+    return pd.DataFrame(rows), sheet
+
+
+def _best(fn, repeat: int) -> tuple[float, list[dict]]:
+    best = float("inf")
+    result: list[dict] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _without_nan(updates: list[dict]) -> list[dict]:
+    return [
+        {**u, "values": [["" if v == "nan" else v for v in u["values"][0]]]}
+        for u in updates
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк update_hours: перебор против индекса")
+    parser.add_argument("--days", type=int, default=365, help="Дней в листе и выгрузке")
+    parser.add_argument("--columns", type=int, default=40, help="Столбцов в листе (для объёма get_all_values)")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов замера (берётся лучший)")
+    parser.add_argument("--out", default="bench_update_hours.jsonl", help="Файл результатов (JSON lines); пусто — не писать")
+    args = parser.parse_args()
+
+    df_clean, sheet = make_data(args.days, args.columns)
+    column_b = [row[1] for row in sheet]
+
+    legacy_s, legacy = _best(lambda: legacy_updates(df_clean, sheet), args.repeat)
+    indexed_s, indexed = _best(lambda: compute_updates(df_clean, column_b), args.repeat)
+    same = _without_nan(legacy) == indexed
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "days": args.days,
+        "export_rows": len(df_clean),
+        "legacy_s": round(legacy_s, 4),
+        "indexed_s": round(indexed_s, 4),
+        "speedup": round(legacy_s / indexed_s, 1),
+        "read_bytes_legacy": len(json.dumps(sheet, ensure_ascii=False).encode("utf-8")),
+        "read_bytes_indexed": len(json.dumps(column_b, ensure_ascii=False).encode("utf-8")),
+        "same_updates": same,
+    }
+    print(
+        f"📊 {record['export_rows']} строк выгрузки × {len(sheet)} строк листа: "
+        f"перебор {legacy_s * 1000:.1f} мс, индекс {indexed_s * 1000:.1f} мс (×{record['speedup']})"
+    )
+    print(f"📦 Чтение листа: {record['read_bytes_legacy']} Б → {record['read_bytes_indexed']} Б")
+    print("✅ Обновления совпадают" if same else "❌ Обновления различаются")
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
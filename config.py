@@ -26,17 +26,23 @@ def get_bool_env(name: str, default: str = "0") -> bool:
     return raw in ("1", "true", "yes", "y", "on")
 
 
-def load_config() -> dict:
+def load_config(require_site: bool = True) -> dict:
     """
     Единая точка получения конфигурации.
+    require_site=False — учётные данные портала и таблица берутся из ростера (run.py --roster).
     """
+    site_env = get_env if require_site else (lambda name: os.getenv(name, "").strip())
+    portal_fetcher = os.getenv("PORTAL_FETCHER", "browser").strip().lower() or "browser"
     return {
-        "SITE_USERNAME": get_env("SITE_USERNAME"),
-        "SITE_PASSWORD": get_env("SITE_PASSWORD"),
-        "GSHEET_ID": get_env("GSHEET_ID"),
+        "SITE_USERNAME": site_env("SITE_USERNAME"),
+        "SITE_PASSWORD": site_env("SITE_PASSWORD"),
+        "GSHEET_ID": site_env("GSHEET_ID"),
         # Локально: файл service_key.json в корне.
         # В GitHub Actions можно создавать этот файл из секретов.
         "GOOGLE_JSON_FILE": os.getenv("GOOGLE_JSON_FILE", "service_key.json").strip(),
+        # Кэш токена сервисного аккаунта между запусками, например google_token.json
+        # (в файле действующий токен доступа; по умолчанию выключен)
+        "GOOGLE_TOKEN_CACHE": os.getenv("GOOGLE_TOKEN_CACHE", "").strip(),
         "HEADLESS": get_headless(),
         # Имя временного Excel-файла
         "EXCEL_PATH": os.getenv("EXCEL_PATH", "local_data.xlsx").strip(),
@@ -46,4 +52,44 @@ def load_config() -> dict:
         "MANUAL_PORTAL": get_bool_env("MANUAL_PORTAL", "0"),
         # Таймаут ожидания скачивания в ручном режиме (мс). 0 = без таймаута.
         "MANUAL_DOWNLOAD_TIMEOUT_MS": int(os.getenv("MANUAL_DOWNLOAD_TIMEOUT_MS", "0").strip() or "0"),
+        # Файл кэша сессии портала (cookies браузера). Пусто — каждый раз полный логин.
+        # Содержит действующую сессию — не коммитить.
+        # Для PORTAL_FETCHER=http сессия нужна всегда — по умолчанию portal_session.json.
+        "PORTAL_SESSION_FILE": os.getenv(
+            "PORTAL_SESSION_FILE", "portal_session.json" if portal_fetcher == "http" else ""
+        ).strip(),
+        # Как скачивать Excel: browser — Playwright, http — повтор записанных запросов без браузера
+        # (при ошибке — откат на браузер, который заодно перезаписывает рецепт)
+        "PORTAL_FETCHER": portal_fetcher,
+        # Рецепт HTTP-выгрузки (записывается браузерной выгрузкой в режиме http)
+        "HTTP_RECIPE_FILE": os.getenv("HTTP_RECIPE_FILE", "portal_recipe.json").strip(),
+        # Подмена адреса портала для HTTP-выгрузки (например, локальный стенд ylm_stub_server)
+        "PORTAL_BASE_URL": os.getenv("PORTAL_BASE_URL", "").strip(),
+        # Как строить лист изменений: steps — серией вызовов, single — одним batchUpdate,
+        # patch — правка существующего листа по строкам (вставка/удаление/изменение)
+        "RENDER_MODE": os.getenv("RENDER_MODE", "steps").strip().lower() or "steps",
+        # Если 1/true/yes — дополнительно красить табель статическим форматом (поверх правил)
+        "STATIC_COLORS": get_bool_env("STATIC_COLORS", "0"),
+        # Если 1/true/yes — не пересобирать лист изменений, если данные не менялись
+        "INCREMENTAL": get_bool_env("INCREMENTAL", "0"),
+        # Файл состояния: хэши инкрементального режима, строки листа изменений, индекс дат листов месяцев
+        "STATE_FILE": os.getenv("STATE_FILE", "sync_state.json").strip(),
+        # Чтение листа месяца: narrow — столбец B и C:D, K:L только нужных дат (индекс в STATE_FILE),
+        # full — весь диапазон B:L
+        "BASE_READ": os.getenv("BASE_READ", "narrow").strip().lower() or "narrow",
+        # Если 1/true/yes — кэшировать разобранные архивы history/M.YY.xlsx (файл .intervals рядом, ключ — SHA-256)
+        "PARSE_CACHE": get_bool_env("PARSE_CACHE", "1"),
+        # run.py --watch: интервал между выгрузками текущего месяца, секунд
+        "WATCH_INTERVAL_S": float(os.getenv("WATCH_INTERVAL_S", "300").strip() or "300"),
+        # Режим ростера: сколько контекстов браузера выгружают одновременно
+        "PORTAL_POOL_SIZE": int(os.getenv("PORTAL_POOL_SIZE", "3").strip() or "3"),
+        # Режим ростера: потоки синхронизации таблиц
+        "SHEETS_WORKERS": int(os.getenv("SHEETS_WORKERS", "4").strip() or "4"),
+        # Квота Sheets API на пользователя: чтений и записей в минуту (планировщик запросов)
+        "SHEETS_READS_PER_MIN": float(os.getenv("SHEETS_READS_PER_MIN", "60").strip() or "60"),
+        "SHEETS_WRITES_PER_MIN": float(os.getenv("SHEETS_WRITES_PER_MIN", "60").strip() or "60"),
+        # google — настоящий Google Sheets, fake — таблица в памяти (прогоны без сети, см. fake_sheets.py)
+        "SHEETS_BACKEND": os.getenv("SHEETS_BACKEND", "google").strip().lower() or "google",
+        # Листы для fake-бэкенда (JSON {"M.YY": [[...]]}), туда же сохраняется результат
+        "FAKE_SHEETS_FILE": os.getenv("FAKE_SHEETS_FILE", "").strip(),
     }
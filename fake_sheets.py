@@ -0,0 +1,498 @@
+"""
+Таблица Google Sheets в памяти — для прогонов без сети и учётных данных.
+
+Подключается через SHEETS_BACKEND=fake (см. run.py). Реализует то
+подмножество gspread, которым пользуются sync_logic, run.py и sheets_client:
+Spreadsheet.worksheet/worksheets/add_worksheet/del_worksheet/batch_update/
+fetch_sheet_metadata/values_batch_get и Worksheet.get_values/update/
+batch_update/batch_format/format.
+
+Значения хранятся как строки (USER_ENTERED не вычисляется: формула
+остаётся текстом формулы, числа из updateCells — как их покажет numberFormat
+ячейки: время hh:mm и даты dd.mm.yyyy / dd/mm/yyyy, иначе str(числа)).
+insertDimension/deleteDimension по строкам сдвигают ячейки и ссылки на строки
+в формулах, как это делает Sheets.
+
+Исходные листы и итог прогона — в FAKE_SHEETS_FILE (JSON
+{"M.YY": [[A1, B1, ...], ...]}); "{id}" в имени файла заменяется на gsheet_id.
+
+Счётчики: вызовы по методам, чтения/записи, байты запросов и ответов
+(размер JSON), имитированная задержка. Задержка и квота задаются
+FAKE_SHEETS_LATENCY_MS, FAKE_SHEETS_READ_QUOTA, FAKE_SHEETS_WRITE_QUOTA
+(запросов в минуту, 0 — без ограничения); при превышении квоты — APIError 429,
+как у настоящего API. Разовые ошибки отдельных вызовов — FakeSpreadsheet.fail_next.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import re
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, fill_gaps
+
+_OPENED: list["FakeSpreadsheet"] = []
+
+
+def api_error(code: int, message: str, status: str = "", retry_after: float | None = None) -> APIError:
+    """
+    APIError как у настоящего API (тело JSON, при retry_after — заголовок Retry-After).
+    """
+    response = requests.Response()
+    response.status_code = code
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    response._content = json.dumps({"error": {"code": code, "message": message, "status": status}}).encode("utf-8")
+    return APIError(response)
+
+
+def _quota_error(kind: str) -> APIError:
+    return api_error(429, f"Quota exceeded for quota metric '{kind} requests' (fake backend)", "RESOURCE_EXHAUSTED")
+
+
+def _payload_size(data) -> int:
+    return len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _split_range(a1: str) -> tuple[str | None, str]:
+    """
+    "'12.25'!B:L" -> ("12.25", "B:L").
+    """
+    if "!" not in a1:
+        return None, a1
+    title, rng = a1.rsplit("!", 1)
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, rng
+
+
+_SHEETS_EPOCH = datetime(1899, 12, 30)
+_CELL_REF_RE = re.compile(r"(\$?[A-Z]{1,3}\$?)(\d+)")
+
+
+def _formatted_number(number: float, pattern: str) -> str:
+    if "yyyy" in pattern:
+        sep = "/" if "/" in pattern else "."
+        return (_SHEETS_EPOCH + timedelta(days=int(number))).strftime(f"%d{sep}%m{sep}%Y")
+    if "mm" in pattern:
+        total = int(round(number * 1440))
+        return f"{total // 60:02d}:{total % 60:02d}"
+    return str(number)
+
+
+def _user_value(cell: dict) -> str:
+    value = cell.get("userEnteredValue")
+    if not value:
+        return ""
+    if "formulaValue" in value:
+        return value["formulaValue"]
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "numberValue" in value:
+        pattern = cell.get("userEnteredFormat", {}).get("numberFormat", {}).get("pattern", "")
+        return _formatted_number(value["numberValue"], pattern)
+    if "boolValue" in value:
+        return "TRUE" if value["boolValue"] else "FALSE"
+    return ""
+
+
+class FakeMetrics:
+    """
+    Счётчики API-вызовов одного бэкенда.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.reads = 0
+        self.writes = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.latency = 0.0
+        self.quota_errors = 0
+
+    def summary(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "reads": self.reads,
+            "writes": self.writes,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "latency_s": round(self.latency, 3),
+            "quota_errors": self.quota_errors,
+        }
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", sheet_id: int, title: str, rows: int = 1000, cols: int = 26):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells: dict[tuple[int, int], str] = {}
+        self.formats: list[dict] = []
+        self.merges: list[dict] = []
+        self.conditional_formats: list[dict] = []
+
+    def __repr__(self) -> str:
+        return f"<FakeWorksheet {self.title!r} id:{self.id}>"
+
+    # --- данные ---
+
+    def _bounds(self, rng: str) -> tuple[int, int, int, int]:
+        grid = a1_range_to_grid_range(rng)
+        r0 = grid.get("startRowIndex", 0)
+        c0 = grid.get("startColumnIndex", 0)
+        r1 = grid.get("endRowIndex", max((r for r, _ in self.cells), default=-1) + 1)
+        c1 = grid.get("endColumnIndex", max((c for _, c in self.cells), default=-1) + 1)
+        return r0, r1, c0, c1
+
+    def _read(self, rng: str) -> list[list[str]]:
+        """
+        Как values.get: пустые хвосты строк и столбцов отрезаются.
+        """
+        r0, r1, c0, c1 = self._bounds(rng)
+        rows = []
+        for r in range(r0, r1):
+            row = [self.cells.get((r, c), "") for c in range(c0, c1)]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def _write(self, rng: str, values: list[list]) -> None:
+        grid = a1_range_to_grid_range(rng)
+        r0 = grid.get("startRowIndex", 0)
+        c0 = grid.get("startColumnIndex", 0)
+        for dr, row in enumerate(values):
+            for dc, value in enumerate(row):
+                key = (r0 + dr, c0 + dc)
+                text = "" if value is None else str(value)
+                if text == "":
+                    self.cells.pop(key, None)
+                else:
+                    self.cells[key] = text
+
+    def get_values(self, range_name: str = "A:ZZ", **kwargs) -> list[list[str]]:
+        return self.spreadsheet._call("get_values", "read", (self.title, range_name), lambda: fill_gaps(self._read(range_name)))
+
+    def update(self, range_name, values=None, value_input_option=None, **kwargs):
+        # gspread 6: update(range_name, values); старый порядок update(values, range_name) не поддерживается
+        return self.spreadsheet._call(
+            "update", "write", (self.title, range_name, values), lambda: self._write(range_name, values)
+        )
+
+    def batch_update(self, data: list[dict], value_input_option=None, **kwargs):
+        def _apply() -> None:
+            for item in data:
+                self._write(item["range"], item["values"])
+
+        return self.spreadsheet._call("ws.batch_update", "write", (self.title, data), _apply)
+
+    def batch_format(self, formats: list[dict]):
+        return self.spreadsheet._call("batch_format", "write", (self.title, formats), lambda: self.formats.extend(formats))
+
+    def format(self, ranges, format: dict):
+        item = {"range": ranges, "format": format}
+        return self.spreadsheet._call("format", "write", (self.title, item), lambda: self.formats.append(item))
+
+    def resize(self, rows: int | None = None, cols: int | None = None):
+        def _apply() -> None:
+            if rows is not None:
+                self.row_count = rows
+            if cols is not None:
+                self.col_count = cols
+
+        return self.spreadsheet._call("resize", "write", (self.title, rows, cols), _apply)
+
+    def _shift_rows(self, at: int, delta: int) -> None:
+        """
+        Строки с индекса at сдвигаются на delta (вставка > 0, удаление < 0 —
+        удаляются строки [at, at - delta)). Ссылки на строки в формулах
+        сдвигаются так же; ссылка на удалённую строку прижимается к at.
+        """
+        cells = {}
+        for (r, c), text in self.cells.items():
+            if delta < 0 and at <= r < at - delta:
+                continue
+            cells[(r + delta if r >= at else r, c)] = text
+        self.cells = cells
+        self.row_count = max(0, self.row_count + delta)
+
+        def _ref(match: re.Match) -> str:
+            row = int(match.group(2)) - 1
+            if row >= at:
+                row = max(at, row + delta)
+            return f"{match.group(1)}{row + 1}"
+
+        # ссылки с других листов ('12.25'!B5) не поддерживаются — в проекте их нет
+        for key, text in self.cells.items():
+            if text.startswith("="):
+                self.cells[key] = _CELL_REF_RE.sub(_ref, text)
+
+    def properties(self) -> dict:
+        return {
+            "sheetId": self.id,
+            "title": self.title,
+            "gridProperties": {"rowCount": self.row_count, "columnCount": self.col_count},
+        }
+
+
+class FakeSpreadsheet:
+    """
+    Таблица в памяти. values — начальные листы {title: [[A1, B1, ...], ...]}.
+    """
+
+    def __init__(
+        self,
+        gsheet_id: str = "fake",
+        values: dict[str, list[list[str]]] | None = None,
+        latency_ms: float = 0.0,
+        read_quota: int = 0,
+        write_quota: int = 0,
+        file_path: str = "",
+    ):
+        self.id = gsheet_id
+        self.title = f"fake:{gsheet_id}"
+        self.latency = latency_ms / 1000.0
+        self.read_quota = read_quota
+        self.write_quota = write_quota
+        self.file_path = file_path
+        self.metrics = FakeMetrics()
+        self.sheets: list[FakeWorksheet] = []
+        self._next_id = 0
+        self._recent = {"read": deque(), "write": deque()}
+        self._failures: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        for title, rows in (values or {}).items():
+            ws = self._add(title, max(len(rows), 1000), 26)
+            ws._write("A1", rows)
+
+    # --- служебное ---
+
+    def _add(self, title: str, rows: int, cols: int, sheet_id: int | None = None) -> FakeWorksheet:
+        if any(ws.title == title for ws in self.sheets):
+            raise RuntimeError(f"Лист {title} уже существует")
+        if sheet_id is None:
+            sheet_id = self._next_id
+        self._next_id = max(self._next_id, sheet_id) + 1
+        ws = FakeWorksheet(self, sheet_id, title, rows, cols)
+        self.sheets.append(ws)
+        return ws
+
+    def _by_id(self, sheet_id: int) -> FakeWorksheet:
+        for ws in self.sheets:
+            if ws.id == sheet_id:
+                return ws
+        raise WorksheetNotFound(str(sheet_id))
+
+    def fail_next(self, name: str, code: int = 400, times: int = 1, retry_after: float | None = None) -> None:
+        """
+        Следующие times вызовов name (имя из счётчика вызовов: "batch_update",
+        "ws.batch_update", "get_values", ...) падают с APIError code — для проверки
+        повторов и обработки ошибок.
+        """
+        failures = self._failures.setdefault(name, deque())
+        for _ in range(times):
+            failures.append(api_error(code, f"Injected error for {name} (fake backend)", retry_after=retry_after))
+
+    def _check_quota(self, kind: str) -> None:
+        quota = self.read_quota if kind == "read" else self.write_quota
+        if quota <= 0:
+            return
+        now = time.monotonic()
+        recent = self._recent[kind]
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        if len(recent) >= quota:
+            self.metrics.quota_errors += 1
+            raise _quota_error(kind)
+        recent.append(now)
+
+    def _call(self, name: str, kind: str, request, action):
+        with self._lock:
+            self.metrics.calls[name] += 1
+            if self._failures.get(name):
+                raise self._failures[name].popleft()
+            self._check_quota(kind)
+            if kind == "read":
+                self.metrics.reads += 1
+            else:
+                self.metrics.writes += 1
+            self.metrics.request_bytes += _payload_size(request)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.metrics.latency += self.latency
+            result = action()
+            if result is not None:
+                self.metrics.response_bytes += _payload_size(result)
+        return result
+
+    # --- gspread API ---
+
+    def worksheets(self, exclude_hidden: bool = False) -> list[FakeWorksheet]:
+        return self._call("worksheets", "read", None, lambda: list(self.sheets))
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        def _find() -> FakeWorksheet:
+            for ws in self.sheets:
+                if ws.title == title:
+                    return ws
+            raise WorksheetNotFound(title)
+
+        return self._call("worksheet", "read", title, _find)
+
+    def add_worksheet(self, title: str, rows: int, cols: int, index=None) -> FakeWorksheet:
+        return self._call("add_worksheet", "write", (title, rows, cols), lambda: self._add(title, rows, cols))
+
+    def del_worksheet(self, worksheet: FakeWorksheet) -> None:
+        self._call("del_worksheet", "write", worksheet.id, lambda: self.sheets.remove(self._by_id(worksheet.id)))
+
+    def fetch_sheet_metadata(self, params=None) -> dict:
+        def _meta() -> dict:
+            return {
+                "spreadsheetId": self.id,
+                "sheets": [
+                    {
+                        "properties": ws.properties(),
+                        "conditionalFormats": list(ws.conditional_formats),
+                        "merges": list(ws.merges),
+                    }
+                    for ws in self.sheets
+                ],
+            }
+
+        return self._call("fetch_sheet_metadata", "read", params, _meta)
+
+    def values_batch_get(self, ranges: list[str], params=None) -> dict:
+        def _get() -> dict:
+            value_ranges = []
+            for a1 in ranges:
+                title, rng = _split_range(a1)
+                ws = next((w for w in self.sheets if w.title == title), None) if title else self.sheets[0]
+                if ws is None:
+                    raise RuntimeError(f"Unable to parse range: {a1}")
+                value_ranges.append({"range": a1, "majorDimension": "ROWS", "values": ws._read(rng)})
+            return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+        return self._call("values_batch_get", "read", ranges, _get)
+
+    def values_batch_update(self, body: dict) -> dict:
+        def _apply() -> dict:
+            for item in body.get("data", []):
+                title, rng = _split_range(item["range"])
+                ws = next((w for w in self.sheets if w.title == title), None) if title else self.sheets[0]
+                if ws is None:
+                    raise RuntimeError(f"Unable to parse range: {item['range']}")
+                ws._write(rng, item["values"])
+            return {"spreadsheetId": self.id}
+
+        return self._call("values_batch_update", "write", body, _apply)
+
+    def batch_update(self, body: dict) -> dict:
+        return self._call("batch_update", "write", body, lambda: self._apply_requests(body.get("requests", [])))
+
+    def _apply_requests(self, requests_list: list[dict]) -> dict:
+        replies = []
+        for request in requests_list:
+            (kind, params), = request.items()
+            reply = {}
+            if kind == "addSheet":
+                props = params.get("properties", {})
+                grid = props.get("gridProperties", {})
+                ws = self._add(props["title"], grid.get("rowCount", 1000), grid.get("columnCount", 26), props.get("sheetId"))
+                reply = {"addSheet": {"properties": ws.properties()}}
+            elif kind == "deleteSheet":
+                self.sheets.remove(self._by_id(params["sheetId"]))
+            elif kind == "updateCells":
+                ws = self._by_id(params.get("start", params.get("range", {})).get("sheetId"))
+                start = params.get("start", {})
+                r0 = start.get("rowIndex", params.get("range", {}).get("startRowIndex", 0))
+                c0 = start.get("columnIndex", params.get("range", {}).get("startColumnIndex", 0))
+                for dr, row in enumerate(params.get("rows", [])):
+                    for dc, cell in enumerate(row.get("values", [])):
+                        key = (r0 + dr, c0 + dc)
+                        text = _user_value(cell)
+                        if text:
+                            ws.cells[key] = text
+                        else:
+                            ws.cells.pop(key, None)
+            elif kind == "mergeCells":
+                self._by_id(params["range"]["sheetId"]).merges.append(params["range"])
+            elif kind == "addConditionalFormatRule":
+                ws = self._by_id(params["rule"]["ranges"][0]["sheetId"])
+                ws.conditional_formats.insert(params.get("index", len(ws.conditional_formats)), params["rule"])
+            elif kind == "deleteConditionalFormatRule":
+                self._by_id(params["sheetId"]).conditional_formats.pop(params["index"])
+            elif kind == "updateConditionalFormatRule":
+                # правила в файл не сохраняются: у листа из FAKE_SHEETS_FILE их ещё нет
+                rules = self._by_id(params["sheetId"]).conditional_formats
+                if params["index"] < len(rules):
+                    rules[params["index"]] = params["rule"]
+                else:
+                    rules.append(params["rule"])
+            elif kind in ("insertDimension", "deleteDimension") and params["range"].get("dimension") == "ROWS":
+                rng = params["range"]
+                count = rng["endIndex"] - rng["startIndex"]
+                self._by_id(rng["sheetId"])._shift_rows(rng["startIndex"], count if kind == "insertDimension" else -count)
+            # остальные запросы (форматы, размеры) на значения не влияют — только считаются
+            replies.append(reply)
+        return {"spreadsheetId": self.id, "replies": replies}
+
+    # --- файл и отчёт ---
+
+    def dump(self) -> dict[str, list[list[str]]]:
+        return {ws.title: fill_gaps(ws._read("A:ZZ")) for ws in self.sheets}
+
+    def save(self) -> None:
+        if not self.file_path:
+            return
+        temp_path = f"{self.file_path}.new"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.dump(), f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.file_path)
+
+
+def open_fake_spreadsheet(gsheet_id: str, file_path: str = "") -> FakeSpreadsheet:
+    """
+    Таблица из FAKE_SHEETS_FILE (или пустая). По завершении процесса листы
+    сохраняются обратно в файл, а счётчики печатаются.
+    """
+    file_path = file_path.replace("{id}", gsheet_id)
+    values = {}
+    if file_path and os.path.exists(file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            values = json.load(f)
+    spreadsheet = FakeSpreadsheet(
+        gsheet_id,
+        values=values,
+        latency_ms=float(os.getenv("FAKE_SHEETS_LATENCY_MS", "0").strip() or "0"),
+        read_quota=int(os.getenv("FAKE_SHEETS_READ_QUOTA", "0").strip() or "0"),
+        write_quota=int(os.getenv("FAKE_SHEETS_WRITE_QUOTA", "0").strip() or "0"),
+        file_path=file_path,
+    )
+    if not _OPENED:
+        atexit.register(_report_opened)
+    _OPENED.append(spreadsheet)
+    return spreadsheet
+
+
+def _report_opened() -> None:
+    for spreadsheet in _OPENED:
+        spreadsheet.save()
+        m = spreadsheet.metrics
+        print(
+            f"🧪 Fake Sheets {spreadsheet.id}: чтений {m.reads}, записей {m.writes}, "
+            f"отправлено {m.request_bytes} Б, получено {m.response_bytes} Б, "
+            f"задержка {m.latency:.2f} с, ошибок квоты {m.quota_errors}"
+        )
+        print(f"   вызовы: {json.dumps(dict(m.calls), ensure_ascii=False)}")
@@ -0,0 +1,109 @@
+"""
+Сводка за год: разница табеля и факта по дням, месяцам и с начала года.
+
+Считается локально из разобранных архивов history/ и листов месяцев —
+тем же ядром, что и листы изменений (sync_diff.compute_changes), суммы в NumPy.
+В таблицу уходит один лист "Сводка YYYY" одним обновлением значений, без
+формул: Google ничего не пересчитывает, открывать листы изменений не нужно.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+
+import numpy as np
+
+# Разница = (выход - вход по табелю) - (выход - вход по факту), как в листе изменений
+ROLLUP_HEADER = ["Месяц", "Дней с разницей", "Разница, мин", "Разница", "С начала года, мин", "С начала года"]
+DAYS_HEADER = ["Дата", "Месяц", "Разница, мин", "Разница"]
+ROLLUP_COLS = len(ROLLUP_HEADER)
+
+
+def signed_hhmm(minutes: int) -> str:
+    """
+    -95 -> "-1:35", 30 -> "+0:30", 0 -> "0:00".
+    """
+    sign = "-" if minutes < 0 else "+" if minutes > 0 else ""
+    hours, mins = divmod(abs(int(minutes)), 60)
+    return f"{sign}{hours}:{mins:02d}"
+
+
+def row_diffs(changes_rows: list[list]) -> tuple[list[str], np.ndarray]:
+    """
+    Разница (мин) по строкам листа изменений: (дата строки, разница).
+    Бонусная строка (без даты) относится к дате над ней; строка, где не хватает
+    хотя бы одного времени, даёт 0 — как пустая формула в листе изменений.
+    В бонусной строке пустое время записано в лист как 00:00 — так и считаем.
+    """
+    if not changes_rows:
+        return [], np.zeros(0, dtype=np.int64)
+    times = np.array([row[1:5] for row in changes_rows], dtype=np.int64)
+    bonus = np.array([row[0] == "" for row in changes_rows])
+    times[bonus] = np.maximum(times[bonus], 0)
+    complete = (times >= 0).all(axis=1)
+    diffs = np.where(complete, (times[:, 3] - times[:, 2]) - (times[:, 1] - times[:, 0]), 0)
+
+    labels = []
+    current = ""
+    for row in changes_rows:
+        current = row[0] or current
+        labels.append(current)
+    return labels, diffs
+
+
+def day_totals(changes_rows: list[list]) -> tuple[list[str], np.ndarray]:
+    """
+    Сумма разницы по датам (в порядке листа изменений); даты с нулевой суммой — тоже.
+    """
+    labels, diffs = row_diffs(changes_rows)
+    days = list(dict.fromkeys(labels))
+    if not days:
+        return [], np.zeros(0, dtype=np.int64)
+    positions = {day: i for i, day in enumerate(days)}
+    totals = np.zeros(len(days), dtype=np.int64)
+    np.add.at(totals, np.fromiter((positions[label] for label in labels), dtype=np.int64, count=len(labels)), diffs)
+    return days, totals
+
+
+def build_rollup_values(title: str, months: list[tuple[str, list[list]]]) -> list[list]:
+    """
+    months: [(M.YY, changes_rows)] по порядку. Возвращает значения листа сводки:
+    заголовок, таблица по месяцам с нарастающим итогом, затем дни с разницей.
+    """
+    per_month = [(label, *day_totals(rows)) for label, rows in months]
+    month_sums = np.array([int(totals.sum()) for _, _, totals in per_month], dtype=np.int64)
+    ytd = np.cumsum(month_sums) if len(month_sums) else month_sums
+
+    values: list[list] = [
+        [title, "", "", "", f"Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}", ""],
+        [""] * ROLLUP_COLS,
+        list(ROLLUP_HEADER),
+    ]
+    for (label, days, totals), month_sum, running in zip(per_month, month_sums, ytd):
+        values.append(
+            [label, int(np.count_nonzero(totals)), int(month_sum), signed_hhmm(month_sum), int(running), signed_hhmm(running)]
+        )
+    total = int(ytd[-1]) if len(ytd) else 0
+    values.append(["Итого", sum(row[1] for row in values[3:]), total, signed_hhmm(total), "", ""])
+
+    values.append([""] * ROLLUP_COLS)
+    values.append(DAYS_HEADER + [""] * (ROLLUP_COLS - len(DAYS_HEADER)))
+    for label, days, totals in per_month:
+        for day, minutes in zip(days, totals):
+            if minutes:
+                values.append([day, label, int(minutes), signed_hhmm(minutes), "", ""])
+    return values
+
+
+def write_rollup(spreadsheet, worksheet, title: str, values: list[list]) -> None:
+    """
+    Пишет сводку одним обновлением значений (RAW — без пересчёта формул).
+    Существующий лист не очищается отдельным запросом: значения дополняются
+    пустыми строками до его размера.
+    """
+    if worksheet is None:
+        worksheet = spreadsheet.add_worksheet(title=title, rows=len(values) + 10, cols=ROLLUP_COLS)
+    elif worksheet.row_count < len(values):
+        worksheet.resize(rows=len(values) + 10)
+
+    padded = values + [[""] * ROLLUP_COLS for _ in range(max(0, worksheet.row_count - len(values)))]
+    worksheet.update(f"A1:F{len(padded)}", padded, value_input_option="RAW")
@@ -0,0 +1,72 @@
+"""
+Ростер команды: сотрудники, их учётные данные портала и таблицы.
+
+Файл JSON — список сотрудников:
+
+    [
+        {
+            "name": "anna",
+            "site_username": "123456789",
+            "site_password_env": "ANNA_SITE_PASSWORD",
+            "gsheet_id": "1AbC...",
+            "google_json_file": "service_key.json"
+        }
+    ]
+
+Пароль лучше держать в env (site_password_env), а не в самом файле
+(site_password). google_json_file — необязательный, по умолчанию GOOGLE_JSON_FILE.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+
+_NAME_RE = re.compile(r"^[\w.-]+$")
+
+
+def _password(entry: dict) -> str:
+    if entry.get("site_password"):
+        return str(entry["site_password"])
+    env_name = entry.get("site_password_env", "")
+    value = os.getenv(env_name, "").strip() if env_name else ""
+    if not value:
+        raise RuntimeError(f"Ростер: у {entry.get('name')} не задан пароль (site_password или site_password_env)")
+    return value
+
+
+def load_roster(path: str, google_json_file: str = "service_key.json") -> list[dict[str, str]]:
+    """
+    Читает и проверяет ростер. Возвращает записи с полями
+    name, site_username, site_password, gsheet_id, google_json_file.
+    """
+    if not os.path.exists(path):
+        raise RuntimeError(f"Файл ростера не найден: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise RuntimeError(f"Ростер {path} должен быть непустым списком сотрудников")
+
+    roster = []
+    seen = set()
+    for entry in entries:
+        name = str(entry.get("name", "")).strip()
+        # name — часть имён файлов (team/<name>.xlsx)
+        if not _NAME_RE.match(name):
+            raise RuntimeError(f"Ростер: недопустимое имя сотрудника: {name!r}")
+        if name in seen:
+            raise RuntimeError(f"Ростер: сотрудник {name} указан дважды")
+        seen.add(name)
+        for key in ("site_username", "gsheet_id"):
+            if not str(entry.get(key, "")).strip():
+                raise RuntimeError(f"Ростер: у {name} не задано поле {key}")
+        roster.append(
+            {
+                "name": name,
+                "site_username": str(entry["site_username"]).strip(),
+                "site_password": _password(entry),
+                "gsheet_id": str(entry["gsheet_id"]).strip(),
+                "google_json_file": str(entry.get("google_json_file") or google_json_file).strip(),
+            }
+        )
+    return roster
@@ -1,12 +1,28 @@
+from __future__ import annotations
+
 import argparse
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
+from typing import TYPE_CHECKING
 
 from config import load_config
-from sheets_client import open_spreadsheet, month_sheet_name, get_worksheet
-from sync_logic import build_changes_sheet
-from ylm_portal import download_excel
+from roster import load_roster
+from sync_diff import date_variants
+from sync_logic import build_changes_sheet, load_site_by_date
+from sync_state import base_hash, is_unchanged, load_state, save_state, site_hash
+
+# gspread/google-auth, playwright, requests и asyncio импортируются в функциях,
+# которым они нужны: --help и запуск без выгрузки их не ждут (см. bench_startup.py).
+if TYPE_CHECKING:
+    from sheets_quota import SheetsScheduler
+
+
+# Архивы выгрузок по месяцам: history/M.YY.xlsx
+HISTORY_DIR = "history"
 
 
 def _parse_month_arg(raw: str) -> datetime:
@@ -21,6 +37,24 @@ def _parse_month_arg(raw: str) -> datetime:
     return datetime(year=year, month=month, day=1)
 
 
+def _parse_months_arg(raw: str) -> list[datetime]:
+    """
+    Диапазон месяцев M.YY-M.YY (например 1.25-12.25), границы включительно.
+    """
+    start_raw, _, end_raw = raw.partition("-")
+    start = _parse_month_arg(start_raw)
+    end = _parse_month_arg(end_raw) if end_raw.strip() else start
+    if end < start:
+        raise ValueError("Конец диапазона месяцев раньше начала")
+
+    months = []
+    current = start
+    while current <= end:
+        months.append(current)
+        current = current.replace(month=1, year=current.year + 1) if current.month == 12 else current.replace(month=current.month + 1)
+    return months
+
+
 def _month_sheet_label(dt: datetime) -> str:
     return f"{dt.month}.{dt.strftime('%y')}"
 
@@ -29,72 +63,703 @@ def _first_day_str(dt: datetime) -> str:
     return f"01/{dt.strftime('%m/%Y')}"
 
 
+def _scheduler(cfg: dict) -> SheetsScheduler:
+    from sheets_quota import shared_scheduler
+
+    return shared_scheduler(cfg["SHEETS_READS_PER_MIN"], cfg["SHEETS_WRITES_PER_MIN"])
+
+
+def _open_spreadsheet(cfg: dict):
+    """
+    Таблица через общий планировщик запросов (квота, склейка записей, повторы 429/5xx).
+    Планировщик один на процесс — он же единственный ограничитель частоты.
+    """
+    from sheets_client import open_spreadsheet
+
+    spreadsheet = open_spreadsheet(
+        gsheet_id=cfg["GSHEET_ID"],
+        google_json_file=cfg["GOOGLE_JSON_FILE"],
+        backend=cfg["SHEETS_BACKEND"],
+        fake_file=cfg["FAKE_SHEETS_FILE"],
+        token_cache=cfg["GOOGLE_TOKEN_CACHE"],
+    )
+    return _scheduler(cfg).wrap(spreadsheet)
+
+
+def _done(cfg: dict) -> None:
+    print(_scheduler(cfg).report())
+    print("✅ Готово")
+
+
+def _download_http(cfg: dict, excel_path: str, first_day: str | None) -> bool:
+    """
+    Повтор записанных запросов без браузера; False — не удалось (нужен браузер).
+    """
+    try:
+        from ylm_http import download_excel_http
+
+        download_excel_http(
+            excel_path=excel_path,
+            first_day=first_day or _first_day_str(datetime.now()),
+            recipe_file=cfg["HTTP_RECIPE_FILE"],
+            session_file=cfg["PORTAL_SESSION_FILE"],
+            base_url=cfg["PORTAL_BASE_URL"],
+        )
+        return True
+    except Exception as exc:
+        print(f"⚠️ HTTP-выгрузка не удалась ({exc}) — скачиваю через браузер.")
+        return False
+
+
+def _download(cfg: dict, excel_path: str, first_day: str | None) -> None:
+    """
+    Скачивание Excel: PORTAL_FETCHER=http — повтор записанных запросов без браузера,
+    при ошибке (или по умолчанию) — через браузер.
+    """
+    http_mode = cfg["PORTAL_FETCHER"] == "http" and not cfg["MANUAL_PORTAL"]
+    if http_mode and _download_http(cfg, excel_path, first_day):
+        return
+
+    from ylm_portal import download_excel
+
+    download_excel(
+        site_username=cfg["SITE_USERNAME"],
+        site_password=cfg["SITE_PASSWORD"],
+        excel_path=excel_path,
+        headless=cfg["HEADLESS"],
+        first_day=first_day,
+        manual_portal=cfg["MANUAL_PORTAL"],
+        manual_download_timeout_ms=cfg["MANUAL_DOWNLOAD_TIMEOUT_MS"],
+        session_file=cfg["PORTAL_SESSION_FILE"],
+        recipe_file=cfg["HTTP_RECIPE_FILE"] if http_mode else "",
+    )
+
+
+def _download_months(cfg: dict, exports: dict[str, str]) -> None:
+    http_mode = cfg["PORTAL_FETCHER"] == "http"
+    if http_mode:
+        try:
+            from ylm_http import HttpPortalClient
+
+            with HttpPortalClient(
+                cfg["HTTP_RECIPE_FILE"],
+                session_file=cfg["PORTAL_SESSION_FILE"],
+                base_url=cfg["PORTAL_BASE_URL"],
+            ) as client:
+                client.export_months(exports)
+            return
+        except Exception as exc:
+            print(f"⚠️ HTTP-выгрузка не удалась ({exc}) — скачиваю через браузер.")
+
+    from ylm_portal import download_excel_months
+
+    download_excel_months(
+        site_username=cfg["SITE_USERNAME"],
+        site_password=cfg["SITE_PASSWORD"],
+        exports=exports,
+        headless=cfg["HEADLESS"],
+        session_file=cfg["PORTAL_SESSION_FILE"],
+        recipe_file=cfg["HTTP_RECIPE_FILE"] if http_mode else "",
+    )
+
+
+def _read_base_narrow(cfg: dict, spreadsheet, sheet_name: str, site_by_date: dict) -> list[list[str]] | None:
+    """
+    B и C:D, K:L только нужных строк по индексу дат из STATE_FILE.
+    None — узкое чтение не удалось, читаем B:L целиком.
+    """
+    from sheets_client import read_base_rows
+    from sheets_quota import DeferredWriteError
+
+    state = load_state(cfg["STATE_FILE"])
+    entry = state.setdefault(sheet_name, {})
+    cache = dict(entry.get("index") or {})
+    dates = [variant for d in site_by_date for variant in date_variants(d)]
+    try:
+        base_values = read_base_rows(spreadsheet, sheet_name, dates, cache)
+    except DeferredWriteError:
+        # не ошибка чтения: не ушла запись прошлого этапа
+        raise
+    except Exception as exc:
+        print(f"⚠️ Узкое чтение листа {sheet_name} не удалось ({exc}) — читаем B:L целиком.")
+        return None
+    if cache != entry.get("index"):
+        entry["index"] = cache
+        save_state(cfg["STATE_FILE"], state)
+    return base_values
+
+
+def _build_month(
+    cfg: dict,
+    spreadsheet,
+    worksheet,
+    sheet_name: str,
+    excel_path: str,
+    base_values: list[list[str]] | None = None,
+    site_by_date: dict | None = None,
+) -> None:
+    if site_by_date is None:
+        # архивы не меняются — их разбор кэшируется рядом (history/M.YY.xlsx.intervals)
+        is_archive = os.path.basename(os.path.dirname(os.path.abspath(excel_path))) == HISTORY_DIR
+        site_by_date = load_site_by_date(excel_path, cached=cfg["PARSE_CACHE"] and is_archive)
+    if base_values is None and cfg["BASE_READ"] == "narrow":
+        base_values = _read_base_narrow(cfg, spreadsheet, sheet_name, site_by_date)
+    if cfg["INCREMENTAL"]:
+        _build_incremental(cfg, spreadsheet, worksheet, sheet_name, excel_path, site_by_date, base_values)
+        return
+    build_changes_sheet(
+        spreadsheet=spreadsheet,
+        base_ws=worksheet,
+        sheet_name=sheet_name,
+        excel_path=excel_path,
+        render_mode=cfg["RENDER_MODE"],
+        static_colors=cfg["STATIC_COLORS"],
+        site_by_date=site_by_date,
+        base_values=base_values,
+    )
+    # склеенные планировщиком записи — отправить до перехода к следующему месяцу
+    spreadsheet.flush()
+
+
+def _build_incremental(
+    cfg: dict,
+    spreadsheet,
+    worksheet,
+    sheet_name: str,
+    excel_path: str,
+    site_by_date: dict,
+    base_values: list[list[str]] | None = None,
+) -> None:
+    """
+    Пересобирает лист изменений, только если данные сайта или B:L листа
+    месяца изменились с прошлого запуска (по хэшам в STATE_FILE).
+    """
+    if base_values is None:
+        base_values = worksheet.get_values("B:L")
+
+    state = load_state(cfg["STATE_FILE"])
+    entry = state.setdefault(sheet_name, {})
+    site = site_hash(site_by_date)
+    if is_unchanged(entry, site, base_hash(base_values)):
+        print(f"⏭️ Данные за {sheet_name} не менялись с прошлого запуска — лист изменений не трогаем.")
+        return
+
+    filled_values = build_changes_sheet(
+        spreadsheet=spreadsheet,
+        base_ws=worksheet,
+        sheet_name=sheet_name,
+        excel_path=excel_path,
+        render_mode=cfg["RENDER_MODE"],
+        static_colors=cfg["STATIC_COLORS"],
+        site_by_date=site_by_date,
+        base_values=base_values,
+        state=entry,
+    )
+    # состояние сохраняем только после того, как записи реально ушли;
+    # хэш B:L — после дозаполнения, иначе следующий запуск увидит "изменение" от своих же записей
+    spreadsheet.flush()
+    entry["site"] = site
+    entry["base"] = base_hash(filled_values)
+    save_state(cfg["STATE_FILE"], state)
+
+
+def _ensure_archives(cfg: dict, months: list[datetime], history_dir: str) -> dict[str, str]:
+    """
+    M.YY -> history/M.YY.xlsx; недостающие архивы скачиваются одной сессией портала.
+    """
+    labels = [_month_sheet_label(m) for m in months]
+    archives = {label: os.path.join(history_dir, f"{label}.xlsx") for label in labels}
+
+    missing = [label for label in labels if not os.path.exists(archives[label])]
+    for label in labels:
+        if label not in missing:
+            print(f"📦 Используем архив: {archives[label]}")
+
+    if missing:
+        if cfg.get("SKIP_DOWNLOAD"):
+            raise RuntimeError(f"Архивы не найдены: {', '.join(archives[label] for label in missing)}")
+        first_days = {_month_sheet_label(m): _first_day_str(m) for m in months}
+        _download_months(cfg, {first_days[label]: f"{archives[label]}.new" for label in missing})
+        for label in missing:
+            os.replace(f"{archives[label]}.new", archives[label])
+            print(f"📦 Архив сохранён: {archives[label]}")
+    return archives
+
+
+def _read_month_sheets(spreadsheet, labels: list[str]) -> tuple[dict, dict[str, list[list[str]]]]:
+    """
+    Листы таблицы по названию и B:L имеющихся листов месяцев одним values:batchGet.
+    """
+    from sheets_client import batch_get_values
+
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    present = [label for label in labels if label in worksheets]
+    for label in labels:
+        if label not in worksheets:
+            print(f"⚠️ Лист {label} не найден — месяц пропущен.")
+    return worksheets, batch_get_values(spreadsheet, present)
+
+
+def _run_months(cfg: dict, months: list[datetime], history_dir: str) -> None:
+    """
+    Пакетный аудит: архивы history/M.YY.xlsx, недостающие месяцы — одной
+    сессией портала, таблица открывается один раз, листы месяцев читаются
+    одним values:batchGet.
+    """
+    # 1. Недостающие архивы
+    archives = _ensure_archives(cfg, months, history_dir)
+
+    # 2. Google Sheets: одна авторизация и одно чтение всех листов месяцев
+    spreadsheet = _open_spreadsheet(cfg)
+    worksheets, base_by_sheet = _read_month_sheets(spreadsheet, list(archives))
+
+    # 3. Листы "Изменения M.YY"
+    for label, base_values in base_by_sheet.items():
+        print(f"🗓️ Месяц {label}")
+        _build_month(cfg, spreadsheet, worksheets[label], label, archives[label], base_values)
+
+
+def _rollup_title(months: list[datetime]) -> str:
+    if months[0].year == months[-1].year:
+        return f"Сводка {months[0].year}"
+    return f"Сводка {_month_sheet_label(months[0])}-{_month_sheet_label(months[-1])}"
+
+
+def _run_rollup(cfg: dict, months: list[datetime], history_dir: str) -> None:
+    """
+    Сводка за период: разница по дням, месяцам и с начала периода считается
+    локально (архивы history/ + B:L листов месяцев), в таблицу — один лист
+    "Сводка YYYY" одним обновлением. Листы месяцев и изменений не меняются.
+    """
+    from rollup import build_rollup_values, write_rollup
+    from sync_diff import compute_changes
+
+    archives = _ensure_archives(cfg, months, history_dir)
+    spreadsheet = _open_spreadsheet(cfg)
+    worksheets, base_by_sheet = _read_month_sheets(spreadsheet, list(archives))
+
+    started = time.perf_counter()
+    month_rows = []
+    for label, base_values in base_by_sheet.items():
+        site_by_date = load_site_by_date(archives[label], cached=cfg["PARSE_CACHE"])
+        _, changes_rows = compute_changes(site_by_date, base_values)
+        month_rows.append((label, changes_rows))
+
+    title = _rollup_title(months)
+    values = build_rollup_values(title, month_rows)
+    print(f"🧮 Сводка посчитана за {time.perf_counter() - started:.2f} с: месяцев {len(month_rows)}")
+    write_rollup(spreadsheet, worksheets.get(title), title, values)
+    spreadsheet.flush()
+    print(f"✅ Лист '{title}' обновлён. Строк: {len(values)}")
+
+
+def _sync_employee(emp_cfg: dict, sheet_name: str, excel_path: str) -> None:
+    from sheets_client import get_worksheet
+
+    spreadsheet = _open_spreadsheet(emp_cfg)
+    try:
+        worksheet = get_worksheet(spreadsheet, sheet_name)
+    except Exception as exc:
+        raise RuntimeError(f"Лист {sheet_name} не найден.") from exc
+    _build_month(emp_cfg, spreadsheet, worksheet, sheet_name, excel_path)
+
+
+def _run_roster(cfg: dict, roster_file: str, target_month: datetime | None, team_dir: str) -> None:
+    """
+    Аудит команды: выгрузки идут в пуле контекстов одного Chromium
+    (PORTAL_POOL_SIZE), синхронизация таблицы сотрудника стартует сразу
+    после его выгрузки в пуле потоков (SHEETS_WORKERS); квоту Sheets API
+    потоки делят через общий планировщик (SHEETS_READS_PER_MIN/SHEETS_WRITES_PER_MIN).
+    С PORTAL_SESSION_FILE у каждого сотрудника свой кэш сессии (team/<name>_session.json);
+    с PORTAL_FETCHER=http в браузер идут только те, чья HTTP-выгрузка не удалась.
+    """
+    roster = load_roster(roster_file, google_json_file=cfg["GOOGLE_JSON_FILE"])
+    month = target_month or datetime.now()
+    sheet_name = _month_sheet_label(month)
+
+    employees = {}
+    for entry in roster:
+        name = entry["name"]
+        employees[name] = {
+            **cfg,
+            "SITE_USERNAME": entry["site_username"],
+            "SITE_PASSWORD": entry["site_password"],
+            "GSHEET_ID": entry["gsheet_id"],
+            "GOOGLE_JSON_FILE": entry["google_json_file"],
+            "EXCEL_PATH": os.path.join(team_dir, f"{name}.xlsx"),
+            # у каждого своя таблица — и своё состояние инкрементального режима
+            "STATE_FILE": os.path.join(team_dir, f"{name}_state.json"),
+            "PORTAL_SESSION_FILE": os.path.join(team_dir, f"{name}_session.json") if cfg["PORTAL_SESSION_FILE"] else "",
+        }
+
+    errors: dict[str, BaseException] = {}
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, cfg["SHEETS_WORKERS"])) as pool:
+
+        def _on_download(name: str, path: str | None, error: BaseException | None) -> None:
+            if error is not None:
+                errors[name] = error
+                return
+            excel_path = employees[name]["EXCEL_PATH"]
+            if path != excel_path:
+                os.replace(path, excel_path)
+            print(f"📊 Синхронизация таблицы: {name}")
+            futures[name] = pool.submit(_sync_employee, employees[name], sheet_name, excel_path)
+
+        if cfg.get("SKIP_DOWNLOAD"):
+            for name, emp_cfg in employees.items():
+                if os.path.exists(emp_cfg["EXCEL_PATH"]):
+                    _on_download(name, emp_cfg["EXCEL_PATH"], None)
+                else:
+                    errors[name] = RuntimeError(f"Excel не найден: {emp_cfg['EXCEL_PATH']}")
+        else:
+            jobs = {}
+            for name, emp_cfg in employees.items():
+                job = {
+                    "site_username": emp_cfg["SITE_USERNAME"],
+                    "site_password": emp_cfg["SITE_PASSWORD"],
+                    "first_day": _first_day_str(month),
+                    "excel_path": f"{emp_cfg['EXCEL_PATH']}.new",
+                    "session_file": emp_cfg["PORTAL_SESSION_FILE"],
+                }
+                if cfg["PORTAL_FETCHER"] == "http" and _download_http(emp_cfg, job["excel_path"], job["first_day"]):
+                    _on_download(name, job["excel_path"], None)
+                    continue
+                jobs[name] = job
+
+            if jobs:
+                import asyncio
+
+                from ylm_portal_async import download_excel_pool
+
+                asyncio.run(
+                    download_excel_pool(jobs, headless=cfg["HEADLESS"], pool_size=cfg["PORTAL_POOL_SIZE"], on_download=_on_download)
+                )
+
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as exc:
+                print(f"❌ Синхронизация не удалась ({name}): {exc}")
+                errors[name] = exc
+
+    print(f"👥 Сотрудников: {len(employees)}, успешно: {len(employees) - len(errors)}")
+    if errors:
+        raise RuntimeError(f"Не удалось обработать: {', '.join(sorted(errors))}")
+
+
+def _excel_target(cfg: dict, target_month: datetime | None, sheet_name: str, history_dir: str) -> tuple[str, bool]:
+    """
+    Путь к Excel для одного месяца и нужно ли его скачивать.
+    """
+    if target_month:
+        excel_path = os.path.join(history_dir, f"{sheet_name}.xlsx")
+        if os.path.exists(excel_path):
+            print(f"📦 Используем архив: {excel_path}")
+            return excel_path, False
+        if cfg.get("SKIP_DOWNLOAD"):
+            raise RuntimeError(f"Архив за {sheet_name} не найден: {excel_path}")
+        return excel_path, True
+
+    excel_path = cfg["EXCEL_PATH"]
+    if cfg.get("SKIP_DOWNLOAD"):
+        print(f"⏭️ SKIP_DOWNLOAD=1 — используем локальный Excel: {excel_path}")
+        return excel_path, False
+
+    prev_month = datetime.now().replace(day=1)
+    prev_month = prev_month.replace(month=12, year=prev_month.year - 1) if prev_month.month == 1 else prev_month.replace(month=prev_month.month - 1)
+    prev_label = _month_sheet_label(prev_month)
+    prev_archive = os.path.join(history_dir, f"{prev_label}.xlsx")
+    if os.path.exists(excel_path) and not os.path.exists(prev_archive):
+        shutil.copy2(excel_path, prev_archive)
+        print(f"🗂️ Архив за прошлый месяц: {prev_archive}")
+    return excel_path, True
+
+
+async def _timed(stages: dict[str, float], name: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        stages[name] = time.perf_counter() - started
+
+
+async def _download_async(cfg: dict, excel_path: str, first_day: str | None) -> None:
+    import asyncio
+
+    temp_path = f"{excel_path}.new"
+    if cfg["PORTAL_FETCHER"] == "http" or cfg["MANUAL_PORTAL"]:
+        # HTTP-выгрузка и ручной режим — синхронные, уводим в поток
+        await asyncio.to_thread(_download, cfg, temp_path, first_day)
+    else:
+        from ylm_portal_async import download_excel_async
+
+        await download_excel_async(
+            cfg["SITE_USERNAME"],
+            cfg["SITE_PASSWORD"],
+            first_day or _first_day_str(datetime.now()),
+            temp_path,
+            headless=cfg["HEADLESS"],
+            session_file=cfg["PORTAL_SESSION_FILE"],
+        )
+    os.replace(temp_path, excel_path)
+
+
+async def _prepare_sheets(cfg: dict, sheet_name: str):
+    """
+    Авторизация, лист месяца и его B:L — от выгрузки не зависят.
+    При BASE_READ=narrow B:L не читается: узкое чтение по датам выгрузки
+    делает _build_month, когда выгрузка готова.
+    """
+    import asyncio
+
+    from sheets_client import get_worksheet
+
+    spreadsheet = await asyncio.to_thread(_open_spreadsheet, cfg)
+    try:
+        worksheet = await asyncio.to_thread(get_worksheet, spreadsheet, sheet_name)
+    except Exception as exc:
+        raise RuntimeError(f"Лист {sheet_name} не найден.") from exc
+    if cfg["BASE_READ"] == "narrow":
+        return spreadsheet, worksheet, None
+    base_values = await asyncio.to_thread(worksheet.get_values, "B:L")
+    return spreadsheet, worksheet, base_values
+
+
+async def _run_async(cfg: dict, sheet_name: str, excel_path: str, need_download: bool, first_day: str | None) -> None:
+    """
+    Выгрузка Excel и подготовка Google Sheets идут одновременно:
+    критический путь — max(выгрузка, таблица), а не их сумма.
+    """
+    import asyncio
+
+    stages: dict[str, float] = {}
+    started = time.perf_counter()
+
+    prepare = _timed(stages, "таблица", _prepare_sheets(cfg, sheet_name))
+    if need_download:
+        _, (spreadsheet, worksheet, base_values) = await asyncio.gather(
+            _timed(stages, "выгрузка", _download_async(cfg, excel_path, first_day)), prepare
+        )
+    else:
+        spreadsheet, worksheet, base_values = await prepare
+
+    await _timed(
+        stages,
+        "лист изменений",
+        asyncio.to_thread(_build_month, cfg, spreadsheet, worksheet, sheet_name, excel_path, base_values),
+    )
+
+    total = time.perf_counter() - started
+    report = ", ".join(f"{name} {seconds:.1f} с" for name, seconds in stages.items())
+    print(f"⏱️ Этапы: {report}; итого {total:.1f} с (последовательно: {sum(stages.values()):.1f} с)")
+
+
+def _open_portal(cfg: dict, stack: ExitStack):
+    """
+    Долгоживущий источник выгрузок для --watch (export(first_day, excel_path)):
+    HTTP-клиент при PORTAL_FETCHER=http, иначе (или если рецепт не загрузился) —
+    залогиненная сессия браузера. Закрывается вместе со stack.
+    """
+    http_mode = cfg["PORTAL_FETCHER"] == "http"
+    if http_mode:
+        try:
+            from ylm_http import HttpPortalClient
+
+            return stack.enter_context(
+                HttpPortalClient(
+                    cfg["HTTP_RECIPE_FILE"],
+                    session_file=cfg["PORTAL_SESSION_FILE"],
+                    base_url=cfg["PORTAL_BASE_URL"],
+                )
+            )
+        except Exception as exc:
+            print(f"⚠️ HTTP-выгрузка недоступна ({exc}) — открываю браузер.")
+
+    from ylm_portal import PortalSession
+
+    return stack.enter_context(
+        PortalSession(
+            cfg["SITE_USERNAME"],
+            cfg["SITE_PASSWORD"],
+            headless=cfg["HEADLESS"],
+            session_file=cfg["PORTAL_SESSION_FILE"],
+            recipe_file=cfg["HTTP_RECIPE_FILE"] if http_mode else "",
+        )
+    )
+
+
+class _ExportFailed(RuntimeError):
+    """
+    Опрос --watch упал на выгрузке (а не на таблице) — сессию портала нужно пересоздать.
+    """
+
+
+def _watch_tick(cfg: dict, portal, spreadsheet, history_dir: str, last: dict) -> None:
+    """
+    Один опрос: выгрузка текущего месяца, хэш разобранных данных и синхронизация,
+    только если он изменился. last — {"sheet", "worksheet", "site"} прошлого опроса.
+    """
+    from sheets_client import get_worksheet, month_sheet_name
+
+    sheet_name = month_sheet_name()
+    excel_path, need_download = _excel_target(cfg, None, sheet_name, history_dir)
+    if need_download:
+        temp_path = f"{excel_path}.new"
+        try:
+            portal.export(_first_day_str(datetime.now()), temp_path)
+        except Exception as exc:
+            raise _ExportFailed(f"выгрузка: {exc}") from exc
+        os.replace(temp_path, excel_path)
+
+    # xlsx при каждом экспорте отличается байтами — сравниваем разобранные данные
+    site_by_date = load_site_by_date(excel_path)
+    site = site_hash(site_by_date)
+    if last.get("sheet") == sheet_name and last.get("site") == site:
+        print(f"⏭️ Выгрузка за {sheet_name} не изменилась — синхронизация не нужна.")
+        return
+
+    if last.get("sheet") != sheet_name:
+        try:
+            last["worksheet"] = get_worksheet(spreadsheet, sheet_name)
+        except Exception as exc:
+            raise RuntimeError(f"Лист {sheet_name} не найден.") from exc
+        last["sheet"] = sheet_name
+    _build_month(cfg, spreadsheet, last["worksheet"], sheet_name, excel_path, site_by_date=site_by_date)
+    last["site"] = site
+    print(f"🔄 Лист изменений за {sheet_name} синхронизирован ({datetime.now().strftime('%H:%M:%S')}).")
+
+
+def _watch_recover(exc: Exception, spreadsheet) -> bool:
+    """
+    После неудачного опроса: отложенные записи опроса отправляются (или отбрасываются,
+    если не уходят), чтобы следующий опрос начинался с чистой таблицы.
+    True — упала выгрузка, сессию портала нужно пересоздать.
+    """
+    try:
+        spreadsheet.flush()
+    except Exception:
+        pass
+    return isinstance(exc, _ExportFailed)
+
+
+def _run_watch(cfg: dict, history_dir: str) -> None:
+    """
+    Демон: одна сессия портала и одна авторизованная таблица на всё время работы,
+    выгрузка текущего месяца раз в WATCH_INTERVAL_S. Ошибка опроса не останавливает
+    демон; если упала выгрузка — сессия портала пересоздаётся к следующему опросу.
+    Остановка — Ctrl+C.
+    """
+    if cfg["MANUAL_PORTAL"]:
+        raise RuntimeError("--watch не работает с MANUAL_PORTAL=1")
+
+    interval = max(cfg["WATCH_INTERVAL_S"], 1.0)
+    spreadsheet = _open_spreadsheet(cfg)
+    last: dict = {}
+    stack = ExitStack()
+    portal = None
+    print(f"👀 Наблюдение за выгрузкой: каждые {interval:.0f} с (Ctrl+C — остановить)")
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                if portal is None and not cfg["SKIP_DOWNLOAD"]:
+                    portal = _open_portal(cfg, stack)
+                _watch_tick(cfg, portal, spreadsheet, history_dir, last)
+            except Exception as exc:
+                print(f"⚠️ Опрос не удался ({exc}) — повтор через {interval:.0f} с.")
+                if _watch_recover(exc, spreadsheet) or portal is None:
+                    stack.close()
+                    portal = None
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        print("🛑 Наблюдение остановлено.")
+    finally:
+        stack.close()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
-    parser.add_argument("--month", help="Аудит за месяц в формате M.YY (например 12.25)")
+    months_group = parser.add_mutually_exclusive_group()
+    months_group.add_argument("--month", help="Аудит за месяц в формате M.YY (например 12.25)")
+    months_group.add_argument("--months", help="Аудит за диапазон месяцев M.YY-M.YY (например 1.25-12.25)")
+    months_group.add_argument("--rollup", help="Сводка разницы за диапазон месяцев M.YY-M.YY в лист 'Сводка YYYY'")
+    parser.add_argument("--roster", help="Аудит команды по файлу ростера (JSON, см. roster.py)")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Выгрузка Excel параллельно с подготовкой Google Sheets",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Демон: выгружать текущий месяц раз в WATCH_INTERVAL_S и синхронизировать только изменения",
+    )
     args = parser.parse_args()
+    if args.roster and args.months:
+        parser.error("--roster нельзя совмещать с --months")
+    if args.roster and args.rollup:
+        parser.error("--roster нельзя совмещать с --rollup")
+    if args.use_async and (args.roster or args.months or args.rollup):
+        parser.error("--async — только для одного месяца")
+    if args.watch and (args.roster or args.month or args.months or args.rollup or args.use_async):
+        parser.error("--watch — только для текущего месяца, без других режимов")
+
+    cfg = load_config(require_site=not args.roster)
 
-    cfg = load_config()
+    if args.roster:
+        team_dir = "team"
+        os.makedirs(team_dir, exist_ok=True)
+        _run_roster(cfg, args.roster, _parse_month_arg(args.month) if args.month else None, team_dir)
+        _done(cfg)
+        return
+
+    history_dir = HISTORY_DIR
+    if args.months:
+        os.makedirs(history_dir, exist_ok=True)
+        _run_months(cfg, _parse_months_arg(args.months), history_dir)
+        _done(cfg)
+        return
+
+    if args.rollup:
+        os.makedirs(history_dir, exist_ok=True)
+        _run_rollup(cfg, _parse_months_arg(args.rollup), history_dir)
+        _done(cfg)
+        return
+
+    if args.watch:
+        os.makedirs(history_dir, exist_ok=True)
+        _run_watch(cfg, history_dir)
+        _done(cfg)
+        return
+
+    from sheets_client import get_worksheet, month_sheet_name
 
     target_month = _parse_month_arg(args.month) if args.month else None
     sheet_name = _month_sheet_label(target_month) if target_month else month_sheet_name()
     first_day = _first_day_str(target_month) if target_month else None
 
     # 1. Получаем Excel
-    history_dir = "history"
     os.makedirs(history_dir, exist_ok=True)
+    excel_path, need_download = _excel_target(cfg, target_month, sheet_name, history_dir)
 
-    if target_month:
-        excel_path = os.path.join(history_dir, f"{sheet_name}.xlsx")
-        if os.path.exists(excel_path):
-            print(f"📦 Используем архив: {excel_path}")
-        elif cfg.get("SKIP_DOWNLOAD"):
-            raise RuntimeError(f"Архив за {sheet_name} не найден: {excel_path}")
-        else:
-            temp_path = f"{excel_path}.new"
-            download_excel(
-                site_username=cfg["SITE_USERNAME"],
-                site_password=cfg["SITE_PASSWORD"],
-                excel_path=temp_path,
-                headless=cfg["HEADLESS"],
-                first_day=first_day,
-                manual_portal=cfg["MANUAL_PORTAL"],
-                manual_download_timeout_ms=cfg["MANUAL_DOWNLOAD_TIMEOUT_MS"],
-            )
-            os.replace(temp_path, excel_path)
+    if args.use_async:
+        import asyncio
+
+        asyncio.run(_run_async(cfg, sheet_name, excel_path, need_download, first_day))
+        _done(cfg)
+        return
+
+    if need_download:
+        temp_path = f"{excel_path}.new"
+        _download(cfg, temp_path, first_day)
+        os.replace(temp_path, excel_path)
+        if target_month:
             print(f"📦 Архив сохранён: {excel_path}")
-    else:
-        if cfg.get("SKIP_DOWNLOAD"):
-            excel_path = cfg["EXCEL_PATH"]
-            print(f"⏭️ SKIP_DOWNLOAD=1 — используем локальный Excel: {excel_path}")
-        else:
-            excel_path = cfg["EXCEL_PATH"]
-            temp_path = f"{excel_path}.new"
-
-            prev_month = datetime.now().replace(day=1)
-            prev_month = prev_month.replace(month=12, year=prev_month.year - 1) if prev_month.month == 1 else prev_month.replace(month=prev_month.month - 1)
-            prev_label = _month_sheet_label(prev_month)
-            prev_archive = os.path.join(history_dir, f"{prev_label}.xlsx")
-            if os.path.exists(excel_path) and not os.path.exists(prev_archive):
-                shutil.copy2(excel_path, prev_archive)
-                print(f"🗂️ Архив за прошлый месяц: {prev_archive}")
-
-            download_excel(
-                site_username=cfg["SITE_USERNAME"],
-                site_password=cfg["SITE_PASSWORD"],
-                excel_path=temp_path,
-                headless=cfg["HEADLESS"],
-                first_day=first_day,
-                manual_portal=cfg["MANUAL_PORTAL"],
-                manual_download_timeout_ms=cfg["MANUAL_DOWNLOAD_TIMEOUT_MS"],
-            )
-            os.replace(temp_path, excel_path)
 
     # 2. Открываем Google Sheets
-    spreadsheet = open_spreadsheet(
-        gsheet_id=cfg["GSHEET_ID"],
-        google_json_file=cfg["GOOGLE_JSON_FILE"],
-    )
+    spreadsheet = _open_spreadsheet(cfg)
 
     # 3. Получаем основной лист месяца (эталон)
     try:
@@ -103,14 +768,9 @@ def main() -> None:
         raise RuntimeError(f"Лист {sheet_name} не найден.") from exc
 
     # 4. Строим лист "Изменения M.YY"
-    changes_found = build_changes_sheet(
-        spreadsheet=spreadsheet,
-        base_ws=worksheet,
-        sheet_name=sheet_name,
-        excel_path=excel_path,
-    )
+    _build_month(cfg, spreadsheet, worksheet, sheet_name, excel_path)
 
-    print("✅ Готово")
+    _done(cfg)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,129 @@
-from datetime import datetime
-from typing import Optional
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
 
 import gspread
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
+from gspread.utils import fill_gaps
 
+from sheets_quota import RateLimiter, throttled_http_client
+from sync_state import content_hash
 
-def open_spreadsheet(gsheet_id: str, google_json_file: str):
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_file(google_json_file, scopes=scopes)
-    client = gspread.authorize(creds)
-    return client.open_by_key(gsheet_id)
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# Клиенты gspread на процесс: (сервисный аккаунт, limiter) -> Client.
+# У каждого клиента своя AuthorizedSession (пул keep-alive соединений),
+# токен обновляется в ней же, когда истекает.
+_CLIENTS: dict[tuple[str, int], gspread.Client] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Токен, до истечения которого осталось меньше, в файловый кэш не берём
+_TOKEN_MARGIN_S = 300
+
+
+def _account_key(info: dict) -> str:
+    return f"{info.get('client_email', '')}/{info.get('private_key_id', '')}"
+
+
+def _read_token_cache(token_cache: str) -> dict:
+    if not token_cache or not os.path.exists(token_cache):
+        return {}
+    try:
+        with open(token_cache, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _restore_token(creds: Credentials, token_cache: str, key: str) -> bool:
+    """
+    Подставляет в creds токен из файлового кэша, если он ещё действует.
+    """
+    entry = _read_token_cache(token_cache).get(key) or {}
+    try:
+        expiry = datetime.fromtimestamp(float(entry["expiry"]), timezone.utc).replace(tzinfo=None)
+    except (KeyError, TypeError, ValueError):
+        return False
+    if (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() < _TOKEN_MARGIN_S:
+        return False
+    creds.token = entry.get("token")
+    creds.expiry = expiry
+    return bool(creds.token)
+
+
+def _save_token(creds: Credentials, token_cache: str, key: str) -> None:
+    """
+    Токен сервисного аккаунта в файл (только для владельца) — следующие
+    короткие запуски обойдутся без обмена ключа на токен.
+    """
+    if not token_cache or not creds.token or creds.expiry is None:
+        return
+    data = _read_token_cache(token_cache)
+    data[key] = {"token": creds.token, "expiry": creds.expiry.replace(tzinfo=timezone.utc).timestamp()}
+    temp_path = f"{token_cache}.new"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, token_cache)
+
+
+def authorized_client(
+    info: dict,
+    limiter: Optional[RateLimiter] = None,
+    token_cache: str = "",
+) -> gspread.Client:
+    """
+    Клиент gspread для сервисного аккаунта (info — содержимое ключа JSON),
+    один на процесс для пары (аккаунт, limiter): повторные вызовы и другие
+    таблицы идут через те же соединения и тот же токен.
+    token_cache — файл с токенами между запусками (пусто — не использовать).
+    """
+    key = _account_key(info)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get((key, id(limiter)))
+        if client is not None:
+            return client
+
+        creds = Credentials.from_service_account_info(info, scopes=SCOPES)
+        if token_cache and not _restore_token(creds, token_cache, key):
+            creds.refresh(Request())
+            _save_token(creds, token_cache, key)
+        if limiter is None:
+            client = gspread.authorize(creds)
+        else:
+            # limiter живёт, пока жив клиент (на него ссылается http_client), — id не переиспользуется
+            client = gspread.authorize(creds, http_client=throttled_http_client(limiter))
+        _CLIENTS[(key, id(limiter))] = client
+        return client
+
+
+def open_spreadsheet(
+    gsheet_id: str,
+    google_json_file: str,
+    limiter: Optional[RateLimiter] = None,
+    backend: str = "google",
+    fake_file: str = "",
+    token_cache: str = "",
+):
+    """
+    limiter — общий ограничитель частоты запросов (несколько таблиц из разных потоков).
+    backend="fake" — таблица в памяти (fake_sheets), без сети и учётных данных.
+    token_cache — файловый кэш токена (см. authorized_client).
+    """
+    if backend == "fake":
+        from fake_sheets import open_fake_spreadsheet
+
+        return open_fake_spreadsheet(gsheet_id, fake_file)
+    if backend != "google":
+        raise RuntimeError(f"Неизвестный SHEETS_BACKEND: {backend}")
+
+    with open(google_json_file, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    return authorized_client(info, limiter=limiter, token_cache=token_cache).open_by_key(gsheet_id)
 
 
 def month_sheet_name(now: Optional[datetime] = None) -> str:
@@ -23,3 +137,87 @@ def month_sheet_name(now: Optional[datetime] = None) -> str:
 
 def get_worksheet(spreadsheet, sheet_name: str):
     return spreadsheet.worksheet(sheet_name)
+
+
+def batch_get_values(spreadsheet, sheet_names: list[str], a1: str = "B:L") -> dict[str, list[list[str]]]:
+    """
+    Один и тот же диапазон сразу с нескольких листов — одним запросом values:batchGet.
+    Строки дополняются до прямоугольника, как в Worksheet.get_values.
+    """
+    if not sheet_names:
+        return {}
+    ranges = [f"'{name}'!{a1}" for name in sheet_names]
+    response = spreadsheet.values_batch_get(ranges)
+    return {
+        name: fill_gaps(value_range.get("values", []))
+        for name, value_range in zip(sheet_names, response.get("valueRanges", []))
+    }
+
+
+def _column_index(column_b: list[list[str]]) -> dict[str, int]:
+    """
+    Текст даты в B -> номер строки (1-based). Как в sync_diff.index_base:
+    пустые пропускаются, при повторе даты побеждает последняя строка.
+    """
+    index = {}
+    for idx, row in enumerate(column_b):
+        date_cell = str(row[0]).strip() if row else ""
+        if date_cell:
+            index[date_cell] = idx + 1
+    return index
+
+
+def read_base_rows(spreadsheet, sheet_name: str, dates: Iterable[str], cache: dict) -> list[list[str]]:
+    """
+    Узкое чтение листа месяца: только B и C:D, K:L строк с датами из dates.
+
+    cache — индекс из прошлого запуска {"b_hash": ..., "rows": {дата: строка}},
+    обновляется на месте. Столбец B читается всегда (он узкий) в том же
+    values:batchGet, что и строки по закэшированному индексу; если B изменился —
+    индекс пересобирается и нужные строки дочитываются вторым запросом.
+
+    Возвращает строки в форме B:L (как get_values("B:L")): позиции строк
+    сохранены, строки вне нужного диапазона — пустые.
+    """
+    prefix = f"'{sheet_name}'!"
+    wanted = set(dates)
+
+    def _span(index: dict[str, int]) -> tuple[int, int] | None:
+        rows = [row for date_text, row in index.items() if date_text in wanted]
+        return (min(rows), max(rows)) if rows else None
+
+    def _span_ranges(span: tuple[int, int]) -> list[str]:
+        r0, r1 = span
+        return [f"{prefix}C{r0}:D{r1}", f"{prefix}K{r0}:L{r1}"]
+
+    span = _span(cache.get("rows", {})) if cache.get("b_hash") else None
+    ranges = [f"{prefix}B:B"] + (_span_ranges(span) if span else [])
+    value_ranges = spreadsheet.values_batch_get(ranges).get("valueRanges", [])
+    column_b = value_ranges[0].get("values", []) if value_ranges else []
+
+    b_hash = content_hash(column_b)
+    if b_hash != cache.get("b_hash"):
+        cache["b_hash"] = b_hash
+        cache["rows"] = _column_index(column_b)
+        span = _span(cache["rows"])
+        value_ranges = value_ranges[:1]
+        if span:
+            print(f"🗂️ Индекс дат листа {sheet_name} обновлён (строк с датами: {len(cache['rows'])})")
+            value_ranges += spreadsheet.values_batch_get(_span_ranges(span)).get("valueRanges", [])
+
+    if not span:
+        return []
+    r0, r1 = span
+    main = value_ranges[1].get("values", []) if len(value_ranges) > 1 else []
+    bonus = value_ranges[2].get("values", []) if len(value_ranges) > 2 else []
+
+    def _pair(rows: list[list[str]], offset: int) -> list[str]:
+        row = rows[offset] if offset < len(rows) else []
+        return (list(row) + ["", ""])[:2]
+
+    base_values: list[list[str]] = [[] for _ in range(r0 - 1)]
+    for row_num in range(r0, r1 + 1):
+        offset = row_num - r0
+        date_cell = column_b[row_num - 1][0] if row_num - 1 < len(column_b) and column_b[row_num - 1] else ""
+        base_values.append([date_cell] + _pair(main, offset) + [""] * 6 + _pair(bonus, offset))
+    return base_values
@@ -0,0 +1,403 @@
+"""
+Ограничение частоты запросов к Google Sheets API.
+
+Квота Sheets API считается на сервисный аккаунт (запросов в минуту), поэтому
+при синхронизации нескольких таблиц из разных потоков все клиенты должны
+делить один RateLimiter.
+
+SheetsScheduler — обёртка над Spreadsheet/Worksheet gspread: отдельные
+token bucket на чтения и записи, склейка соседних записей, повтор 429/5xx
+с экспоненциальной задержкой и счётчики.
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+
+class RateLimiter:
+    """
+    Token bucket: rate_per_minute запросов в минуту, до burst запросов подряд.
+    Потокобезопасен.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int | None = None):
+        if rate_per_minute <= 0:
+            raise RuntimeError("Лимит запросов в минуту должен быть больше нуля")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(rate_per_minute // 6)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Забирает один токен, при необходимости ждёт. Возвращает время ожидания (с).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # долг в токенах = очередь; ждём вне блокировки
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def throttled_http_client(limiter: RateLimiter) -> type[HTTPClient]:
+    """
+    HTTP-клиент gspread, который перед каждым запросом берёт токен у limiter.
+    Передаётся в gspread.authorize(creds, http_client=...).
+    """
+
+    class ThrottledHTTPClient(HTTPClient):
+        def request(self, *args, **kwargs):
+            limiter.acquire()
+            return super().request(*args, **kwargs)
+
+    return ThrottledHTTPClient
+
+
+_RETRY_CODES = {429, 500, 502, 503, 504}
+
+# Методы gspread, которые только читают (остальные считаются записью)
+_READ_METHODS = {
+    "worksheet",
+    "worksheets",
+    "fetch_sheet_metadata",
+    "values_batch_get",
+    "values_get",
+    "get_values",
+    "get_all_values",
+    "get",
+    "batch_get",
+    "col_values",
+    "row_values",
+    "acell",
+    "cell",
+}
+
+
+# Записи, повтор которых после 5xx (запрос мог уже выполниться) задвоил бы
+# результат: лишний лист, строки, правило или удаление не того индекса
+_NON_IDEMPOTENT_METHODS = {
+    "add_worksheet",
+    "del_worksheet",
+    "duplicate_sheet",
+    "append_row",
+    "append_rows",
+    "insert_row",
+    "insert_rows",
+    "insert_cols",
+    "delete_rows",
+    "delete_columns",
+    "add_rows",
+    "add_cols",
+    "values_append",
+}
+_NON_IDEMPOTENT_REQUESTS = {
+    "addSheet",
+    "deleteSheet",
+    "duplicateSheet",
+    "insertDimension",
+    "deleteDimension",
+    "appendDimension",
+    "moveDimension",
+    "insertRange",
+    "deleteRange",
+    "appendCells",
+    "addConditionalFormatRule",
+    "deleteConditionalFormatRule",
+}
+
+
+def _requests_idempotent(requests_list: list[dict]) -> bool:
+    return not any(kind in _NON_IDEMPOTENT_REQUESTS for request in requests_list for kind in request)
+
+
+def _retry_after(exc: Exception) -> float | None:
+    response = getattr(exc, "response", None)
+    raw = response.headers.get("Retry-After") if response is not None and response.headers else None
+    try:
+        return float(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(exc: Exception, idempotent: bool = True) -> bool:
+    """
+    429 — запрос отклонён до выполнения, его можно повторить всегда; 5xx и
+    обрыв соединения — только для чтений и идемпотентных записей.
+    """
+    if isinstance(exc, APIError):
+        return exc.code == 429 or (idempotent and exc.code in _RETRY_CODES)
+    return idempotent and isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class SheetsScheduler:
+    """
+    Общий планировщик запросов к Sheets API (можно делить между потоками).
+
+        scheduler = SheetsScheduler(reads_per_min=60, writes_per_min=60)
+        spreadsheet = scheduler.wrap(open_spreadsheet(...))
+        ...
+        spreadsheet.flush()
+        print(scheduler.report())
+
+    Записи (update/batch_update/batch_format/format) не уходят сразу: идущие
+    подряд записи в один лист склеиваются в один values.batchUpdate (на каждый
+    valueInputOption) и один batch_format, идущие подряд spreadsheet.batch_update —
+    в один batchUpdate. Накопленное отправляется перед любым чтением, перед
+    записью в другой лист или другого вида и в flush().
+    Ошибка такой записи поэтому всплывает при отправке, а не в месте вызова:
+    в flush() — как есть, при неявной отправке перед другим вызовом — как
+    DeferredWriteError (один раз; следующие вызовы таблицы уже не затронуты).
+    Записи этапа стоит отправлять явным flush() в его конце.
+    """
+
+    def __init__(
+        self,
+        reads_per_min: float = 60,
+        writes_per_min: float = 60,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 64.0,
+    ):
+        self.buckets = {"read": RateLimiter(reads_per_min), "write": RateLimiter(writes_per_min)}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = Counter()
+        self.lock = threading.Lock()
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self.lock:
+            self.metrics[key] += value
+
+    def call(self, kind: str, fn, *args, idempotent: bool = True, **kwargs):
+        """
+        Вызов API с токеном нужного вида и повтором 429/5xx (full jitter,
+        Retry-After, если сервер его прислал). idempotent=False — запись,
+        которую после 5xx повторять нельзя (повторяется только 429).
+        """
+        for attempt in range(self.max_retries + 1):
+            waited = self.buckets[kind].acquire()
+            self._count(f"{kind}s")
+            self._count("quota_wait_s", waited)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.max_retries or not _is_retryable(exc, idempotent):
+                    self._count("errors")
+                    raise
+                delay = _retry_after(exc)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                self._count("retries")
+                self._count("backoff_s", delay)
+                print(f"🔁 Sheets API: {exc} — повтор через {delay:.1f} с")
+                time.sleep(delay)
+
+    def wrap(self, spreadsheet) -> "ScheduledSpreadsheet":
+        if isinstance(spreadsheet, ScheduledSpreadsheet):
+            return spreadsheet
+        return ScheduledSpreadsheet(self, spreadsheet)
+
+    def report(self) -> str:
+        m = self.metrics
+        return (
+            f"📈 Sheets API: чтений {m['reads']}, записей {m['writes']}, "
+            f"склеено вызовов {m['coalesced']}, повторов {m['retries']}, "
+            f"ожидание квоты {m['quota_wait_s']:.1f} с, паузы повторов {m['backoff_s']:.1f} с"
+        )
+
+
+class DeferredWriteError(RuntimeError):
+    """
+    Отложенная запись не ушла при неявной отправке перед другим вызовом
+    (сам вызов не выполнялся). Исходная ошибка — в __cause__.
+    """
+
+
+class ScheduledSpreadsheet:
+    """
+    Spreadsheet gspread через SheetsScheduler. Атрибуты и прочие методы —
+    как у исходного объекта.
+    """
+
+    def __init__(self, scheduler: SheetsScheduler, spreadsheet):
+        self._scheduler = scheduler
+        self._inner = spreadsheet
+        self._pending = None  # (лист, {вид записи: ([исходные вызовы], склеенные данные)})
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._inner, name)
+        if not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            self._send_pending()
+            kind = "read" if name in _READ_METHODS else "write"
+            idempotent = name not in _NON_IDEMPOTENT_METHODS
+            return self._wrap_result(self._scheduler.call(kind, attr, *args, idempotent=idempotent, **kwargs))
+
+        return _call
+
+    def _wrap_result(self, result):
+        if isinstance(result, list):
+            return [self._wrap_result(item) for item in result]
+        if hasattr(result, "get_values") and hasattr(result, "batch_format"):
+            return ScheduledWorksheet(self, result)
+        return result
+
+    def _defer(self, target, part: str, thunk, payload: list) -> None:
+        """
+        target — лист (значения и форматы) или None (spreadsheet.batch_update).
+        part — "values:<valueInputOption>", "formats" или "requests".
+        """
+        if self._pending is not None and (
+            self._pending[0] is not target
+            # значения с другим valueInputOption — только в исходном порядке
+            or any(p.startswith("values:") and p != part for p in self._pending[1] if part.startswith("values:"))
+        ):
+            self._send_pending()
+        if self._pending is None:
+            self._pending = (target, {})
+        thunks, data = self._pending[1].setdefault(part, ([], []))
+        thunks.append(thunk)
+        data.extend(payload)
+
+    def _send_pending(self) -> None:
+        """
+        Неявная отправка перед другим вызовом. Накопленное при ошибке отбрасывается
+        (как и при ошибке flush()), так что таблица остаётся пригодной для следующих вызовов.
+        """
+        try:
+            self._send()
+        except Exception as exc:
+            raise DeferredWriteError(f"Отложенная запись в Google Sheets не удалась: {exc}") from exc
+
+    def flush(self) -> None:
+        """
+        Отправляет накопленные записи (ошибка — как есть).
+        """
+        self._send()
+
+    def _send(self) -> None:
+        """
+        По одному вызову на вид записи (значения раньше форматов — форматы значений не меняют).
+        """
+        if self._pending is None:
+            return
+        target, parts = self._pending
+        self._pending = None
+        for part, (thunks, payload) in sorted(parts.items(), key=lambda item: item[0] == "formats"):
+            # значения и форматы идемпотентны, запросы batchUpdate — смотря какие
+            idempotent = part != "requests" or _requests_idempotent(payload)
+            if len(thunks) == 1:
+                self._scheduler.call("write", thunks[0], idempotent=idempotent)
+                continue
+            self._scheduler._count("coalesced", len(thunks) - 1)
+            if part.startswith("values:"):
+                option = part.split(":", 1)[1]
+                self._scheduler.call("write", target.batch_update, payload, value_input_option=option)
+            elif part == "formats":
+                self._scheduler.call("write", target.batch_format, payload)
+            else:
+                self._scheduler.call("write", self._inner.batch_update, {"requests": payload}, idempotent=idempotent)
+
+    def batch_update(self, body: dict):
+        if set(body) != {"requests"}:
+            self._send_pending()
+            return self._scheduler.call(
+                "write", self._inner.batch_update, body, idempotent=_requests_idempotent(body.get("requests", []))
+            )
+        self._defer(None, "requests", lambda: self._inner.batch_update(body), body["requests"])
+
+
+class ScheduledWorksheet:
+    """
+    Worksheet gspread через SheetsScheduler (записи копятся в ScheduledSpreadsheet).
+    """
+
+    def __init__(self, spreadsheet: ScheduledSpreadsheet, worksheet):
+        self._spreadsheet = spreadsheet
+        self._inner = worksheet
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._inner, name)
+        if not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            self._spreadsheet._send_pending()
+            kind = "read" if name in _READ_METHODS else "write"
+            idempotent = name not in _NON_IDEMPOTENT_METHODS
+            return self._spreadsheet._scheduler.call(kind, attr, *args, idempotent=idempotent, **kwargs)
+
+        return _call
+
+    def update(self, range_name, values=None, value_input_option=None, **kwargs):
+        if values is None or kwargs or not isinstance(range_name, str):
+            self._spreadsheet._send_pending()
+            return self._spreadsheet._scheduler.call(
+                "write", self._inner.update, range_name, values, value_input_option=value_input_option, **kwargs
+            )
+        self._spreadsheet._defer(
+            self._inner,
+            f"values:{value_input_option or 'RAW'}",
+            lambda: self._inner.update(range_name, values, value_input_option=value_input_option),
+            [{"range": range_name, "values": values}],
+        )
+
+    def batch_update(self, data: list[dict], value_input_option=None, **kwargs):
+        if kwargs:
+            self._spreadsheet._send_pending()
+            return self._spreadsheet._scheduler.call(
+                "write", self._inner.batch_update, data, value_input_option=value_input_option, **kwargs
+            )
+        self._spreadsheet._defer(
+            self._inner,
+            f"values:{value_input_option or 'RAW'}",
+            lambda: self._inner.batch_update(data, value_input_option=value_input_option),
+            list(data),
+        )
+
+    def batch_format(self, formats: list[dict]):
+        self._spreadsheet._defer(self._inner, "formats", lambda: self._inner.batch_format(formats), list(formats))
+
+    def format(self, ranges, format: dict):
+        if not isinstance(ranges, str):
+            self._spreadsheet._send_pending()
+            return self._spreadsheet._scheduler.call("write", self._inner.format, ranges, format)
+        self._spreadsheet._defer(
+            self._inner,
+            "formats",
+            lambda: self._inner.format(ranges, format),
+            [{"range": ranges, "format": format}],
+        )
+
+
+_SHARED: dict[tuple, SheetsScheduler] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_scheduler(reads_per_min: float = 60, writes_per_min: float = 60) -> SheetsScheduler:
+    """
+    Один планировщик на процесс (квота общая для всех таблиц сервисного аккаунта).
+    """
+    key = (reads_per_min, writes_per_min)
+    with _SHARED_LOCK:
+        if key not in _SHARED:
+            _SHARED[key] = SheetsScheduler(reads_per_min, writes_per_min)
+        return _SHARED[key]
@@ -0,0 +1,201 @@
+"""
+Потоковое чтение выгрузки YLM (Excel) без pandas.
+
+openpyxl в режиме read_only читает лист строка за строкой: заголовок
+תאריך / כניסה / יציאה ищется один раз, дальше берутся только эти три ячейки.
+Память не растёт с размером выгрузки, pandas не импортируется.
+
+Разбор значений совпадает с sync_logic.parse_site_frame (путь через pd.read_excel):
+время оба пути разбирают через sync_diff.parse_minutes, текстовые даты — через
+parse_date_text, нестандартные отдаются pandas (импорт только в этом случае).
+
+Для архивов history/M.YY.xlsx разобранные интервалы кэшируются рядом с файлом
+(M.YY.xlsx.intervals, ключ — версия разбора и SHA-256 xlsx): повторный аудит
+Excel не разбирает.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import struct
+from datetime import date, datetime
+from typing import Iterator
+
+from sync_diff import Interval, parse_minutes
+
+SITE_COLUMNS = ["תאריך", "כניסה", "יציאה"]
+
+# Заголовок ищется в первых строках листа
+HEADER_SCAN_ROWS = 20
+
+_DAY_FIRST_RE = re.compile(r"^(\d{1,2})[./-](\d{1,2})[./-](\d{4})$")
+# Год впереди — всегда год-месяц-день (pandas с dayfirst=True прочёл бы 2025-01-05 как 1 мая)
+_ISO_RE = re.compile(r"^(\d{4})[./-](\d{1,2})[./-](\d{1,2})$")
+
+
+def iter_site_cells(excel_path: str) -> Iterator[tuple]:
+    """
+    (дата, вход, выход) — сырые значения ячеек первого листа под заголовком.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        positions = None
+        for _, row in zip(range(HEADER_SCAN_ROWS), rows):
+            header = [str(v).strip() if v is not None else "" for v in row]
+            if all(c in header for c in SITE_COLUMNS):
+                positions = [header.index(c) for c in SITE_COLUMNS]
+                break
+        if positions is None:
+            raise RuntimeError("Excel не содержит ожидаемые колонки: תאריך, כניסה, יציאה")
+
+        last = max(positions)
+        for row in rows:
+            if len(row) <= last:
+                row = tuple(row) + (None,) * (last + 1 - len(row))
+            yield tuple(row[i] for i in positions)
+    finally:
+        workbook.close()
+
+
+def _text_date(text: str) -> datetime | None:
+    match = _DAY_FIRST_RE.match(text)
+    if match:
+        day, month, year = (int(g) for g in match.groups())
+    else:
+        match = _ISO_RE.match(text)
+        if not match:
+            return None
+        year, month, day = (int(g) for g in match.groups())
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_date_text(text: str) -> datetime | None:
+    """
+    Первое слово текстовой даты -> datetime (полночь) или None.
+    DD.MM.YYYY (и с "/" или "-") — день первым, YYYY-MM-DD — год первым;
+    остальное разбирает pd.to_datetime(..., dayfirst=True).
+    """
+    parsed = _text_date(text)
+    if parsed is not None:
+        return parsed
+    import pandas as pd
+
+    try:
+        stamp = pd.to_datetime(text, dayfirst=True)
+    except Exception:
+        return None
+    return None if pd.isna(stamp) else datetime(stamp.year, stamp.month, stamp.day)
+
+
+def cell_date(value, cache: dict[str, datetime | None]) -> datetime | None:
+    """
+    Ячейка даты -> datetime (полночь) или None.
+    Текст разбирается по первому слову (parse_date_text, результат кэшируется по тексту).
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+
+    words = str(value).split()
+    if not words:
+        return None
+    text = words[0]
+    if text not in cache:
+        cache[text] = parse_date_text(text)
+    return cache[text]
+
+
+def read_site_by_date(excel_path: str) -> dict[datetime, list[Interval]]:
+    """
+    date_obj -> [Interval, ...] в порядке строк выгрузки; строки без даты
+    или без обоих времён пропускаются.
+    """
+    site_by_date: dict[datetime, list[Interval]] = {}
+    dates: dict[str, datetime | None] = {}
+    for raw_date, raw_in, raw_out in iter_site_cells(excel_path):
+        day = cell_date(raw_date, dates)
+        if day is None:
+            continue
+        interval = Interval(parse_minutes(raw_in), parse_minutes(raw_out))
+        if interval.is_empty:
+            continue
+        site_by_date.setdefault(day, []).append(interval)
+    return site_by_date
+
+
+CACHE_SUFFIX = ".intervals"
+# Версия разбора в заголовке кэша: при любом изменении разбора дат или времени
+# (здесь, в parse_date_text, sync_diff.parse_minutes) — увеличить, иначе старые
+# .intervals продолжат отдавать прежний результат.
+# 2 — год первым в "YYYY-MM-DD" и ячейках-датах, время — parse_minutes.
+_CACHE_MAGIC = b"YLMI2"
+_CACHE_HEADER = struct.Struct("<5s32sI")  # магия, SHA-256 xlsx, число записей
+_CACHE_RECORD = struct.Struct("<HBBhh")  # год, месяц, день, вход, выход (минуты, -1 = пусто)
+
+
+def file_sha256(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _read_cache(cache_path: str, sha: bytes) -> dict[datetime, list[Interval]] | None:
+    try:
+        with open(cache_path, "rb") as f:
+            raw = f.read()
+        magic, cached_sha, count = _CACHE_HEADER.unpack_from(raw)
+    except (OSError, struct.error):
+        return None
+    if magic != _CACHE_MAGIC or cached_sha != sha or len(raw) != _CACHE_HEADER.size + count * _CACHE_RECORD.size:
+        return None
+
+    site_by_date: dict[datetime, list[Interval]] = {}
+    for year, month, day, start, end in _CACHE_RECORD.iter_unpack(raw[_CACHE_HEADER.size :]):
+        site_by_date.setdefault(datetime(year, month, day), []).append(Interval(start, end))
+    return site_by_date
+
+
+def _write_cache(cache_path: str, sha: bytes, site_by_date: dict[datetime, list[Interval]]) -> None:
+    records = [
+        _CACHE_RECORD.pack(d.year, d.month, d.day, iv.start, iv.end)
+        for d, intervals in site_by_date.items()
+        for iv in intervals
+    ]
+    temp_path = f"{cache_path}.new"
+    with open(temp_path, "wb") as f:
+        f.write(_CACHE_HEADER.pack(_CACHE_MAGIC, sha, len(records)))
+        f.write(b"".join(records))
+    os.replace(temp_path, cache_path)
+
+
+def read_site_by_date_cached(excel_path: str, read=read_site_by_date) -> dict[datetime, list[Interval]]:
+    """
+    read(excel_path), но через кэш excel_path + CACHE_SUFFIX: если версия разбора
+    и SHA-256 файла совпадают с записанными в кэше — Excel не открывается. Кэш, который не удалось
+    записать, — не ошибка (просто разберём в следующий раз снова).
+    """
+    cache_path = excel_path + CACHE_SUFFIX
+    sha = file_sha256(excel_path)
+    site_by_date = _read_cache(cache_path, sha)
+    if site_by_date is not None:
+        print(f"📦 Разобранная выгрузка из кэша: {cache_path}")
+        return site_by_date
+
+    site_by_date = read(excel_path)
+    try:
+        _write_cache(cache_path, sha, site_by_date)
+    except (OSError, struct.error) as exc:
+        print(f"⚠️ Кэш выгрузки {cache_path} не записан: {exc}")
+    return site_by_date
@@ -0,0 +1,223 @@
+"""
+Ядро сравнения: данные сайта против листа месяца (эталона).
+
+Без gspread и без сети — на входе уже разобранные интервалы сайта и
+значения B:L листа месяца, на выходе дозаполнения эталона и строки листа
+изменений. Время внутри — минуты от полуночи, строки "HH:MM" получаются
+только в minutes_text при записи.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+
+NO_TIME = -1
+
+
+def parse_minutes(value) -> int:
+    """
+    Время из ячейки -> минуты от полуночи (NO_TIME, если пусто или не разобрать).
+    Принимает "7:00", "07:00", "07:00:00"; вне 00:00–23:59 — пусто.
+    """
+    if value is None:
+        return NO_TIME
+    s = str(value).strip()[:8]
+    parts = s.split(":")
+    if len(parts) < 2:
+        return NO_TIME
+    try:
+        hh = int(parts[0])
+        mm = int(parts[1])
+    except ValueError:
+        return NO_TIME
+    if not (0 <= hh <= 23 and 0 <= mm <= 59):
+        return NO_TIME
+    return hh * 60 + mm
+
+
+def minutes_text(minutes: int, *, empty_as_zero: bool = False) -> str:
+    """
+    Минуты от полуночи -> "HH:MM" для записи в Sheets.
+    """
+    if minutes < 0:
+        return "00:00" if empty_as_zero else ""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class Interval:
+    """
+    Интервал вход/выход в минутах от полуночи (NO_TIME — значения нет).
+    """
+
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: int = NO_TIME, end: int = NO_TIME):
+        self.start = start
+        self.end = end
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Interval) and self.start == other.start and self.end == other.end
+
+    def __repr__(self) -> str:
+        return f"Interval({minutes_text(self.start) or '-'}, {minutes_text(self.end) or '-'})"
+
+    @property
+    def is_empty(self) -> bool:
+        return self.start < 0 and self.end < 0
+
+
+EMPTY_INTERVAL = Interval()
+
+
+def index_base(base_values: list[list[str]]) -> dict[str, tuple[int, Interval, Interval]]:
+    """
+    Индекс листа месяца: date_str -> (row_num, основной интервал, бонус).
+    В base_values (диапазон B:L) дата в B (index 0), вход/выход в C/D (1/2), бонус в K/L (9/10).
+    """
+    base_by_date: dict[str, tuple[int, Interval, Interval]] = {}
+    for idx, row in enumerate(base_values):
+        if len(row) < 1:
+            continue
+        date_cell = str(row[0]).strip()
+        if not date_cell:
+            continue
+
+        main = Interval(
+            parse_minutes(row[1] if len(row) > 1 else ""),
+            parse_minutes(row[2] if len(row) > 2 else ""),
+        )
+        bonus = Interval(
+            parse_minutes(row[9] if len(row) > 9 else ""),
+            parse_minutes(row[10] if len(row) > 10 else ""),
+        )
+        base_by_date[date_cell] = (idx + 1, main, bonus)  # 1-based for Sheets API
+    return base_by_date
+
+
+# Столбец дозаполнения -> индекс в строке B:L
+_BASE_COLUMNS = {"C": 1, "D": 2, "K": 9, "L": 10}
+
+
+def apply_base_updates(base_values: list[list[str]], base_updates: list[dict]) -> list[list[str]]:
+    """
+    Копия base_values (B:L) с записанными base_updates — лист месяца после дозаполнения.
+    """
+    values = [list(row) for row in base_values]
+    for update in base_updates:
+        ref = update["range"]
+        idx, col = int(ref[1:]) - 1, _BASE_COLUMNS[ref[0]]
+        while len(values) <= idx:
+            values.append([])
+        row = values[idx]
+        if len(row) <= col:
+            row.extend([""] * (col + 1 - len(row)))
+        row[col] = update["values"][0][0]
+    return values
+
+
+def date_variants(d: datetime) -> list[str]:
+    """
+    Как дата может быть записана в столбце B листа месяца.
+    """
+    return [d.strftime("%d.%m.%Y"), d.strftime("%d/%m/%Y")]
+
+
+def _cmp(mine: int, site: int) -> int:
+    if mine < 0 or site < 0 or mine == site:
+        return 0
+    return -1 if site < mine else 1
+
+
+def _row_for_interval(date_label: str, mine: Interval, site: Interval) -> list:
+    return [
+        date_label,
+        mine.start,
+        mine.end,
+        site.start,
+        site.end,
+        "",
+        _cmp(mine.start, site.start),
+        _cmp(mine.end, site.end),
+    ]
+
+
+def compute_changes(
+    site_by_date: dict[datetime, list[Interval]],
+    base_values: list[list[str]],
+) -> tuple[list[dict], list[list]]:
+    """
+    Возвращает (base_updates, changes_rows).
+
+    base_updates — дозаполнение пустых ячеек эталона значениями сайта,
+    в формате Worksheet.batch_update: {"range": "C12", "values": [["07:00"]]}.
+
+    changes_rows — строки листа изменений:
+    [date, my_in, my_out, site_in, site_out, diff_formula, cmp_in, cmp_out]
+    (время — минуты, NO_TIME = пусто; строка без даты — бонусный интервал;
+    cmp: -1 — сайт меньше эталона, 1 — больше, 0 — совпадает/нечего сравнивать).
+    """
+    base_by_date = index_base(base_values)
+
+    changes_rows = []
+    base_updates = []
+    updated_my_cache: dict[str, tuple[Interval, Interval]] = {}
+
+    def _fill(column: str, row_num: int, minutes: int) -> None:
+        base_updates.append({"range": f"{column}{row_num}", "values": [[minutes_text(minutes)]]})
+
+    for date_key, intervals in site_by_date.items():
+        variants = date_variants(date_key)
+
+        intervals_sorted = sorted(intervals, key=lambda iv: (iv.start < 0, iv.start))
+        site_main = intervals_sorted[0] if len(intervals_sorted) > 0 else EMPTY_INTERVAL
+        site_bonus = intervals_sorted[1] if len(intervals_sorted) > 1 else EMPTY_INTERVAL
+        if len(intervals_sorted) > 2:
+            print(f"⚠️ Дата {variants[0]}: найдено интервалов {len(intervals_sorted)}, используем первые два.")
+
+        # Найдём дату в основном листе (по одному из вариантов формата)
+        base_date = next((dv for dv in variants if dv in base_by_date), None)
+        if base_date is None:
+            # даты нет в твоём листе — это не "изменение"
+            continue
+        row_num, my_main, my_bonus = base_by_date[base_date]
+        if base_date in updated_my_cache:
+            my_main, my_bonus = updated_my_cache[base_date]
+        my_main = Interval(my_main.start, my_main.end)
+        my_bonus = Interval(my_bonus.start, my_bonus.end)
+
+        changed_base = False
+        main_was_empty = my_main.is_empty
+        main_filled = False
+        if my_main.start < 0 and site_main.start >= 0:
+            _fill("C", row_num, site_main.start)
+            my_main.start = site_main.start
+            changed_base = main_filled = True
+        if my_main.end < 0 and site_main.end >= 0:
+            _fill("D", row_num, site_main.end)
+            my_main.end = site_main.end
+            changed_base = main_filled = True
+        # Бонусы заполняем только если строка была пустая и мы заполнили её в этой сессии.
+        if main_was_empty and main_filled:
+            if my_bonus.start < 0 and site_bonus.start >= 0:
+                _fill("K", row_num, site_bonus.start)
+                my_bonus.start = site_bonus.start
+                changed_base = True
+            if my_bonus.end < 0 and site_bonus.end >= 0:
+                _fill("L", row_num, site_bonus.end)
+                my_bonus.end = site_bonus.end
+                changed_base = True
+
+        if changed_base:
+            updated_my_cache[base_date] = (my_main, my_bonus)
+
+        main_diff = my_main != site_main
+        bonus_diff = my_bonus != site_bonus
+        has_bonus = not (my_bonus.is_empty and site_bonus.is_empty)
+
+        if not (main_diff or bonus_diff):
+            continue
+
+        changes_rows.append(_row_for_interval(base_date, my_main, site_main))
+        if has_bonus:
+            changes_rows.append(_row_for_interval("", my_bonus, site_bonus))
+
+    return base_updates, changes_rows
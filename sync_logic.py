@@ -1,49 +1,101 @@
 from __future__ import annotations
 
+import copy
+import random
 from datetime import datetime
-import pandas as pd
+from typing import TYPE_CHECKING
 
+from site_excel import SITE_COLUMNS, parse_date_text, read_site_by_date, read_site_by_date_cached
+from sync_diff import NO_TIME, Interval, apply_base_updates, compute_changes, minutes_text, parse_minutes
 
-def _normalize_time(value, *, empty_as_zero: bool = False) -> str:
+# pandas нужен только запасному пути чтения Excel — импортируется в функциях
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def _minutes_column(col: pd.Series) -> pd.Series:
     """
-    Нормализует время к HH:MM.
-    Принимает строки вида "7:00", "07:00", "07:00:00", а также NaN/None.
+    Столбец времени -> минуты от полуночи (int, -1 = пусто) тем же
+    sync_diff.parse_minutes, что и в потоковом чтении; каждое уникальное
+    значение разбирается один раз.
     """
-    if value is None:
-        return "00:00" if empty_as_zero else ""
-    s = str(value).strip()
-    if s == "" or s.lower() == "nan":
-        return "00:00" if empty_as_zero else ""
-    s = s[:8]
-    if ":" not in s:
-        return "00:00" if empty_as_zero else ""
+    minutes = {value: parse_minutes(value) for value in col.unique()}
+    return col.map(minutes).astype("int64")
 
-    parts = s.split(":")
-    if len(parts) < 2:
-        return ""
-    h, m = parts[0], parts[1]
-    try:
-        hh = int(h)
-        mm = int(m)
-        if not (0 <= hh <= 23 and 0 <= mm <= 59):
-            return ""
-        return f"{hh:02d}:{mm:02d}"
-    except Exception:
-        return "00:00" if empty_as_zero else ""
 
+def _dates_column(col: pd.Series) -> pd.Series:
+    """
+    Столбец даты -> нормализованные Timestamp (NaT, если не разобрать).
+    Текстовые даты разбираются по уникальным значениям (их не больше ~31 на месяц)
+    тем же site_excel.parse_date_text, что и в потоковом чтении.
+    Отличие от прежнего построчного разбора (str() + dayfirst): ячейки-даты и текст
+    "YYYY-MM-DD" больше не читаются как день-месяц наоборот (см. CODEX.md).
+    """
+    import pandas as pd
 
-def _time_to_minutes(t: str) -> int:
-    if not t or ":" not in t:
-        return 0
-    h, m = t.split(":")[:2]
-    return int(h) * 60 + int(m)
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.normalize()
+
+    # ячейки-даты среди текста (столбец object) — как есть, не через строку "YYYY-MM-DD" с dayfirst
+    raw = col.map(lambda v: v.strftime("%d.%m.%Y") if isinstance(v, datetime) else v)
+    raw = raw.astype(str).str.split().str[0]
+    parsed = {}
+    for value in raw.dropna().unique():
+        day = parse_date_text(value)
+        parsed[value] = pd.Timestamp(day) if day is not None else pd.NaT
+    return pd.to_datetime(raw.map(parsed))
+
+
+def parse_site_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Разбирает выгрузку сайта за один проход.
+    Возвращает DataFrame со столбцами: date (Timestamp), in_min, out_min (минуты, -1 = пусто).
+    Строки без даты или без обоих времён отбрасываются.
+    """
+    import pandas as pd
+
+    if not all(c in df.columns for c in SITE_COLUMNS):
+        raise RuntimeError("Excel не содержит ожидаемые колонки: תאריך, כניסה, יציאה")
+    df = df[SITE_COLUMNS].dropna(subset=["תאריך"])
+
+    frame = pd.DataFrame(
+        {
+            "date": _dates_column(df["תאריך"]),
+            "in_min": _minutes_column(df["כניסה"]),
+            "out_min": _minutes_column(df["יציאה"]),
+        }
+    )
+    frame = frame[frame["date"].notna()]
+    return frame[(frame["in_min"] >= 0) | (frame["out_min"] >= 0)]
+
+
+def group_site_by_date(frame: pd.DataFrame) -> dict[datetime, list[Interval]]:
+    """
+    date_obj -> [Interval, ...] в порядке строк выгрузки.
+    """
+    site_by_date: dict[datetime, list[Interval]] = {}
+    for key, grp in frame.groupby("date", sort=False):
+        site_by_date[key] = [Interval(int(a), int(b)) for a, b in zip(grp["in_min"], grp["out_min"])]
+    return site_by_date
 
 
-def _format_time_for_sheet(v, *, empty_as_zero: bool = False) -> str:
+def load_site_by_date(excel_path: str, cached: bool = False) -> dict[datetime, list[Interval]]:
     """
-    Нормализует время для записи в Google Sheets без апострофов.
+    Читает Excel сайта и группирует интервалы по дате.
+    Обычно — потоково (site_excel); если openpyxl файл не открыл — через pd.read_excel.
+    cached=True — через кэш разобранных интервалов рядом с файлом (архивы history/).
     """
-    return _normalize_time(v, empty_as_zero=empty_as_zero)
+    if cached:
+        return read_site_by_date_cached(excel_path, read=load_site_by_date)
+    try:
+        return read_site_by_date(excel_path)
+    except RuntimeError:
+        raise
+    except Exception as exc:
+        print(f"⚠️ Потоковое чтение {excel_path} не удалось ({exc}) — читаем через pandas.")
+    import pandas as pd
+
+    return group_site_by_date(parse_site_frame(pd.read_excel(excel_path)))
 
 
 def _color_red():
@@ -64,6 +116,16 @@ def _bg_site():
     return {"red": 1.00, "green": 0.98, "blue": 0.85}
 
 
+def _flush(spreadsheet) -> None:
+    """
+    Отправить отложенные записи (SheetsScheduler) в конце этапа — до вызовов
+    под try/except, которые иначе приняли бы ошибку записи за свою.
+    """
+    flush = getattr(spreadsheet, "flush", None)
+    if flush is not None:
+        flush()
+
+
 def _delete_worksheet_if_exists(spreadsheet, title: str) -> None:
     try:
         ws = spreadsheet.worksheet(title)
@@ -72,10 +134,506 @@ def _delete_worksheet_if_exists(spreadsheet, title: str) -> None:
         return
 
 
-def build_changes_sheet(spreadsheet, base_ws, sheet_name: str, excel_path: str) -> bool:
+_HEADER_ROWS = [
+    ["Дата", "Факт", "", "Табель", "", "Разница"],
+    ["", "Вход", "Выход", "Вход", "Выход", ""],
+]
+
+
+def _changes_date_label() -> str:
+    return f"Дата изменений: {datetime.now().strftime('%d.%m.%Y')}"
+
+
+def _diff_formula(row_num: int) -> str:
+    return (
+        f'=ЕСЛИ(И(B{row_num}<>"";C{row_num}<>"";D{row_num}<>"";E{row_num}<>"");'
+        f'(E{row_num}-D{row_num})-(C{row_num}-B{row_num});"")'
+    )
+
+
+def _values_block(changes_rows: list[list], start_row: int) -> list[list[str]]:
+    """
+    Строки данных листа изменений (A:F) с формулой разницы.
+    Время в changes_rows — минуты, здесь оно переводится в "HH:MM".
+    """
+    values_block = []
+    for idx, rr in enumerate(changes_rows):
+        row_num = start_row + idx
+        diff_formula = _diff_formula(row_num)
+        # в бонусной строке (без даты) пустое время пишется как 00:00
+        empty_as_zero = rr[0] == ""
+        times = [minutes_text(m, empty_as_zero=empty_as_zero) for m in rr[1:5]]
+        values_block.append([rr[0], *times, diff_formula])
+    return values_block
+
+
+def _total_row_values(start_row: int, end_row: int) -> list[list[str]]:
+    return [["Итого:", f"=СУММ(F{start_row}:F{end_row})"]]
+
+
+def _body_formats(start_row: int, end_row: int) -> list[dict]:
+    return [
+        {
+            "range": "A3:F4",
+            "format": {
+                "textFormat": {"bold": True},
+                "horizontalAlignment": "CENTER",
+                "verticalAlignment": "MIDDLE",
+            },
+        },
+        {
+            "range": f"A{start_row}:F{end_row}",
+            "format": {
+                "horizontalAlignment": "CENTER",
+                "verticalAlignment": "MIDDLE",
+            },
+        },
+        {"range": f"B4:C{end_row}", "format": {"backgroundColor": _bg_my()}},
+        {"range": f"D4:E{end_row}", "format": {"backgroundColor": _bg_site()}},
+        {"range": f"B{start_row}:E{end_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "hh:mm"}}},
+        {"range": f"F{start_row}:F{end_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "[h]:mm"}}},
+    ]
+
+
+def _total_formats(total_row: int) -> list[dict]:
+    return [
+        {"range": f"E{total_row}:F{total_row}", "format": {"textFormat": {"bold": True}}},
+        {"range": f"E{total_row}", "format": {"horizontalAlignment": "RIGHT"}},
+        {"range": f"F{total_row}", "format": {"horizontalAlignment": "LEFT"}},
+        {"range": f"F{total_row}", "format": {"textFormat": {"foregroundColor": {"red": 0, "green": 0, "blue": 0}}}},
+        {"range": f"F{total_row}:F{total_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "[h]:mm"}}},
+    ]
+
+
+def _text_color_formats(changes_rows: list[list], start_row: int) -> list[dict]:
+    """
+    Статическая окраска табеля: красный — меньше факта, зелёный — больше.
+    """
+    formats = []
+    for idx, rr in enumerate(changes_rows):
+        row_num = start_row + idx
+        for col, cmp in (("D", rr[6]), ("E", rr[7])):
+            if cmp != 0:
+                c = _color_red() if cmp < 0 else _color_green()
+                formats.append({"range": f"{col}{row_num}", "format": {"textFormat": {"foregroundColor": c}}})
+    return formats
+
+
+def _apply_text_colors(ws, changes_rows: list[list], start_row: int, static_colors: bool = False) -> int:
+    """
+    Окраска текста табеля. Возвращает число сделанных API-вызовов.
+
+    Правила условного форматирования (см. _conditional_rules) покрывают D:F
+    целиком и перекрывают статический цвет, поэтому по умолчанию этап пропускается.
+    Если static_colors=True — все ячейки красятся одним batch_format.
+    """
+    if not static_colors:
+        return 0
+    formats = _text_color_formats(changes_rows, start_row)
+    if not formats:
+        return 0
+    ws.batch_format(formats)
+    return 1
+
+
+def _header_merges(sheet_id: int) -> list[dict]:
+    # "Факт" над B:C и "Табель" над D:E
+    return [
+        {
+            "mergeCells": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": 2,
+                    "endRowIndex": 3,
+                    "startColumnIndex": start_col,
+                    "endColumnIndex": start_col + 2,
+                },
+                "mergeType": "MERGE_ALL",
+            }
+        }
+        for start_col in (1, 3)
+    ]
+
+
+def _conditional_rules(sheet_id: int, start_row: int, end_row: int) -> list[dict]:
+    black = {"red": 0, "green": 0, "blue": 0}
+    # (индекс столбца, формула, цвет текста)
+    specs = [
+        # Табель (D) vs Факт (B)
+        (3, f"=D{start_row}<B{start_row}", _color_red()),
+        (3, f"=D{start_row}>B{start_row}", _color_green()),
+        (3, f"=D{start_row}=B{start_row}", black),
+        # Табель (E) vs Факт (C)
+        (4, f"=E{start_row}<C{start_row}", _color_red()),
+        (4, f"=E{start_row}>C{start_row}", _color_green()),
+        (4, f"=E{start_row}=C{start_row}", black),
+        # Разница (F)
+        (5, f"=F{start_row}<0", _color_red()),
+        (5, f"=F{start_row}>0", _color_green()),
+        (5, f"=F{start_row}=0", black),
+    ]
+    return [
+        {
+            "addConditionalFormatRule": {
+                "rule": {
+                    "ranges": [
+                        {
+                            "sheetId": sheet_id,
+                            "startRowIndex": start_row - 1,
+                            "endRowIndex": end_row,
+                            "startColumnIndex": col,
+                            "endColumnIndex": col + 1,
+                        }
+                    ],
+                    "booleanRule": {
+                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": formula}]},
+                        "format": {"textFormat": {"foregroundColor": color}},
+                    },
+                },
+                "index": idx,
+            }
+        }
+        for idx, (col, formula, color) in enumerate(specs)
+    ]
+
+
+def _a1_bounds(a1: str) -> tuple[int, int, int, int]:
+    """
+    "B4:C10" -> (row_start, row_end, col_start, col_end), 0-based, конец не включается.
+    """
+    first, _, last = a1.partition(":")
+    last = last or first
+
+    def _cell(ref: str) -> tuple[int, int]:
+        col = ord(ref[0]) - ord("A")
+        return int(ref[1:]) - 1, col
+
+    r0, c0 = _cell(first)
+    r1, c1 = _cell(last)
+    return r0, r1 + 1, c0, c1 + 1
+
+
+def _merge_format(target: dict, fmt: dict) -> None:
+    for key, value in fmt.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_format(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+_SHEETS_EPOCH = datetime(1899, 12, 30)
+
+
+def _cell_value(value: str) -> dict:
+    """
+    Значение ячейки для updateCells так, как его понял бы USER_ENTERED:
+    формула, время (доля суток), дата (серийный номер) или текст.
+    """
+    if value.startswith("="):
+        return {"formulaValue": value}
+    minutes = parse_minutes(value)
+    if minutes != NO_TIME and minutes_text(minutes) == value:
+        return {"numberValue": minutes / 1440}
+    for pattern in ("%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            d = datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+        return {"numberValue": (d - _SHEETS_EPOCH).days}
+    return {"stringValue": value}
+
+
+def _date_pattern(value: str) -> dict:
+    sep = "/" if "/" in value else "."
+    return {"numberFormat": {"type": "DATE", "pattern": f"dd{sep}mm{sep}yyyy"}}
+
+
+def _changes_grid(
+    changes_rows: list[list],
+    values_block: list[list[str]],
+    static_colors: bool = False,
+) -> list[dict]:
+    """
+    Весь лист изменений как RowData для updateCells: значения + итоговый формат ячеек.
+    """
+    start_row = 5
+    end_row = start_row + len(values_block) - 1
+    total_row = end_row + 1
+
+    values: dict[tuple[int, int], str] = {(0, 0): _changes_date_label()}
+    for r, row in enumerate(_HEADER_ROWS, start=2):
+        for c, v in enumerate(row):
+            values[(r, c)] = v
+    for r, row in enumerate(values_block, start=start_row - 1):
+        for c, v in enumerate(row):
+            values[(r, c)] = v
+    for c, v in enumerate(_total_row_values(start_row, end_row)[0], start=4):
+        values[(total_row - 1, c)] = v
+
+    formats: dict[tuple[int, int], dict] = {}
+
+    def _apply(a1: str, fmt: dict) -> None:
+        r0, r1, c0, c1 = _a1_bounds(a1)
+        for r in range(r0, r1):
+            for c in range(c0, c1):
+                _merge_format(formats.setdefault((r, c), {}), fmt)
+
+    for item in _body_formats(start_row, end_row):
+        _apply(item["range"], item["format"])
+    for idx, rr in enumerate(changes_rows):
+        if rr[0]:
+            _apply(f"A{start_row + idx}", _date_pattern(rr[0]))
+    if static_colors:
+        for item in _text_color_formats(changes_rows, start_row):
+            _apply(item["range"], item["format"])
+    for item in _total_formats(total_row):
+        _apply(item["range"], item["format"])
+
+    rows = []
+    for r in range(total_row):
+        cells = []
+        for c in range(6):
+            cell = {}
+            v = values.get((r, c), "")
+            if v != "":
+                cell["userEnteredValue"] = _cell_value(v)
+            if (r, c) in formats:
+                cell["userEnteredFormat"] = formats[(r, c)]
+            cells.append(cell)
+        rows.append({"values": cells})
+    return rows
+
+
+def _find_sheet_id(spreadsheet, title: str):
+    try:
+        return spreadsheet.worksheet(title).id
+    except Exception:
+        return None
+
+
+def _render_changes_single(
+    spreadsheet,
+    changes_title: str,
+    changes_rows: list[list],
+    values_block: list[list[str]],
+    static_colors: bool = False,
+) -> int:
+    """
+    Пересоздаёт лист изменений одним spreadsheets.batchUpdate.
+    Возвращает sheetId нового листа.
+    """
+    start_row = 5
+    end_row = start_row + len(values_block) - 1
+
+    old_id = _find_sheet_id(spreadsheet, changes_title)
+    sheet_id = old_id
+    while sheet_id == old_id:
+        sheet_id = random.randint(1, 2**31 - 1)
+
+    requests = []
+    if old_id is not None:
+        requests.append({"deleteSheet": {"sheetId": old_id}})
+    requests.append(
+        {
+            "addSheet": {
+                "properties": {
+                    "sheetId": sheet_id,
+                    "title": changes_title,
+                    "gridProperties": {"rowCount": len(changes_rows) + 10, "columnCount": 6},
+                }
+            }
+        }
+    )
+    requests.append(
+        {
+            "updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+                "rows": _changes_grid(changes_rows, values_block, static_colors=static_colors),
+                "fields": "userEnteredValue,userEnteredFormat",
+            }
+        }
+    )
+    requests.extend(_header_merges(sheet_id))
+    requests.extend(_conditional_rules(sheet_id, start_row, end_row))
+
+    spreadsheet.batch_update({"requests": requests})
+    return sheet_id
+
+
+def _patch_changes_sheet(
+    spreadsheet,
+    changes_title: str,
+    changes_rows: list[list],
+    values_block: list[list[str]],
+    static_colors: bool = False,
+):
+    """
+    Правит существующий лист изменений построчно: читает его A:E, сравнивает
+    с новыми строками (difflib) и одним batchUpdate вставляет/удаляет строки
+    (insertDimension/deleteDimension) и переписывает только изменённые
+    (updateCells). sheetId, объединения и правила остаются; диапазоны правил
+    и формула "Итого" подправляются под новое число строк.
+    Возвращает число затронутых строк или None, если листа нет или он не
+    похож на лист изменений (тогда его нужно пересоздать).
+    """
+    import difflib
+
+    start_row = 5
+    try:
+        ws = spreadsheet.worksheet(changes_title)
+    except Exception:
+        return None
+    current = ws.get_values(f"A{start_row}:E")
+    total_idx = next(
+        (i for i in range(len(current) - 1, -1, -1) if current[i][4:5] == ["Итого:"] and not any(current[i][:4])),
+        None,
+    )
+    if not total_idx:
+        return None
+
+    old_keys = [tuple((list(row) + [""] * 5)[:5]) for row in current[:total_idx]]
+    new_keys = [tuple(row[:5]) for row in values_block]
+    opcodes = [op for op in difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes() if op[0] != "equal"]
+    if not opcodes:
+        return 0
+
+    # Готовые ячейки (значения + формат) всех строк нового листа
+    grid = _changes_grid(changes_rows, values_block, static_colors=static_colors)
+
+    def _cells(row_index: int, sheet_row: int, c0: int, c1: int, keep_format: bool = False) -> dict:
+        """
+        keep_format — строка уже оформлена: шлём значения и только формат чисел
+        (без статических цветов остальное оформление у строк листа одинаковое).
+        """
+        cells = grid[row_index]["values"][c0:c1]
+        fields = "userEnteredValue,userEnteredFormat"
+        if keep_format and not static_colors:
+            cells = [
+                {
+                    **({"userEnteredValue": cell["userEnteredValue"]} if "userEnteredValue" in cell else {}),
+                    **(
+                        {"userEnteredFormat": {"numberFormat": cell["userEnteredFormat"]["numberFormat"]}}
+                        if "numberFormat" in cell.get("userEnteredFormat", {})
+                        else {}
+                    ),
+                }
+                for cell in cells
+            ]
+            fields = "userEnteredValue,userEnteredFormat.numberFormat"
+        return {
+            "updateCells": {
+                "start": {"sheetId": ws.id, "rowIndex": sheet_row, "columnIndex": c0},
+                "rows": [{"values": cells}],
+                "fields": fields,
+            }
+        }
+
+    def _rows(kind: str, at: int, count: int) -> dict:
+        body = {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": at, "endIndex": at + count}}
+        if kind == "insertDimension":
+            body["inheritFromBefore"] = at > start_row - 1
+        return {kind: body}
+
+    # Снизу вверх: индексы старых строк выше текущей правки ещё не сдвинуты.
+    # Формулы ниже правки Sheets сдвигает сам; во вставленные строки пишем формулу
+    # для их текущего номера — её тоже сдвинут правки выше.
+    requests = []
+    touched = 0
+    for _, i1, i2, j1, j2 in reversed(opcodes):
+        common = min(i2 - i1, j2 - j1)
+        for k in range(common):
+            requests.append(_cells(start_row - 1 + j1 + k, start_row - 1 + i1 + k, 0, 5, keep_format=True))
+        at = start_row - 1 + i1 + common
+        if j2 - j1 > common:
+            count = j2 - j1 - common
+            requests.append(_rows("insertDimension", at, count))
+            for k in range(count):
+                cell_row = grid[start_row - 1 + j1 + common + k]["values"]
+                cell_row[5] = {**cell_row[5], "userEnteredValue": {"formulaValue": _diff_formula(at + k + 1)}}
+                requests.append(_cells(start_row - 1 + j1 + common + k, at + k, 0, 6))
+        elif i2 - i1 > common:
+            requests.append(_rows("deleteDimension", at, i2 - i1 - common))
+        touched += max(i2 - i1, j2 - j1)
+
+    # Итого (диапазон суммы — по новым строкам), дата проверки, правила на новый диапазон
+    end_row = start_row + len(values_block) - 1
+    requests.append(_cells(end_row, end_row, 4, 6, keep_format=True))
+    requests.append(_cells(0, 0, 0, 1, keep_format=True))
+    for rule in _conditional_rules(ws.id, start_row, end_row):
+        params = rule["addConditionalFormatRule"]
+        requests.append({"updateConditionalFormatRule": {"sheetId": ws.id, "index": params["index"], "rule": params["rule"]}})
+
+    try:
+        spreadsheet.batch_update({"requests": requests})
+        # планировщик откладывает запись — отправляем здесь, чтобы ошибка попала в этот except
+        _flush(spreadsheet)
+    except Exception as e:
+        # batchUpdate атомарен: при ошибке лист не тронут, его можно пересоздать
+        print(f"⚠️ Правка листа по строкам не удалась ({e}).")
+        return None
+    return touched
+
+
+def _rewrite_changed_rows(
+    spreadsheet,
+    changes_title: str,
+    previous_rows: list[list[str]],
+    values_block: list[list[str]],
+    start_row: int,
+):
+    """
+    Переписывает в существующем листе изменений только строки, отличающиеся
+    от прошлого запуска (структура листа та же, формулы ссылаются на свои строки).
+    Возвращает число переписанных строк или None, если листа нет.
+    """
+    try:
+        ws = spreadsheet.worksheet(changes_title)
+    except Exception:
+        return None
+
+    updates = []
+    for idx, (prev, row) in enumerate(zip(previous_rows, values_block)):
+        if list(prev) != row:
+            row_num = start_row + idx
+            updates.append({"range": f"A{row_num}:F{row_num}", "values": [row]})
+    if updates:
+        updates.append({"range": "A1", "values": [[_changes_date_label()]]})
+        ws.batch_update(updates, value_input_option="USER_ENTERED")
+    return len(updates) - 1 if updates else 0
+
+
+def build_changes_sheet(
+    spreadsheet,
+    base_ws,
+    sheet_name: str,
+    excel_path: str,
+    render_mode: str = "steps",
+    static_colors: bool = False,
+    site_by_date: dict[datetime, list[Interval]] | None = None,
+    base_values: list[list[str]] | None = None,
+    state: dict | None = None,
+) -> list[list[str]]:
     """
     Создаёт/пересоздаёт лист "Изменения M.YY" (состояние расхождений).
     Если расхождений нет — лист удаляется (или не создаётся).
+    Возвращает B:L листа месяца после дозаполнения (для хэша в инкрементальном режиме).
+
+    render_mode:
+    - "steps" — лист строится серией отдельных вызовов gspread;
+    - "single" — весь лист (удаление старого, addSheet, значения, форматы,
+      объединения, условное форматирование) уходит одним spreadsheets.batchUpdate;
+    - "patch" — существующий лист правится по строкам (вставка/удаление/изменение,
+      см. _patch_changes_sheet), если листа нет — создаётся как в "single".
+
+    static_colors: дополнительно красить ячейки табеля статическим форматом.
+    По умолчанию выключено — ту же окраску дают правила условного форматирования.
+
+    site_by_date / base_values: уже прочитанные данные сайта и диапазона B:L
+    (если не переданы — читаются здесь).
+
+    state: запись состояния листа из sync_state. В неё сохраняются строки листа
+    изменений; если при следующем запуске число строк не изменилось и лист на месте,
+    переписываются только отличающиеся строки.
 
     Столбцы листа изменений строго:
     Дата | Факт (Вход/Выход) | Табель (Вход/Выход) | Разница
@@ -85,142 +643,15 @@ def build_changes_sheet(spreadsheet, base_ws, sheet_name: str, excel_path: str)
     changes_title = f"Изменения {sheet_name}"
 
     # 1) Считаем Excel (сайт)
-    df = pd.read_excel(excel_path)
-    if not all(c in df.columns for c in ["תאריך", "כניסה", "יציאה"]):
-        raise RuntimeError("Excel не содержит ожидаемые колонки: תאריך, כניסה, יציאה")
-    df = df[["תאריך", "כניסה", "יציאה"]].dropna(subset=["תאריך"])
-
-    # date_obj -> [(site_in, site_out), ...]
-    site_by_date: dict[datetime, list[tuple[str, str]]] = {}
-    for _, r in df.iterrows():
-        raw_date = str(r["תאריך"]).split()[0]
-        try:
-            d = pd.to_datetime(raw_date, dayfirst=True)
-        except Exception:
-            continue
-
-        site_in = _format_time_for_sheet(r["כניסה"])
-        site_out = _format_time_for_sheet(r["יציאה"])
-        if site_in == "" and site_out == "":
-            continue
-
-        key = d.normalize()
-        site_by_date.setdefault(key, []).append((site_in, site_out))
+    if site_by_date is None:
+        site_by_date = load_site_by_date(excel_path)
 
     # 2) Считаем базовую таблицу (твои часы — эталон)
-    base_values = base_ws.get_values("B:L")
-
-    # Индекс по дате из base:
-    # date_str -> (row_num, my_in_1, my_out_1, my_in_2, my_out_2)
-    # В base дата в столбце B (index 1), вход/выход в C/D (2/3), бонус в K/L (10/11)
-    base_by_date: dict[str, tuple[int, str, str, str, str]] = {}
-    for idx, row in enumerate(base_values):
-        if len(row) < 1:
-            continue
-        date_cell = str(row[0]).strip()
-        if not date_cell:
-            continue
+    if base_values is None:
+        base_values = base_ws.get_values("B:L")
 
-        my_in_1 = _format_time_for_sheet(row[1] if len(row) > 1 else "")
-        my_out_1 = _format_time_for_sheet(row[2] if len(row) > 2 else "")
-        my_in_2 = _format_time_for_sheet(row[9] if len(row) > 9 else "")
-        my_out_2 = _format_time_for_sheet(row[10] if len(row) > 10 else "")
-        row_num = idx + 1  # 1-based for Sheets API
-
-        base_by_date[date_cell] = (row_num, my_in_1, my_out_1, my_in_2, my_out_2)
-
-    # 3) Собираем изменения
-    # Каждая строка:
-    # [date, my_in, my_out, site_in, site_out, diff_formula, cmp_in, cmp_out]
-    changes_rows = []
-    base_updates = []
-    updated_my_cache: dict[str, tuple[str, str, str, str]] = {}
-
-    def _row_for_interval(date_label: str, my_in: str, my_out: str, site_in: str, site_out: str):
-        my_in = _format_time_for_sheet(my_in)
-        my_out = _format_time_for_sheet(my_out)
-        site_in = _format_time_for_sheet(site_in)
-        site_out = _format_time_for_sheet(site_out)
-
-        cmp_in = 0
-        cmp_out = 0
-        if my_in and site_in and my_in != site_in:
-            cmp_in = -1 if _time_to_minutes(site_in) < _time_to_minutes(my_in) else 1
-        if my_out and site_out and my_out != site_out:
-            cmp_out = -1 if _time_to_minutes(site_out) < _time_to_minutes(my_out) else 1
-
-        return [date_label, my_in, my_out, site_in, site_out, "", cmp_in, cmp_out]
-
-    for date_key, intervals in site_by_date.items():
-        d = pd.to_datetime(date_key)
-        date_variants = [d.strftime("%d.%m.%Y"), d.strftime("%d/%m/%Y")]
-
-        intervals_sorted = sorted(
-            intervals,
-            key=lambda x: (x[0] == "", _time_to_minutes(x[0])),
-        )
-        site_in_1, site_out_1 = intervals_sorted[0] if len(intervals_sorted) > 0 else ("", "")
-        site_in_2, site_out_2 = intervals_sorted[1] if len(intervals_sorted) > 1 else ("", "")
-        if len(intervals_sorted) > 2:
-            print(f"⚠️ Дата {date_variants[0]}: найдено интервалов {len(intervals_sorted)}, используем первые два.")
-
-        # Найдём дату в основном листе (по одному из вариантов формата)
-        base_date = None
-        row_num = None
-        my_in_1 = ""
-        my_out_1 = ""
-        my_in_2 = ""
-        my_out_2 = ""
-        for dv in date_variants:
-            if dv in base_by_date:
-                base_date = dv
-                row_num, my_in_1, my_out_1, my_in_2, my_out_2 = base_by_date[dv]
-                break
-
-        if base_date is None or row_num is None:
-            # даты нет в твоём листе — это не "изменение"
-            continue
-
-        if base_date in updated_my_cache:
-            my_in_1, my_out_1, my_in_2, my_out_2 = updated_my_cache[base_date]
-
-        changed_base = False
-        main_was_empty = (my_in_1 == "" and my_out_1 == "")
-        main_filled = False
-        if my_in_1 == "" and site_in_1 != "":
-            base_updates.append({"range": f"C{row_num}", "values": [[site_in_1]]})
-            my_in_1 = site_in_1
-            changed_base = True
-            main_filled = True
-        if my_out_1 == "" and site_out_1 != "":
-            base_updates.append({"range": f"D{row_num}", "values": [[site_out_1]]})
-            my_out_1 = site_out_1
-            changed_base = True
-            main_filled = True
-        # Бонусы заполняем только если строка была пустая и мы заполнили её в этой сессии.
-        if main_was_empty and main_filled:
-            if my_in_2 == "" and site_in_2 != "":
-                base_updates.append({"range": f"K{row_num}", "values": [[site_in_2]]})
-                my_in_2 = site_in_2
-                changed_base = True
-            if my_out_2 == "" and site_out_2 != "":
-                base_updates.append({"range": f"L{row_num}", "values": [[site_out_2]]})
-                my_out_2 = site_out_2
-                changed_base = True
-
-        if changed_base:
-            updated_my_cache[base_date] = (my_in_1, my_out_1, my_in_2, my_out_2)
-
-        main_diff = (my_in_1 != site_in_1) or (my_out_1 != site_out_1)
-        bonus_diff = (my_in_2 != site_in_2) or (my_out_2 != site_out_2)
-        has_bonus = bool(my_in_2 or my_out_2 or site_in_2 or site_out_2)
-
-        if not (main_diff or bonus_diff):
-            continue
-
-        changes_rows.append(_row_for_interval(base_date, my_in_1, my_out_1, site_in_1, site_out_1))
-        if has_bonus:
-            changes_rows.append(_row_for_interval("", my_in_2, my_out_2, site_in_2, site_out_2))
+    # 3) Собираем изменения (чистое ядро без gspread, см. sync_diff)
+    base_updates, changes_rows = compute_changes(site_by_date, base_values)
 
     # 4) Применяем дозаполнения в основной таблице одним пакетом
     if base_updates:
@@ -229,138 +660,83 @@ def build_changes_sheet(spreadsheet, base_ws, sheet_name: str, excel_path: str)
         except AttributeError:
             for u in base_updates:
                 base_ws.update(u["range"], u["values"], value_input_option="USER_ENTERED")
+        _flush(spreadsheet)
+    filled_values = apply_base_updates(base_values, base_updates)
+
+    previous_rows = state.get("rows") if state is not None else None
 
     # 5) Если расхождений нет — удалить лист и выйти
     if not changes_rows:
+        if state is not None:
+            state["rows"] = []
         _delete_worksheet_if_exists(spreadsheet, changes_title)
         print(f"✅ Расхождений нет — лист '{changes_title}' удалён/не создан.")
-        return False
+        return filled_values
+
+    start_row = 5
+    values_block = _values_block(changes_rows, start_row)
+    end_row = start_row + len(values_block) - 1
+    total_row = end_row + 1
+    if state is not None:
+        state["rows"] = values_block
+
+    # 6) Лист того же размера — переписываем только изменившиеся строки
+    if not static_colors and previous_rows is not None and len(previous_rows) == len(values_block):
+        written = _rewrite_changed_rows(spreadsheet, changes_title, previous_rows, values_block, start_row)
+        if written is not None:
+            print(f"✅ Лист '{changes_title}' обновлён частично. Изменённых строк: {written}")
+            return filled_values
+
+    # 7) Правка существующего листа по строкам
+    if render_mode == "patch":
+        touched = _patch_changes_sheet(
+            spreadsheet, changes_title, changes_rows, values_block, static_colors=static_colors
+        )
+        if touched is not None:
+            print(f"✅ Лист '{changes_title}' исправлен по строкам. Затронуто строк: {touched}")
+            return filled_values
+        print(f"↻ Лист '{changes_title}' не исправить по строкам — создаём заново.")
+
+    # 8) Пересоздать лист изменений одним запросом
+    if render_mode in ("single", "patch"):
+        _render_changes_single(
+            spreadsheet, changes_title, changes_rows, values_block, static_colors=static_colors
+        )
+        print(f"✅ Лист '{changes_title}' обновлён одним запросом. Строк: {len(changes_rows)}")
+        return filled_values
 
-    # 6) Пересоздать лист изменений
+    # 9) Пересоздать лист изменений по шагам
     _delete_worksheet_if_exists(spreadsheet, changes_title)
     ws = spreadsheet.add_worksheet(title=changes_title, rows=len(changes_rows) + 10, cols=6)
 
-    # 6) A1 и заголовки
-    ws.update("A1", [[f"Дата изменений: {datetime.now().strftime('%d.%m.%Y')}"]])
-
-    header_rows = [
-        ["Дата", "Факт", "", "Табель", "", "Разница"],
-        ["", "Вход", "Выход", "Вход", "Выход", ""],
-    ]
-    ws.update("A3:F4", header_rows, value_input_option="USER_ENTERED")
-    spreadsheet.batch_update(
-        {
-            "requests": [
-                {
-                    "mergeCells": {
-                        "range": {
-                            "sheetId": ws.id,
-                            "startRowIndex": 2,
-                            "endRowIndex": 3,
-                            "startColumnIndex": 1,
-                            "endColumnIndex": 3,
-                        },
-                        "mergeType": "MERGE_ALL",
-                    }
-                },
-                {
-                    "mergeCells": {
-                        "range": {
-                            "sheetId": ws.id,
-                            "startRowIndex": 2,
-                            "endRowIndex": 3,
-                            "startColumnIndex": 3,
-                            "endColumnIndex": 5,
-                        },
-                        "mergeType": "MERGE_ALL",
-                    }
-                },
-            ]
-        }
-    )
-
-    # 7) Данные одним блоком
-    start_row = 5
-    values_block = []
-    for idx, rr in enumerate(changes_rows):
-        row_num = start_row + idx
-        diff_formula = (
-            f'=ЕСЛИ(И(B{row_num}<>"";C{row_num}<>"";D{row_num}<>"";E{row_num}<>"");'
-            f'(E{row_num}-D{row_num})-(C{row_num}-B{row_num});"")'
-        )
-        if rr[0] == "":
-            fact_in = _format_time_for_sheet(rr[1], empty_as_zero=True)
-            fact_out = _format_time_for_sheet(rr[2], empty_as_zero=True)
-            site_in = _format_time_for_sheet(rr[3], empty_as_zero=True)
-            site_out = _format_time_for_sheet(rr[4], empty_as_zero=True)
-            values_block.append([rr[0], fact_in, fact_out, site_in, site_out, diff_formula])
-        else:
-            values_block.append([rr[0], rr[1], rr[2], rr[3], rr[4], diff_formula])
+    # 10) A1 и заголовки
+    ws.update("A1", [[_changes_date_label()]])
+    ws.update("A3:F4", _HEADER_ROWS, value_input_option="USER_ENTERED")
+    spreadsheet.batch_update({"requests": _header_merges(ws.id)})
 
-    end_row = start_row + len(values_block) - 1
+    # 11) Данные одним блоком
     ws.update(
         f"A{start_row}:F{end_row}",
         values_block,
         value_input_option="USER_ENTERED",
     )
 
-    # 8) Фон групп (как у тебя по образцу)
-    ws.batch_format(
-        [
-            {
-                "range": "A3:F4",
-                "format": {
-                    "textFormat": {"bold": True},
-                    "horizontalAlignment": "CENTER",
-                    "verticalAlignment": "MIDDLE",
-                },
-            },
-            {
-                "range": f"A{start_row}:F{end_row}",
-                "format": {
-                    "horizontalAlignment": "CENTER",
-                    "verticalAlignment": "MIDDLE",
-                },
-            },
-            {"range": f"B4:C{end_row}", "format": {"backgroundColor": _bg_my()}},
-            {"range": f"D4:E{end_row}", "format": {"backgroundColor": _bg_site()}},
-            {"range": f"B{start_row}:E{end_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "hh:mm"}}},
-            {"range": f"F{start_row}:F{end_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "[h]:mm"}}},
-        ]
-    )
+    # 12) Фон групп (как у тебя по образцу)
+    ws.batch_format(_body_formats(start_row, end_row))
 
-    # 9) Окраска текста: сайт и разница
-    for idx, rr in enumerate(changes_rows):
-        row_num = start_row + idx
-
-        cmp_in = rr[6]
-        cmp_out = rr[7]
-        if cmp_in != 0:
-            c = _color_red() if cmp_in < 0 else _color_green()
-            ws.format(f"D{row_num}", {"textFormat": {"foregroundColor": c}})
-        if cmp_out != 0:
-            c = _color_red() if cmp_out < 0 else _color_green()
-            ws.format(f"E{row_num}", {"textFormat": {"foregroundColor": c}})
+    # 13) Окраска текста: сайт и разница
+    color_calls = _apply_text_colors(ws, changes_rows, start_row, static_colors=static_colors)
+    print(f"🎨 Окраска текста: API-вызовов: {color_calls}")
 
-    # 10) Итого: только если есть строки, где разница реально посчитана
-    total_row = end_row + 1
-    total_formula = f"=СУММ(F{start_row}:F{end_row})"
+    # 14) Итого: только если есть строки, где разница реально посчитана
     ws.update(
         f"E{total_row}:F{total_row}",
-        [["Итого:", total_formula]],
+        _total_row_values(start_row, end_row),
         value_input_option="USER_ENTERED",
     )
-    ws.batch_format(
-        [
-            {"range": f"E{total_row}:F{total_row}", "format": {"textFormat": {"bold": True}}},
-            {"range": f"E{total_row}", "format": {"horizontalAlignment": "RIGHT"}},
-            {"range": f"F{total_row}", "format": {"horizontalAlignment": "LEFT"}},
-            {"range": f"F{total_row}", "format": {"textFormat": {"foregroundColor": {"red": 0, "green": 0, "blue": 0}}}},
-            {"range": f"F{total_row}:F{total_row}", "format": {"numberFormat": {"type": "TIME", "pattern": "[h]:mm"}}},
-        ]
-    )
+    ws.batch_format(_total_formats(total_row))
 
-    # Удаляем старые правила и задаём новые.
+    # 15) Удаляем старые правила и задаём новые.
     metadata = spreadsheet.fetch_sheet_metadata()
     existing_rules = []
     for sheet in metadata.get("sheets", []):
@@ -375,192 +751,7 @@ def build_changes_sheet(spreadsheet, base_ws, sheet_name: str, excel_path: str)
             delete_requests.append({"deleteConditionalFormatRule": {"sheetId": ws.id, "index": idx}})
         spreadsheet.batch_update({"requests": delete_requests})
 
-    rules = [
-        # Табель (D) vs Факт (B)
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 3,
-                            "endColumnIndex": 4,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=D{start_row}<B{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_red()}},
-                    },
-                },
-                "index": 0,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 3,
-                            "endColumnIndex": 4,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=D{start_row}>B{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_green()}},
-                    },
-                },
-                "index": 1,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 3,
-                            "endColumnIndex": 4,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=D{start_row}=B{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": {"red": 0, "green": 0, "blue": 0}}},
-                    },
-                },
-                "index": 2,
-            }
-        },
-        # Табель (E) vs Факт (C)
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 4,
-                            "endColumnIndex": 5,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=E{start_row}<C{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_red()}},
-                    },
-                },
-                "index": 3,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 4,
-                            "endColumnIndex": 5,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=E{start_row}>C{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_green()}},
-                    },
-                },
-                "index": 4,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 4,
-                            "endColumnIndex": 5,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=E{start_row}=C{start_row}"}]},
-                        "format": {"textFormat": {"foregroundColor": {"red": 0, "green": 0, "blue": 0}}},
-                    },
-                },
-                "index": 5,
-            }
-        },
-        # Разница (F)
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 5,
-                            "endColumnIndex": 6,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=F{start_row}<0"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_red()}},
-                    },
-                },
-                "index": 6,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 5,
-                            "endColumnIndex": 6,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=F{start_row}>0"}]},
-                        "format": {"textFormat": {"foregroundColor": _color_green()}},
-                    },
-                },
-                "index": 7,
-            }
-        },
-        {
-            "addConditionalFormatRule": {
-                "rule": {
-                    "ranges": [
-                        {
-                            "sheetId": ws.id,
-                            "startRowIndex": start_row - 1,
-                            "endRowIndex": end_row,
-                            "startColumnIndex": 5,
-                            "endColumnIndex": 6,
-                        }
-                    ],
-                    "booleanRule": {
-                        "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": f"=F{start_row}=0"}]},
-                        "format": {"textFormat": {"foregroundColor": {"red": 0, "green": 0, "blue": 0}}},
-                    },
-                },
-                "index": 8,
-            }
-        },
-    ]
-    spreadsheet.batch_update({"requests": rules})
+    spreadsheet.batch_update({"requests": _conditional_rules(ws.id, start_row, end_row)})
 
     print(f"✅ Лист '{changes_title}' обновлён. Строк: {len(changes_rows)}")
-    return True
+    return filled_values
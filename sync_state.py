@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from sync_diff import index_base
+
+
+def load_state(path: str) -> dict:
+    """
+    Состояние прошлых запусков: {"M.YY": {"site": hash, "base": hash, "rows": [...]}}.
+    Нет файла или он битый — пустое состояние (полная пересборка).
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️ Файл состояния {path} не прочитан — начинаем с нуля.")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_state(path: str, state: dict) -> None:
+    temp_path = f"{path}.new"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+
+
+def content_hash(data) -> str:
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def site_hash(site_by_date: dict[datetime, list]) -> str:
+    """
+    Хэш разобранных данных сайта (не файла: xlsx при каждом экспорте отличается байтами).
+    """
+    return content_hash(
+        [[d.strftime("%Y-%m-%d"), [[iv.start, iv.end] for iv in intervals]] for d, intervals in site_by_date.items()]
+    )
+
+
+def base_hash(base_values: list[list[str]]) -> str:
+    """
+    Хэш того, что из B:L идёт в сравнение (дата, строка, интервалы в минутах):
+    "7:00" и "07:00" или правка других столбцов листа пересборку не вызывают.
+    """
+    return content_hash(
+        [[date_text, row_num, main.start, main.end, bonus.start, bonus.end] for date_text, (row_num, main, bonus) in index_base(base_values).items()]
+    )
+
+
+def is_unchanged(entry: dict, site: str, base: str) -> bool:
+    return bool(entry) and entry.get("site") == site and entry.get("base") == base
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from fake_sheets import FakeSpreadsheet
+from sheets_quota import SheetsScheduler
+from sync_diff import Interval
+from sync_logic import build_changes_sheet
+
+TITLE = "Изменения 12.25"
+
+# лист месяца: 1–6 декабря, везде 08:00–16:00 (без пустых ячеек — дозаполнений нет)
+BASE = [["", "Дата", "Вход", "Выход"]] + [["", f"0{day}.12.2025", "08:00", "16:00"] for day in range(1, 7)]
+
+
+def _site(**days: list[tuple[int, int]]) -> dict[datetime, list[Interval]]:
+    """
+    Выгрузка: по умолчанию как на листе месяца, d<N> — свои интервалы за N-е.
+    """
+    site = {datetime(2025, 12, day): [Interval(480, 960)] for day in range(1, 7)}
+    for key, intervals in days.items():
+        site[datetime(2025, 12, int(key[1:]))] = [Interval(start, end) for start, end in intervals]
+    return site
+
+
+SEQUENCES = {
+    "grow": [_site(d1=[(420, 960)], d3=[(480, 900)]), _site(d1=[(420, 960)], d2=[(480, 1000)], d3=[(480, 900)], d5=[(500, 960)])],
+    "shrink": [_site(d1=[(420, 960)], d2=[(480, 1000)], d3=[(480, 900)], d5=[(500, 960)]), _site(d2=[(480, 1000)], d5=[(500, 960)])],
+    "bonus": [
+        _site(d2=[(480, 1000)]),
+        _site(d2=[(480, 960), (1020, 1080)], d4=[(400, 960)]),
+        _site(d2=[(480, 1000)], d4=[(400, 960)]),
+    ],
+    "same_size": [_site(d1=[(420, 960)], d3=[(480, 900)]), _site(d1=[(430, 960)], d4=[(480, 900)])],
+    "empty_and_back": [_site(d1=[(420, 960)]), _site(), _site(d6=[(480, 1020)])],
+}
+
+
+def _open() -> tuple[FakeSpreadsheet, object]:
+    fake = FakeSpreadsheet("t", values={"12.25": [list(row) for row in BASE]})
+    return fake, SheetsScheduler(reads_per_min=6000, writes_per_min=6000, base_delay=0.01).wrap(fake)
+
+
+def _build(spreadsheet, site_by_date, render_mode: str, state: dict | None = None) -> None:
+    build_changes_sheet(
+        spreadsheet=spreadsheet,
+        base_ws=spreadsheet.worksheet("12.25"),
+        sheet_name="12.25",
+        excel_path="",
+        render_mode=render_mode,
+        site_by_date=site_by_date,
+        state=state,
+    )
+    spreadsheet.flush()
+
+
+def _changes_sheet(fake: FakeSpreadsheet):
+    """
+    Значения, объединения и правила условного форматирования листа изменений (None — листа нет).
+    """
+    for ws in fake.sheets:
+        if ws.title == TITLE:
+            merges = sorted(tuple(sorted((k, v) for k, v in m.items() if k != "sheetId")) for m in ws.merges)
+            rules = [[{k: v for k, v in r.items() if k != "sheetId"} for r in rule["ranges"]] for rule in ws.conditional_formats]
+            return fake.dump()[TITLE], merges, rules
+    return None
+
+
+@pytest.mark.parametrize("name", sorted(SEQUENCES))
+@pytest.mark.parametrize("with_state", [False, True], ids=["patch", "patch_state"])
+def test_patch_matches_single_and_steps(name, with_state):
+    sequence = SEQUENCES[name]
+    fake, spreadsheet = _open()
+    state = {} if with_state else None
+    for site_by_date in sequence:
+        _build(spreadsheet, site_by_date, "patch", state)
+
+        expected = []
+        for mode in ("single", "steps"):
+            fresh_fake, fresh = _open()
+            _build(fresh, site_by_date, mode)
+            expected.append(_changes_sheet(fresh_fake))
+        assert expected[0] == expected[1]
+        assert _changes_sheet(fake) == expected[0]
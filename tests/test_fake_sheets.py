@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+
+import fake_sheets
+from fake_sheets import FakeSpreadsheet
+from sheets_client import open_spreadsheet
+from sheets_quota import SheetsScheduler
+from sync_diff import Interval
+from sync_logic import build_changes_sheet
+
+
+def test_changes_sheet_on_fake_backend(tmp_path, monkeypatch):
+    # без отчёта и сохранения при выходе из pytest
+    monkeypatch.setattr(fake_sheets, "_OPENED", [])
+    fake_file = tmp_path / "fake_sheets.json"
+    fake_file.write_text(
+        json.dumps({"12.25": [["", "Дата", "Вход", "Выход"], ["", "01.12.2025", "08:00", "16:00"], ["", "02.12.2025"]]}),
+        encoding="utf-8",
+    )
+
+    fake = open_spreadsheet("g", "", backend="fake", fake_file=str(fake_file))
+    assert isinstance(fake, FakeSpreadsheet)
+    spreadsheet = SheetsScheduler(reads_per_min=6000, writes_per_min=6000, base_delay=0.01).wrap(fake)
+
+    site = {datetime(2025, 12, 1): [Interval(420, 960)], datetime(2025, 12, 2): [Interval(480, 960)]}
+    for render_mode in ("steps", "single"):
+        build_changes_sheet(
+            spreadsheet=spreadsheet,
+            base_ws=spreadsheet.worksheet("12.25"),
+            sheet_name="12.25",
+            excel_path="",
+            render_mode=render_mode,
+            site_by_date=site,
+        )
+        spreadsheet.flush()
+        sheets = fake.dump()
+        # дозаполнение 2-го и строка расхождения за 1-е (время из numberValue + numberFormat)
+        assert sheets["12.25"][2][2:4] == ["08:00", "16:00"]
+        assert sheets["Изменения 12.25"][4][:5] == ["01.12.2025", "08:00", "16:00", "07:00", "16:00"]
+        assert sheets["Изменения 12.25"][5][4:] == ["Итого:", "=СУММ(F5:F5)"]
+
+    m = fake.metrics
+    assert m.calls["get_values"] == 2
+    assert m.calls["batch_update"] >= 2
+    assert m.reads >= 2 and m.writes >= 3
+    assert m.request_bytes > 0 and m.response_bytes > 0
+    assert m.quota_errors == 0
+
+    fake.save()
+    saved = json.loads(fake_file.read_text(encoding="utf-8"))
+    assert saved["Изменения 12.25"] == fake.dump()["Изменения 12.25"]
+
+
+def test_row_shift_moves_formula_references():
+    fake = FakeSpreadsheet("t", values={"s": [["1"], ["2"], ["=СУММ(A1:A2)"]]})
+    sheet_id = fake.sheets[0].id
+    fake.batch_update({"requests": [{"insertDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": 1, "endIndex": 2}}}]})
+    assert fake.dump()["s"] == [["1"], [""], ["2"], ["=СУММ(A1:A3)"]]
+    fake.batch_update({"requests": [{"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": 0, "endIndex": 2}}}]})
+    assert fake.dump()["s"] == [["2"], ["=СУММ(A1:A1)"]]
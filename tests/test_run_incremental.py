@@ -0,0 +1,46 @@
+from openpyxl import Workbook
+
+import run
+from config import load_config
+from fake_sheets import FakeSpreadsheet
+
+
+def test_fill_in_does_not_force_rebuild_next_run(tmp_path, monkeypatch, capsys):
+    for name, value in {
+        "SITE_USERNAME": "u",
+        "SITE_PASSWORD": "p",
+        "GSHEET_ID": "g",
+        "SHEETS_BACKEND": "fake",
+        "RENDER_MODE": "single",
+        "INCREMENTAL": "1",
+        "STATE_FILE": str(tmp_path / "sync_state.json"),
+        "SHEETS_READS_PER_MIN": "6000",
+        "SHEETS_WRITES_PER_MIN": "6000",
+    }.items():
+        monkeypatch.setenv(name, value)
+    cfg = load_config()
+
+    excel_path = str(tmp_path / "12.25.xlsx")
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["תאריך", "כניסה", "יציאה"])
+    sheet.append(["01/12/2025", "07:00", "15:00"])
+    sheet.append(["02/12/2025", "08:00", "16:00"])
+    workbook.save(excel_path)
+
+    # 1-е — расхождение, 2-е — пустая строка: дозаполнится с сайта
+    fake = FakeSpreadsheet(
+        "g",
+        values={"12.25": [["", "Дата", "Вход", "Выход"], ["", "01.12.2025", "08:00", "16:00"], ["", "02.12.2025"]]},
+    )
+    spreadsheet = run._scheduler(cfg).wrap(fake)
+
+    run._build_month(cfg, spreadsheet, spreadsheet.worksheet("12.25"), "12.25", excel_path)
+    assert fake.dump()["12.25"][2][2:4] == ["08:00", "16:00"]
+    assert "Изменения 12.25" in fake.dump()
+    writes = fake.metrics.writes
+    capsys.readouterr()
+
+    run._build_month(cfg, spreadsheet, spreadsheet.worksheet("12.25"), "12.25", excel_path)
+    assert "не менялись" in capsys.readouterr().out
+    assert fake.metrics.writes == writes
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+from gspread.exceptions import APIError
+from openpyxl import Workbook
+
+import run
+from config import load_config
+from fake_sheets import FakeSpreadsheet
+from sheets_client import month_sheet_name
+
+
+class _Portal:
+    """
+    Выгрузка текущего месяца: 1-е число 07:00–15:00, 2-е — 08:00–16:00.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+
+    def export(self, first_day: str, excel_path: str) -> str:
+        if self.fail:
+            raise RuntimeError("портал недоступен")
+        now = datetime.now()
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(["תאריך", "כניסה", "יציאה"])
+        sheet.append([f"01/{now:%m/%Y}", "07:00", "15:00"])
+        sheet.append([f"02/{now:%m/%Y}", "08:00", "16:00"])
+        workbook.save(excel_path)
+        return excel_path
+
+
+@pytest.fixture
+def watch(tmp_path, monkeypatch):
+    for name, value in {
+        "SITE_USERNAME": "u",
+        "SITE_PASSWORD": "p",
+        "GSHEET_ID": "g",
+        "SHEETS_BACKEND": "fake",
+        "RENDER_MODE": "single",
+        "EXCEL_PATH": str(tmp_path / "local_data.xlsx"),
+        "STATE_FILE": str(tmp_path / "sync_state.json"),
+        "SHEETS_READS_PER_MIN": "6000",
+        "SHEETS_WRITES_PER_MIN": "6000",
+        "PORTAL_TIMINGS_FILE": "",
+    }.items():
+        monkeypatch.setenv(name, value)
+    cfg = load_config()
+
+    now = datetime.now()
+    fake = FakeSpreadsheet(
+        "g",
+        values={
+            month_sheet_name(): [
+                ["", "Дата", "Вход", "Выход"],
+                ["", f"01.{now:%m.%Y}", "08:00", "16:00"],
+                ["", f"02.{now:%m.%Y}", "08:00", "16:00"],
+            ]
+        },
+    )
+    return cfg, fake, run._scheduler(cfg).wrap(fake), str(tmp_path)
+
+
+def test_failed_sheets_write_does_not_break_next_tick(watch):
+    cfg, fake, spreadsheet, history_dir = watch
+    last: dict = {}
+    changes_title = f"Изменения {month_sheet_name()}"
+
+    fake.fail_next("batch_update", 400)
+    with pytest.raises(APIError) as failed:
+        run._watch_tick(cfg, _Portal(), spreadsheet, history_dir, last)
+    # ошибка таблицы — сессию портала не пересоздаём
+    assert run._watch_recover(failed.value, spreadsheet) is False
+    assert changes_title not in fake.dump()
+
+    run._watch_tick(cfg, _Portal(), spreadsheet, history_dir, last)
+    assert changes_title in fake.dump()
+
+
+def test_failed_export_reopens_portal(watch):
+    cfg, fake, spreadsheet, history_dir = watch
+    with pytest.raises(run._ExportFailed) as failed:
+        run._watch_tick(cfg, _Portal(fail=True), spreadsheet, history_dir, {})
+    assert run._watch_recover(failed.value, spreadsheet) is True
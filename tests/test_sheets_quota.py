@@ -0,0 +1,105 @@
+import pytest
+from gspread.exceptions import APIError
+
+import sheets_quota
+from fake_sheets import FakeSpreadsheet
+from sheets_quota import DeferredWriteError, SheetsScheduler
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(sheets_quota.time, "sleep", delays.append)
+    return delays
+
+
+def _open(values=None):
+    fake = FakeSpreadsheet("t", values=values or {"12.25": [["Дата", "Вход", "Выход"]]})
+    scheduler = SheetsScheduler(reads_per_min=6000, writes_per_min=6000, base_delay=0.01)
+    return fake, scheduler, scheduler.wrap(fake)
+
+
+def test_adjacent_writes_are_coalesced(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    ws = spreadsheet.worksheet("12.25")
+    ws.update("A2", [["01.12.2025"]], value_input_option="USER_ENTERED")
+    ws.update("B2:C2", [["07:00", "15:00"]], value_input_option="USER_ENTERED")
+    ws.format("A2", {"textFormat": {"bold": True}})
+    ws.format("B2", {"textFormat": {"bold": True}})
+    assert fake.metrics.writes == 0
+
+    spreadsheet.flush()
+    assert fake.metrics.calls["ws.batch_update"] == 1
+    assert fake.metrics.calls["batch_format"] == 1
+    assert "update" not in fake.metrics.calls
+    assert scheduler.metrics["coalesced"] == 2
+    assert fake.dump()["12.25"][1] == ["01.12.2025", "07:00", "15:00"]
+
+
+def test_non_idempotent_request_retries_429_but_not_5xx(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    sheet_id = fake.sheets[0].id
+    insert = {"insertDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": 1, "endIndex": 2}}}
+
+    fake.fail_next("batch_update", 429)
+    spreadsheet.batch_update({"requests": [insert]})
+    spreadsheet.flush()
+    assert fake.metrics.calls["batch_update"] == 2
+    assert scheduler.metrics["retries"] == 1
+
+    fake.fail_next("batch_update", 503)
+    spreadsheet.batch_update({"requests": [insert]})
+    with pytest.raises(APIError) as failed:
+        spreadsheet.flush()
+    assert failed.value.code == 503
+    assert fake.metrics.calls["batch_update"] == 3
+    assert scheduler.metrics["retries"] == 1
+
+
+def test_idempotent_write_retries_5xx(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    ws = spreadsheet.worksheet("12.25")
+    fake.fail_next("update", 503, times=2)
+    ws.update("A2", [["x"]])
+    spreadsheet.flush()
+    assert fake.metrics.calls["update"] == 3
+    assert fake.sheets[0].cells[(1, 0)] == "x"
+
+
+def test_retry_after_is_honoured(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    ws = spreadsheet.worksheet("12.25")
+    fake.fail_next("get_values", 429, retry_after=7)
+    assert ws.get_values("A1") == [["Дата"]]
+    assert 7.0 in sleeps
+    assert scheduler.metrics["backoff_s"] >= 7.0
+
+
+def test_failed_implicit_send_is_raised_once(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    ws = spreadsheet.worksheet("12.25")
+    fake.fail_next("update", 400)
+    ws.update("A2", [["x"]])
+
+    # запись уходит перед чтением — ошибка записи, а не чтения
+    with pytest.raises(DeferredWriteError) as failed:
+        ws.get_values("A:C")
+    assert isinstance(failed.value.__cause__, APIError)
+    assert failed.value.__cause__.code == 400
+
+    # дальше таблица работает: и чтения, и записи
+    assert ws.get_values("A1") == [["Дата"]]
+    ws.update("A2", [["y"]])
+    spreadsheet.flush()
+    assert fake.sheets[0].cells[(1, 0)] == "y"
+
+
+def test_flush_raises_write_error_as_is(sleeps):
+    fake, scheduler, spreadsheet = _open()
+    ws = spreadsheet.worksheet("12.25")
+    fake.fail_next("update", 400)
+    ws.update("A2", [["x"]])
+    with pytest.raises(APIError):
+        spreadsheet.flush()
+    spreadsheet.flush()
+    assert (1, 0) not in fake.sheets[0].cells
@@ -0,0 +1,97 @@
+from datetime import datetime, time
+
+import pandas as pd
+from openpyxl import Workbook
+
+from site_excel import CACHE_SUFFIX, parse_date_text, read_site_by_date, read_site_by_date_cached
+from sync_logic import group_site_by_date, parse_site_frame
+
+
+def _export(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["תאריך", "כניסה", "יציאה"])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def test_text_dates():
+    assert parse_date_text("2025-01-05") == datetime(2025, 1, 5)
+    assert parse_date_text("2025/01/05") == datetime(2025, 1, 5)
+    assert parse_date_text("05/01/2025") == datetime(2025, 1, 5)
+    assert parse_date_text("5.1.2025") == datetime(2025, 1, 5)
+    assert parse_date_text("мусор") is None
+
+
+def test_streaming_and_pandas_paths_agree(tmp_path):
+    path = tmp_path / "export.xlsx"
+    _export(
+        path,
+        [
+            ["2025-01-05", "07:00", "15:00"],
+            ["06/01/2025", time(8, 30), "16:45:00"],
+            [datetime(2025, 1, 7), "09:00", None],
+            ["8.1.2025 00:00", None, "17:00"],
+            ["2025-01-09 00:00:00", "10:00", "18:00"],
+            ["9/1/2025", "19:00", "20:00"],
+            [None, "07:00", "15:00"],
+            ["2025-01-10", None, None],
+        ],
+    )
+
+    streamed = read_site_by_date(str(path))
+    via_pandas = group_site_by_date(parse_site_frame(pd.read_excel(path)))
+
+    assert {d.date(): [(iv.start, iv.end) for iv in ivs] for d, ivs in streamed.items()} == {
+        d.date(): [(iv.start, iv.end) for iv in ivs] for d, ivs in via_pandas.items()
+    }
+    assert [d.day for d in streamed] == [5, 6, 7, 8, 9]
+    assert [(iv.start, iv.end) for iv in streamed[datetime(2025, 1, 9)]] == [(600, 1080), (1140, 1200)]
+
+
+def test_time_cells_parse_the_same_on_both_paths(tmp_path):
+    path = tmp_path / "export.xlsx"
+    _export(
+        path,
+        [
+            ["01/01/2025", "7 :00", "15:00"],
+            ["02/01/2025", "-0:30", "24:00"],
+            ["03/01/2025", time(8, 5), "8:5"],
+            ["04/01/2025", "мусор", None],
+        ],
+    )
+
+    streamed = read_site_by_date(str(path))
+    via_pandas = group_site_by_date(parse_site_frame(pd.read_excel(path)))
+
+    expected = {1: [(420, 900)], 2: [(30, -1)], 3: [(485, 485)]}
+    assert {d.day: [(iv.start, iv.end) for iv in ivs] for d, ivs in streamed.items()} == expected
+    assert {d.day: [(iv.start, iv.end) for iv in ivs] for d, ivs in via_pandas.items()} == expected
+
+
+def test_intervals_cache_round_trip_and_invalidation(tmp_path):
+    path = tmp_path / "12.25.xlsx"
+    _export(path, [["01/12/2025", "07:00", "15:00"], ["01/12/2025", "16:00", None]])
+    parsed = []
+
+    def _read(excel_path):
+        parsed.append(excel_path)
+        return read_site_by_date(excel_path)
+
+    first = read_site_by_date_cached(str(path), read=_read)
+    assert read_site_by_date_cached(str(path), read=_read) == first
+    assert len(parsed) == 1
+
+    # кэш прежней версии разбора не используется и перезаписывается
+    cache = tmp_path / f"12.25.xlsx{CACHE_SUFFIX}"
+    raw = cache.read_bytes()
+    cache.write_bytes(b"YLMI1" + raw[5:])
+    assert read_site_by_date_cached(str(path), read=_read) == first
+    assert len(parsed) == 2
+    assert cache.read_bytes() == raw
+
+    # другой файл — другой SHA-256
+    _export(path, [["02/12/2025", "08:00", "16:00"]])
+    assert list(read_site_by_date_cached(str(path), read=_read)) == [datetime(2025, 12, 2)]
+    assert len(parsed) == 3
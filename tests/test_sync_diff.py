@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from sync_diff import NO_TIME, Interval, apply_base_updates, compute_changes
+
+DAY = datetime(2025, 12, 1)
+
+
+def _row(date_text: str, c="", d="", k="", l="") -> list[str]:
+    """
+    Строка B:L листа месяца: дата в B, вход/выход в C/D, бонус в K/L.
+    """
+    return [date_text, c, d, "", "", "", "", "", "", k, l]
+
+
+def _base(*rows: list[str]) -> list[list[str]]:
+    return [["Дата", "Вход", "Выход"], *rows]
+
+
+def _ranges(base_updates: list[dict]) -> dict[str, str]:
+    return {u["range"]: u["values"][0][0] for u in base_updates}
+
+
+def test_empty_row_is_filled_with_bonus():
+    site = {DAY: [Interval(1020, 1080), Interval(420, 900)]}
+    base_updates, changes_rows = compute_changes(site, _base(_row("01.12.2025")))
+    # бонус — второй интервал по времени начала, а не по порядку в выгрузке
+    assert _ranges(base_updates) == {"C2": "07:00", "D2": "15:00", "K2": "17:00", "L2": "18:00"}
+    # после дозаполнения расхождений нет
+    assert changes_rows == []
+
+
+def test_bonus_is_not_filled_when_main_was_partly_set():
+    site = {DAY: [Interval(420, 900), Interval(1020, 1080)]}
+    base_updates, changes_rows = compute_changes(site, _base(_row("01.12.2025", c="07:00")))
+    assert _ranges(base_updates) == {"D2": "15:00"}
+    assert changes_rows == [
+        ["01.12.2025", 420, 900, 420, 900, "", 0, 0],
+        ["", NO_TIME, NO_TIME, 1020, 1080, "", 0, 0],
+    ]
+
+
+def test_bonus_is_not_filled_when_main_was_set():
+    site = {DAY: [Interval(420, 900), Interval(1020, 1080)]}
+    base_updates, changes_rows = compute_changes(site, _base(_row("01.12.2025", c="7:00", d="15:00")))
+    assert base_updates == []
+    assert [row[0] for row in changes_rows] == ["01.12.2025", ""]
+
+
+def test_slash_dates_are_found():
+    site = {DAY: [Interval(420, 900)]}
+    base_updates, changes_rows = compute_changes(site, _base(_row("01/12/2025", c="08:00", d="16:00")))
+    assert base_updates == []
+    # сайт меньше эталона и на входе, и на выходе
+    assert changes_rows == [["01/12/2025", 480, 960, 420, 900, "", -1, -1]]
+
+
+def test_bonus_row_follows_main_row():
+    site = {DAY: [Interval(480, 960), Interval(1020, 1100)]}
+    base = _base(_row("01.12.2025", c="08:00", d="16:00", k="17:00", l="18:00"))
+    _, changes_rows = compute_changes(site, base)
+    assert changes_rows == [
+        ["01.12.2025", 480, 960, 480, 960, "", 0, 0],
+        ["", 1020, 1080, 1020, 1100, "", 0, 1],
+    ]
+
+
+def test_dates_without_diff_or_base_row_are_skipped():
+    site = {
+        DAY: [Interval(480, 960)],
+        datetime(2025, 12, 2): [Interval(480, 960), Interval(1020, 1080)],
+        datetime(2025, 12, 3): [Interval(420, 900)],
+    }
+    base = _base(
+        _row("01.12.2025", c="8:00", d="16:00"),
+        _row("02.12.2025", c="08:00", d="16:00", k="17:00", l="18:00"),
+    )
+    assert compute_changes(site, base) == ([], [])
+
+
+def test_apply_base_updates_copies_and_pads():
+    base = _base(_row("01.12.2025"), ["02.12.2025"])
+    filled = apply_base_updates(base, [{"range": "C2", "values": [["07:00"]]}, {"range": "L3", "values": [["18:00"]]}])
+    assert filled[1][1] == "07:00"
+    assert filled[2] == ["02.12.2025", "", "", "", "", "", "", "", "", "", "18:00"]
+    assert base[1][1] == "" and base[2] == ["02.12.2025"]
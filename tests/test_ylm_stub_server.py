@@ -0,0 +1,60 @@
+import json
+import threading
+
+import requests
+
+from ylm_http import HttpPortalClient
+from ylm_stub_server import make_server
+
+
+def _serve(tmp_path, entries):
+    recipe_file = tmp_path / "portal_recipe.json"
+    recipe_file.write_text(json.dumps({"version": 1, "requests": entries}), encoding="utf-8")
+    server = make_server(str(recipe_file), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, recipe_file, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_url_dated_recipe_round_trip(tmp_path):
+    (tmp_path / "report.bin").write_bytes(b"PK\x03\x04report")
+    entries = [
+        {
+            "method": "GET",
+            "url": "{{origin}}/api/report?from={{first_day}}&to={{last_day}}",
+            "headers": {},
+            "post_data": None,
+            "is_file": True,
+            "response": {"status": 200, "content_type": "application/octet-stream", "body_file": "report.bin"},
+        }
+    ]
+    server, recipe_file, base_url = _serve(tmp_path, entries)
+    try:
+        # другой месяц, чем при записи: даты с "/" должны совпасть с маршрутом
+        excel_path = tmp_path / "3.26.xlsx"
+        with HttpPortalClient(str(recipe_file), base_url=base_url) as client:
+            client.export("01/03/2026", str(excel_path))
+        assert excel_path.read_bytes() == b"PK\x03\x04report"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unknown_request_is_404(tmp_path):
+    entries = [
+        {
+            "method": "GET",
+            "url": "{{origin}}/api/report?from={{first_day_url}}",
+            "headers": {},
+            "post_data": None,
+            "is_file": True,
+            "response": {"status": 200, "content_type": "application/octet-stream", "body_file": None},
+        }
+    ]
+    server, _, base_url = _serve(tmp_path, entries)
+    try:
+        response = requests.get(f"{base_url}/api/other", timeout=5)
+        assert response.status_code == 404
+        assert "Нет записанного ответа" in response.content.decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,18 +1,20 @@
 import os
 import json
+import re
 import time
 import pandas as pd
-import gspread
 from playwright.sync_api import sync_playwright
-from google.oauth2.service_account import Credentials
 from datetime import datetime
 
-USERNAME = os.environ["SITE_USERNAME"]
-PASSWORD = os.environ["SITE_PASSWORD"]
-GSHEET_ID = os.environ["GSHEET_ID"]
-GOOGLE_JSON = json.loads(os.environ["GOOGLE_JSON"])
-if "private_key" in GOOGLE_JSON and isinstance(GOOGLE_JSON["private_key"], str):
-    GOOGLE_JSON["private_key"] = GOOGLE_JSON["private_key"].replace("\\n", "\n")
+from sheets_client import authorized_client
+
+
+def _google_json() -> dict:
+    # env читаем при запуске, а не при импорте (модуль импортирует bench_update_hours.py)
+    info = json.loads(os.environ["GOOGLE_JSON"])
+    if "private_key" in info and isinstance(info["private_key"], str):
+        info["private_key"] = info["private_key"].replace("\\n", "\n")
+    return info
 
 
 def _format_time(value) -> str:
@@ -26,13 +28,124 @@ def _format_time(value) -> str:
         return s[:5]
     return parsed.strftime("%H:%M")
 
+
+_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})(?::(\d{2}))?$")
+_ISO_DATE_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+_SLASH_DATE_RE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+
+def _format_time_fast(value) -> str:
+    """
+    _format_time без pd.to_datetime для обычных значений: объекты времени
+    и строки "H:MM" / "HH:MM:SS"; остальное — через _format_time.
+    """
+    if hasattr(value, "strftime"):
+        return value.strftime("%H:%M")
+    match = _TIME_RE.match(str(value).strip())
+    if match:
+        hh, mm, ss = int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)
+        if hh <= 23 and mm <= 59 and ss <= 59:
+            return f"{hh:02d}:{mm:02d}"
+    return _format_time(value)
+
+
+def _format_times(col: pd.Series) -> list:
+    """
+    _format_time для столбца: каждое уникальное значение разбирается один раз.
+    Пустые ячейки -> "".
+    """
+    values = col.where(col.notna(), "")
+    formatted = {value: _format_time_fast(value) for value in pd.unique(values)}
+    return [formatted[value] for value in values]
+
+
+def _format_date(date_str: str) -> str:
+    match = _ISO_DATE_RE.match(date_str)
+    if match:
+        try:
+            return datetime(*(int(g) for g in match.groups())).strftime("%d/%m/%Y")
+        except ValueError:
+            pass
+    match = _SLASH_DATE_RE.match(date_str)
+    if match:
+        # как pd.to_datetime: сначала месяц первым, если не дата — день первым
+        first, second, year = (int(g) for g in match.groups())
+        for month, day in ((first, second), (second, first)):
+            try:
+                return datetime(year, month, day).strftime("%d/%m/%Y")
+            except ValueError:
+                continue
+    try:
+        return pd.to_datetime(date_str).strftime("%d/%m/%Y")
+    except Exception:
+        return date_str
+
+
+def _format_dates(col: pd.Series) -> list:
+    """
+    (date_str, formatted_date) для каждой строки: дата как текст (без времени)
+    и она же в формате таблицы DD/MM/YYYY. Каждая дата разбирается один раз.
+    """
+    date_strs = [str(value).split()[0] for value in col]
+    formatted = {date_str: _format_date(date_str) for date_str in set(date_strs)}
+    return [(date_str, formatted[date_str]) for date_str in date_strs]
+
+
+def build_date_index(column_b: list) -> dict:
+    """
+    Слово из столбца B -> номер первой строки (1-based), где оно встречается.
+    Ячейка "01/12/2025" и "01/12/2025 א'" обе находятся по "01/12/2025".
+    """
+    index = {}
+    for i, cell in enumerate(column_b):
+        for token in str(cell).split():
+            index.setdefault(token, i + 1)
+    return index
+
+
+def _date_keys(date_str: str, formatted_date: str) -> list:
+    keys = [formatted_date, date_str]
+    # "1/12/2025" раньше находился подстрокой в "01/12/2025" — дополняем нулями
+    for sep in "/.":
+        parts = date_str.split(sep)
+        if len(parts) == 3 and all(part.isdigit() for part in parts):
+            keys.append(sep.join([parts[0].zfill(2), parts[1].zfill(2), parts[2]]))
+    return keys
+
+
+def compute_updates(df_clean: pd.DataFrame, column_b: list) -> list:
+    """
+    Обновления C:D для строк выгрузки, дата которых есть в столбце B
+    (первая строка листа с этой датой).
+    """
+    index = build_date_index(column_b)
+    entry_times = _format_times(df_clean["כניסה"])
+    exit_times = _format_times(df_clean["יציאה"])
+
+    updates = []
+    for (date_str, formatted_date), entry_time, exit_time in zip(
+        _format_dates(df_clean["תאריך"]), entry_times, exit_times
+    ):
+        rows = [index[key] for key in _date_keys(date_str, formatted_date) if key in index]
+        if not rows:
+            continue
+        row_num = min(rows)
+        updates.append({
+            "range": f"C{row_num}:D{row_num}",
+            "values": [[entry_time, exit_time]],
+        })
+        print(f"Обновлено: {formatted_date}")
+    return updates
+
+
 def get_sheet():
-    scopes = ['https://www.googleapis.com/auth/spreadsheets']
-    creds = Credentials.from_service_account_info(GOOGLE_JSON, scopes=scopes)
-    client = gspread.authorize(creds)
-    return client.open_by_key(GSHEET_ID)
+    # общий клиент и кэш токена — как в sheets_client.open_spreadsheet
+    client = authorized_client(_google_json(), token_cache=os.getenv("GOOGLE_TOKEN_CACHE", "").strip())
+    return client.open_by_key(os.environ["GSHEET_ID"])
 
 def run():
+    username = os.environ["SITE_USERNAME"]
+    password = os.environ["SITE_PASSWORD"]
     with sync_playwright() as p:
         # Используем эмуляцию реального устройства
         browser = p.chromium.launch(headless=True)
@@ -51,9 +164,9 @@ def run():
             print("Ожидаю поле ввода #Username...")
             page.wait_for_selector("#Username", timeout=60000)
             
-            page.fill("#Username", USERNAME)
+            page.fill("#Username", username)
             time.sleep(1)
-            page.fill("#YlmCode", PASSWORD)
+            page.fill("#YlmCode", password)
             time.sleep(1)
             
             print("Нажимаю вход...")
@@ -96,31 +209,8 @@ def run():
             print(f"Лист {sheet_name} не найден!")
             return
 
-        all_values = worksheet.get_all_values()
-        
-        updates = []
-        for index, row in df_clean.iterrows():
-            date_str = str(row['תאריך']).split()[0] # На случай если там есть время
-            # Исправляем формат даты (в Excel 2025-12-01, в таблице может быть 01/12/2025)
-            # Если в таблице даты через '/', конвертируем:
-            try:
-                date_obj = pd.to_datetime(date_str)
-                formatted_date = date_obj.strftime('%d/%m/%Y')
-            except:
-                formatted_date = date_str
-
-            entry_time = _format_time(row["כניסה"])
-            exit_time = _format_time(row["יציאה"])
-
-            for i, sheet_row in enumerate(all_values):
-                if len(sheet_row) > 1 and (formatted_date in sheet_row[1] or date_str in sheet_row[1]):
-                    row_num = i + 1
-                    updates.append({
-                        "range": f"C{row_num}:D{row_num}",
-                        "values": [[entry_time, exit_time]],
-                    })
-                    print(f"Обновлено: {formatted_date}")
-                    break
+        # Нужен только столбец дат: индекс дата -> строка вместо перебора всего листа
+        updates = compute_updates(df_clean, worksheet.col_values(2))
         if updates:
             try:
                 worksheet.batch_update(updates, value_input_option="USER_ENTERED")
@@ -2,37 +2,59 @@ from __future__ import annotations
 
 from typing import Any
 
+LOGIN_URL = "https://ins.ylm.co.il/#/employeeLogin"
+REPORT_BUTTON = "button[ng-click='vm.employeeReport();']"
+DATE_INPUT = "input[ng-model='vm.report.FromDate']"
+DISPLAY_BUTTON = "button[ng-click='vm.displayReportResult(true)']"
+EXCEL_BUTTON = "button[ng-click='executeExcelBtn()']"
 
-def build_actions(site_username: str, site_password: str, first_day: str) -> list[dict[str, Any]]:
-    report_button = "button[ng-click='vm.employeeReport();']"
-    date_input = "input[ng-model='vm.report.FromDate']"
-    display_button = "button[ng-click='vm.displayReportResult(true)']"
-    excel_button = "button[ng-click='executeExcelBtn()']"
 
+def build_login_actions(site_username: str, site_password: str) -> list[dict[str, Any]]:
     return [
-        {"type": "goto", "url": "https://ins.ylm.co.il/#/employeeLogin", "wait_until": "domcontentloaded"},
+        {"type": "goto", "url": LOGIN_URL, "wait_until": "domcontentloaded"},
         {"type": "wait", "selector": "#Username", "timeout": 60000},
         {"type": "fill", "selector": "#Username", "value": site_username},
         {"type": "fill", "selector": "#YlmCode", "value": site_password},
         {"type": "click", "selector": "button[type='submit']"},
+    ]
+
+
+def build_report_actions(first_day: str, open_report: bool = True) -> list[dict[str, Any]]:
+    """
+    Отчёт за месяц с first_day и скачивание Excel.
+    open_report=False — отчёт уже открыт (следующий месяц в той же сессии),
+    меняем только дату.
+    """
+    report_button = REPORT_BUTTON
+    date_input = DATE_INPUT
+    display_button = DISPLAY_BUTTON
+    excel_button = EXCEL_BUTTON
+
+    open_actions = [
         {"type": "wait", "selector": report_button},
         {"type": "click", "selector": report_button},
+    ]
+    return (open_actions if open_report else []) + [
         {"type": "wait", "selector": date_input},
         {"type": "click", "selector": date_input},
         {"type": "press", "key": "Control+A"},
         {"type": "press", "key": "Backspace"},
         {"type": "fill", "selector": date_input, "value": first_day},
         {"type": "press", "key": "Enter"},
-        {"type": "sleep", "seconds": 1},
+        # вместо фиксированных пауз — ждём, пока Angular обработает ввод/запрос
+        {"type": "wait_angular"},
         {"type": "click", "selector": display_button},
-        {"type": "wait_load_state", "state": "networkidle"},
-        {"type": "sleep", "seconds": 2},
-        {"type": "wait", "selector": excel_button},
-        {"type": "sleep", "seconds": 3},
+        {"type": "wait_angular"},
+        {"type": "wait_enabled", "selector": excel_button},
         {
             "type": "download",
             "selector": excel_button,
             "attempts": 3,
-            "reload_before_click": True,
+            # страница перезагружается только перед повторными попытками
+            "reload_before_click": False,
         },
     ]
+
+
+def build_actions(site_username: str, site_password: str, first_day: str) -> list[dict[str, Any]]:
+    return build_login_actions(site_username, site_password) + build_report_actions(first_day)
@@ -0,0 +1,309 @@
+"""
+Выгрузка Excel с портала без браузера.
+
+Отчёт на портале — это XHR-запросы (vm.displayReportResult(true), затем
+executeExcelBtn()) и ответ-файл. Во время обычной выгрузки через браузер
+HttpRecorder записывает эти запросы в рецепт (HTTP_RECIPE_FILE), а
+HttpPortalClient потом повторяет их через requests.Session, подставляя
+дату отчёта и авторизацию из сохранённой сессии (PORTAL_SESSION_FILE).
+"""
+from __future__ import annotations
+
+import calendar
+import json
+import os
+import shutil
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PORTAL_ORIGIN = "https://ins.ylm.co.il"
+RECIPE_VERSION = 1
+
+# Заголовки, которые выставляет сам HTTP-клиент (или которые привязаны к браузеру)
+_SKIP_HEADERS = {"host", "content-length", "cookie", "accept-encoding", "connection", "origin", "referer"}
+_FILE_CONTENT_TYPES = ("spreadsheet", "excel", "octet-stream")
+_XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _date_placeholders(first_day: str) -> dict[str, str]:
+    """
+    first_day ("01/MM/YYYY") -> {значение даты в запросе: плейсхолдер}.
+    Покрывает форматы, в которых Angular-форма может отправить начало/конец месяца,
+    в том числе DD/MM/YYYY, закодированный в URL (01%2F12%2F2025).
+    """
+    start = datetime.strptime(first_day, "%d/%m/%Y")
+    end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    placeholders = {}
+    for day, name in ((start, "first_day"), (end, "last_day")):
+        text = day.strftime("%d/%m/%Y")
+        placeholders[text] = "{{" + name + "}}"
+        placeholders[quote(text, safe="")] = "{{" + name + "_url}}"
+        placeholders[quote(text, safe="").lower()] = "{{" + name + "_url_lc}}"
+        placeholders[day.strftime("%Y-%m-%d")] = "{{iso_" + name + "}}"
+    return placeholders
+
+
+# Без одного из них рецепт выгружал бы записанный месяц для любого first_day
+_FIRST_DAY_PLACEHOLDERS = ("{{first_day}}", "{{first_day_url}}", "{{first_day_url_lc}}", "{{iso_first_day}}")
+
+
+def _local_storage(storage_state: dict) -> dict[str, str]:
+    items = {}
+    for origin in storage_state.get("origins", []) or []:
+        for item in origin.get("localStorage", []) or []:
+            items[item["name"]] = item["value"]
+    return items
+
+
+def _is_file_response(headers: dict[str, str]) -> bool:
+    content_type = headers.get("content-type", "").lower()
+    disposition = headers.get("content-disposition", "").lower()
+    return "attachment" in disposition or any(t in content_type for t in _FILE_CONTENT_TYPES)
+
+
+class HttpRecorder:
+    """
+    Записывает XHR/fetch страницы во время выгрузки через браузер.
+
+        with HttpRecorder(page) as recorder:
+            run_actions(page, actions, excel_path)
+        recorder.save(recipe_file, first_day, page.context.storage_state(), excel_path)
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.requests = []
+        self.download_urls = []
+
+    def __enter__(self) -> "HttpRecorder":
+        self.page.on("requestfinished", self._on_request)
+        self.page.on("download", self._on_download)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.page.remove_listener("requestfinished", self._on_request)
+        self.page.remove_listener("download", self._on_download)
+
+    def _on_download(self, download) -> None:
+        # blob: — файл собран из XHR на стороне страницы, его уже видно в requests
+        if download.url.startswith(("http://", "https://")):
+            self.download_urls.append(download.url)
+
+    def _on_request(self, request) -> None:
+        if request.resource_type not in ("xhr", "fetch"):
+            return
+        # шаблоны Angular ($templateCache) к отчёту не относятся
+        if urlsplit(request.url).path.endswith((".html", ".js", ".css")):
+            return
+        self.requests.append(request)
+
+    def save(self, recipe_file: str, first_day: str, storage_state: dict, excel_path: str) -> bool:
+        """
+        Сохраняет рецепт и тела ответов (для локального стенда ylm_stub_server).
+        excel_path — скачанный браузером файл (тело ответа для прямой ссылки на скачивание).
+        Возвращает False, если среди запросов нет ответа-файла или дата отчёта
+        не нашлась ни в одном запросе (её формат не распознан) — рецепт не пишется,
+        а прежний удаляется: выгрузка остаётся за браузером.
+        """
+        replacements = dict(_date_placeholders(first_day))
+        for name, value in _local_storage(storage_state).items():
+            if value and len(value) >= 16:
+                replacements[value] = "{{ls:" + name + "}}"
+        replacements[PORTAL_ORIGIN] = "{{origin}}"
+
+        def _template(text: str | None) -> str | None:
+            if text is None:
+                return None
+            for value, placeholder in replacements.items():
+                text = text.replace(value, placeholder)
+            return text
+
+        responses_dir = f"{os.path.splitext(recipe_file)[0]}_responses"
+        os.makedirs(responses_dir, exist_ok=True)
+
+        recipe_dir = os.path.dirname(os.path.abspath(recipe_file))
+        entries = []
+        has_file = False
+        for idx, request in enumerate(self.requests):
+            response = request.response()
+            if response is None:
+                continue
+            response_headers = response.headers
+            is_file = _is_file_response(response_headers)
+            has_file = has_file or is_file
+
+            body_file = os.path.join(responses_dir, f"{idx:02d}.bin")
+            try:
+                with open(body_file, "wb") as f:
+                    f.write(response.body())
+            except Exception:
+                body_file = None
+
+            entries.append(
+                {
+                    "method": request.method,
+                    "url": _template(request.url),
+                    "headers": {
+                        k: _template(v)
+                        for k, v in request.headers.items()
+                        if k.lower() not in _SKIP_HEADERS and not k.startswith(":")
+                    },
+                    "post_data": _template(request.post_data),
+                    "is_file": is_file,
+                    "response": {
+                        "status": response.status,
+                        "content_type": response_headers.get("content-type", ""),
+                        "body_file": os.path.relpath(body_file, recipe_dir) if body_file else None,
+                    },
+                }
+            )
+
+        for url in self.download_urls:
+            body_file = os.path.join(responses_dir, f"{len(entries):02d}.bin")
+            shutil.copyfile(excel_path, body_file)
+            entries.append(
+                {
+                    "method": "GET",
+                    "url": _template(url),
+                    "headers": {},
+                    "post_data": None,
+                    "is_file": True,
+                    "response": {"status": 200, "content_type": _XLSX_CONTENT_TYPE, "body_file": os.path.relpath(body_file, recipe_dir)},
+                }
+            )
+            has_file = True
+
+        if not has_file:
+            print("⚠️ Среди XHR нет ответа-файла — рецепт HTTP-выгрузки не сохранён.")
+            return False
+
+        templated = json.dumps(entries, ensure_ascii=False)
+        if not any(placeholder in templated for placeholder in _FIRST_DAY_PLACEHOLDERS):
+            print(f"⚠️ Дата отчёта {first_day} не найдена в запросах — рецепт HTTP-выгрузки не сохранён.")
+            if os.path.exists(recipe_file):
+                os.remove(recipe_file)
+            return False
+
+        temp_path = f"{recipe_file}.new"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": RECIPE_VERSION, "requests": entries}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, recipe_file)
+        print(f"📝 Рецепт HTTP-выгрузки сохранён: {recipe_file} (запросов: {len(entries)})")
+        return True
+
+
+def load_recipe(recipe_file: str) -> dict:
+    if not os.path.exists(recipe_file):
+        raise RuntimeError(f"Рецепт HTTP-выгрузки не найден: {recipe_file} (нужна хотя бы одна выгрузка через браузер)")
+    with open(recipe_file, "r", encoding="utf-8") as f:
+        recipe = json.load(f)
+    if recipe.get("version") != RECIPE_VERSION:
+        raise RuntimeError(f"Неподдерживаемая версия рецепта: {recipe.get('version')}")
+    templated = json.dumps(recipe.get("requests", []), ensure_ascii=False)
+    if not any(placeholder in templated for placeholder in _FIRST_DAY_PLACEHOLDERS):
+        raise RuntimeError(f"В рецепте {recipe_file} нет даты отчёта — он выгружал бы только записанный месяц")
+    return recipe
+
+
+class HttpPortalClient:
+    """
+    Повтор записанных запросов портала через пул соединений requests.Session.
+    Авторизация — cookies и localStorage из файла storage_state браузера.
+    base_url подменяет origin портала (например, локальный стенд ylm_stub_server).
+    """
+
+    def __init__(self, recipe_file: str, session_file: str = "", base_url: str = "", pool_size: int = 4):
+        self.recipe = load_recipe(recipe_file)
+        self.base_url = (base_url or PORTAL_ORIGIN).rstrip("/")
+
+        storage_state = {}
+        if session_file and os.path.exists(session_file):
+            with open(session_file, "r", encoding="utf-8") as f:
+                storage_state = json.load(f)
+        self.local_storage = _local_storage(storage_state)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        for cookie in storage_state.get("cookies", []) or []:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+
+    def __enter__(self) -> "HttpPortalClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _render(self, text: str | None, first_day: str) -> str | None:
+        if text is None:
+            return None
+        values = {placeholder: value for value, placeholder in _date_placeholders(first_day).items()}
+        values["{{origin}}"] = self.base_url
+        for name, value in self.local_storage.items():
+            values["{{ls:" + name + "}}"] = value
+        for placeholder, value in values.items():
+            text = text.replace(placeholder, value)
+        if "{{" in text:
+            raise RuntimeError(f"В рецепте остался незаполненный плейсхолдер: {text[:120]}")
+        return text
+
+    def export(self, first_day: str, excel_path: str) -> str:
+        """
+        Повторяет запросы рецепта для месяца с first_day и пишет ответ-файл в excel_path.
+        """
+        saved = False
+        for entry in self.recipe["requests"]:
+            response = self.session.request(
+                entry["method"],
+                self._render(entry["url"], first_day),
+                headers={k: self._render(v, first_day) for k, v in entry["headers"].items()},
+                data=(self._render(entry["post_data"], first_day) or "").encode("utf-8") or None,
+                timeout=60,
+            )
+            if response.status_code in (401, 403):
+                raise RuntimeError(f"Сессия портала истекла (HTTP {response.status_code})")
+            response.raise_for_status()
+            if not entry["is_file"]:
+                continue
+
+            if not response.content.startswith(b"PK"):
+                raise RuntimeError("Ответ портала не похож на .xlsx")
+            temp_path = f"{excel_path}.part"
+            with open(temp_path, "wb") as f:
+                f.write(response.content)
+            os.replace(temp_path, excel_path)
+            saved = True
+
+        if not saved:
+            raise RuntimeError("В рецепте нет запроса, возвращающего файл")
+        print(f"✅ Скачивание по HTTP успешно: {excel_path}")
+        return excel_path
+
+    def export_months(self, exports: dict[str, str]) -> dict[str, str]:
+        """
+        exports: first_day -> excel_path. Возвращает first_day -> сохранённый файл.
+        """
+        return {first_day: self.export(first_day, excel_path) for first_day, excel_path in exports.items()}
+
+
+def download_excel_http(
+    excel_path: str,
+    first_day: str,
+    recipe_file: str,
+    session_file: str = "",
+    base_url: str = "",
+) -> str:
+    with HttpPortalClient(recipe_file, session_file=session_file, base_url=base_url) as client:
+        return client.export(first_day, excel_path)
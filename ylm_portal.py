@@ -1,11 +1,14 @@
+import json
 import os
 import random
 import time
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
-from typing import Callable, Iterable
+from typing import Any, Generator, Iterable, Iterator
 from playwright.sync_api import expect, sync_playwright
 
-from ylm_actions import build_actions
+from ylm_http import HttpRecorder
+from ylm_actions import DATE_INPUT, LOGIN_URL, REPORT_BUTTON, build_login_actions, build_report_actions
 
 
 def download_excel(
@@ -16,43 +19,159 @@ def download_excel(
     first_day: str | None = None,
     manual_portal: bool = False,
     manual_download_timeout_ms: int = 0,
+    session_file: str = "",
+    recipe_file: str = "",
 ) -> str:
     """
     Логин на ylm.co.il и скачивание Excel отчёта за текущий месяц.
     Возвращает путь к сохранённому файлу excel_path.
+    session_file / recipe_file — кэш сессии браузера и рецепт HTTP-выгрузки (см. PortalSession).
     """
     if manual_portal and headless:
         print("⚠️ MANUAL_PORTAL=1 — headless отключён для ручного управления.")
         headless = False
 
+    if manual_portal:
+        with _portal_page(headless) as page:
+            return download_excel_manual(
+                page,
+                site_username=site_username,
+                site_password=site_password,
+                excel_path=excel_path,
+                download_timeout_ms=manual_download_timeout_ms,
+            )
+
+    with PortalSession(
+        site_username, site_password, headless=headless, session_file=session_file, recipe_file=recipe_file
+    ) as portal:
+        if first_day is None:
+            now = datetime.now()
+            first_day = f"01/{now.strftime('%m/%Y')}"
+        return portal.export(first_day, excel_path)
+
+
+def download_excel_months(
+    site_username: str,
+    site_password: str,
+    exports: dict[str, str],
+    headless: bool = False,
+    session_file: str = "",
+    recipe_file: str = "",
+) -> dict[str, str]:
+    """
+    Скачивание отчётов за несколько месяцев: один запуск Chromium и один логин.
+    exports: first_day ("01/MM/YYYY") -> excel_path.
+    Возвращает соответствие first_day -> сохранённый файл.
+    """
+    with PortalSession(
+        site_username, site_password, headless=headless, session_file=session_file, recipe_file=recipe_file
+    ) as portal:
+        return portal.export_months(exports)
+
+
+class PortalSession:
+    """
+    Залогиненная сессия портала: Chromium запускается и логин выполняется
+    один раз, дальше отчёты выгружаются сменой даты в vm.report.FromDate.
+
+        with PortalSession(user, password, headless=True) as portal:
+            portal.export("01/12/2025", "history/12.25.xlsx")
+            portal.export("01/11/2025", "history/11.25.xlsx")
+
+    session_file — кэш сессии (cookies + localStorage, context.storage_state).
+    Если файл есть и личный кабинет открывается без логина — ввод логина
+    пропускается; если сессия истекла — обычный логин и файл перезаписывается.
+
+    recipe_file — если задан, XHR выгрузки записываются в рецепт для
+    HTTP-выгрузки без браузера (см. ylm_http).
+    """
+
+    def __init__(
+        self,
+        site_username: str,
+        site_password: str,
+        headless: bool = False,
+        session_file: str = "",
+        recipe_file: str = "",
+    ):
+        self.site_username = site_username
+        self.site_password = site_password
+        self.headless = headless
+        self.session_file = session_file
+        self.recipe_file = recipe_file
+        self.page = None
+        self._stack = None
+
+    def __enter__(self) -> "PortalSession":
+        with ExitStack() as stack:
+            storage_state = self.session_file if self.session_file and os.path.exists(self.session_file) else None
+            self.page = stack.enter_context(_portal_page(self.headless, storage_state=storage_state))
+            self.login()
+            self._stack = stack.pop_all()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        stack, self._stack, self.page = self._stack, None, None
+        return stack.__exit__(*exc_info)
+
+    def login(self) -> None:
+        drive(plan_login(self.site_username, self.site_password, self.session_file), _SyncDriver(self.page))
+
+    def export(self, first_day: str, excel_path: str) -> str:
+        """
+        Выгружает отчёт за месяц с first_day ("01/MM/YYYY") в excel_path.
+        Если форма отчёта уже на странице — только меняем дату, без повторного входа в отчёт.
+        """
+        driver = _SyncDriver(self.page)
+        if not self.recipe_file:
+            return drive(plan_export(first_day, excel_path), driver)
+
+        with HttpRecorder(self.page) as recorder:
+            drive(plan_export(first_day, excel_path), driver)
+        recorder.save(self.recipe_file, first_day, self.page.context.storage_state(), excel_path)
+        if self.session_file:
+            # HTTP-выгрузка берёт авторизацию из сессии — сохраняем самую свежую
+            self.page.context.storage_state(path=self.session_file)
+        return excel_path
+
+    def export_months(self, exports: dict[str, str]) -> dict[str, str]:
+        """
+        exports: first_day -> excel_path. Возвращает first_day -> сохранённый файл.
+        """
+        saved = {}
+        for first_day, excel_path in exports.items():
+            print(f"📅 Отчёт с {first_day}")
+            saved[first_day] = self.export(first_day, excel_path)
+        return saved
+
+
+@contextmanager
+def _portal_page(headless: bool, storage_state: str | None = None):
+    """
+    Chromium + контекст + страница; при ошибке сохраняет скриншот и HTML.
+    Трейс Playwright пишется только при TRACE_MODE=always (или попавшем в выборку sample).
+    storage_state — файл сохранённой сессии (битый файл игнорируется).
+    """
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=headless)
-        context = browser.new_context()
+        try:
+            context = browser.new_context(storage_state=storage_state)
+        except Exception as exc:
+            if storage_state is None:
+                raise
+            print(f"⚠️ Сохранённая сессия {storage_state} не загружена: {exc}")
+            context = browser.new_context()
         page = context.new_page()
 
         page.set_default_timeout(120000)
         page.set_default_navigation_timeout(120000)
 
-        # Trace — суперполезно в CI
-        context.tracing.start(screenshots=True, snapshots=True, sources=True)
+        tracing = tracing_enabled()
+        if tracing:
+            context.tracing.start(screenshots=True, snapshots=True, sources=True)
 
         try:
-            if manual_portal:
-                return download_excel_manual(
-                    page,
-                    site_username=site_username,
-                    site_password=site_password,
-                    excel_path=excel_path,
-                    download_timeout_ms=manual_download_timeout_ms,
-                )
-            if first_day is None:
-                now = datetime.now()
-                first_day = f"01/{now.strftime('%m/%Y')}"
-            return run_actions(
-                page,
-                build_actions(site_username, site_password, first_day),
-                excel_path,
-            )
+            yield page
 
         except Exception:
             try:
@@ -68,11 +187,12 @@ def download_excel(
             raise
 
         finally:
-            # trace пытаемся сохранить всегда
-            try:
-                context.tracing.stop(path="debug_trace.zip")
-            except Exception:
-                pass
+            if tracing:
+                try:
+                    context.tracing.stop(path="debug_trace.zip")
+                    print("🧵 Трейс сохранён: debug_trace.zip")
+                except Exception:
+                    pass
             browser.close()
 
 
@@ -131,90 +251,315 @@ def _get_action_delay() -> tuple[float, float]:
     return _parse_delay(os.getenv("ACTION_DELAY", "0"))
 
 
-def sleep_action_delay() -> None:
+def _get_trace_mode() -> str:
+    """
+    TRACE_MODE=off|always|sample (по умолчанию off).
+    off — без трейса (при ошибке — debug_screen.png и debug_page.html);
+    always — полный трейс в debug_trace.zip;
+    sample — полный трейс в доле запусков TRACE_SAMPLE_RATE (по умолчанию 0.1),
+    в остальных — как off.
+    Трейс включается до первого шага и замедляет каждый шаг (snapshots), поэтому
+    по умолчанию его нет.
+    """
+    mode = os.getenv("TRACE_MODE", "off").strip().lower() or "off"
+    if mode not in ("off", "always", "sample"):
+        raise RuntimeError(f"Неизвестный TRACE_MODE: {mode}")
+    if mode == "sample":
+        rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.1").strip() or "0")
+        return "sample" if random.random() < rate else "off"
+    return mode
+
+
+def tracing_enabled() -> bool:
+    return _get_trace_mode() != "off"
+
+
+# Angular 1.x спокоен: нет незавершённых $http-запросов и не идёт $digest.
+# Если Angular на странице нет — условие сразу истинно.
+_ANGULAR_IDLE_JS = """
+() => {
+    const ng = window.angular;
+    if (!ng) return true;
+    const injector = ng.element(document.querySelector('[ng-app]') || document.body).injector();
+    if (!injector) return true;
+    return injector.get('$http').pendingRequests.length === 0 && !injector.get('$rootScope').$$phase;
+}
+"""
+
+# Движок сценария один для sync и async Playwright. План — генератор, который
+# отдаёт операции над страницей ("имя", *аргументы) и получает обратно результат
+# (или исключение). Публичные планы — plan_login и plan_export, драйвер только
+# выполняет операции: drive/_SyncDriver здесь, drive_async/_AsyncDriver в
+# ylm_portal_async. Повторы, тайминги и паузы — в плане.
+Op = tuple
+Plan = Generator[Op, Any, Any]
+
+
+def _delay_ops() -> Iterator[Op]:
     lo, hi = _get_action_delay()
     if hi <= 0:
         return
     if hi < lo:
         lo, hi = hi, lo
-    delay = random.uniform(lo, hi)
-    time.sleep(delay)
+    yield ("sleep", random.uniform(lo, hi))
+
+
+def _action_ops(action: dict) -> Iterator[Op]:
+    kind = action["type"]
+    timeout = action.get("timeout", 60000)
+    if kind == "goto":
+        yield ("goto", action["url"], action.get("wait_until", "domcontentloaded"))
+    elif kind == "wait":
+        yield ("wait_for_selector", action["selector"], timeout)
+    elif kind == "wait_enabled":
+        yield ("wait_enabled", action["selector"], timeout)
+    elif kind == "wait_angular":
+        yield ("wait_for_function", _ANGULAR_IDLE_JS, timeout)
+    elif kind == "wait_response":
+        yield ("wait_response", action["url_contains"], timeout)
+    elif kind == "fill":
+        yield ("fill", action["selector"], action["value"])
+    elif kind == "click":
+        # с wait_response клик считается выполненным, когда пришёл ответ с подходящим URL
+        yield ("click", action["selector"], action.get("wait_response"), timeout)
+    elif kind == "reload":
+        yield ("reload", action.get("wait_until", "networkidle"))
+    elif kind == "press":
+        yield ("press", action["key"])
+    elif kind == "wait_load_state":
+        yield ("wait_load_state", action.get("state", "load"))
+    elif kind == "sleep":
+        yield ("sleep", action.get("seconds", 1))
+    else:
+        raise ValueError(f"Unknown action type: {kind}")
 
 
-Step = Callable[[], None]
+# Метка запуска — связывает строки файла таймингов одного запуска
+_RUN_ID = datetime.now().isoformat(timespec="seconds")
 
 
-def run_steps(steps: Iterable[Step]) -> None:
-    for step in steps:
-        step()
-        sleep_action_delay()
+def _action_target(action: dict) -> str:
+    # значения fill (логин/пароль) в отчёт не попадают
+    return action.get("selector") or action.get("url") or action.get("key") or action.get("state") or ""
 
 
-def run_actions(page, actions: Iterable[dict], excel_path: str) -> str:
-    def _step(action: dict) -> Step:
-        kind = action["type"]
-        if kind == "goto":
-            return lambda: page.goto(action["url"], wait_until=action.get("wait_until", "domcontentloaded"))
-        if kind == "wait":
-            return lambda: page.wait_for_selector(action["selector"], timeout=action.get("timeout", 60000))
-        if kind == "fill":
-            return lambda: page.fill(action["selector"], action["value"])
-        if kind == "click":
-            return lambda: page.click(action["selector"])
-        if kind == "reload":
-            return lambda: page.reload(wait_until=action.get("wait_until", "networkidle"))
-        if kind == "press":
-            return lambda: page.keyboard.press(action["key"])
-        if kind == "wait_load_state":
-            return lambda: page.wait_for_load_state(action.get("state", "load"))
-        if kind == "sleep":
-            return lambda: time.sleep(action.get("seconds", 1))
-        raise ValueError(f"Unknown action type: {kind}")
+def _timing(kind: str, target: str, started: float, attempt: int = 1, ok: bool = True) -> dict:
+    return {
+        "type": kind,
+        "selector": target,
+        "attempt": attempt,
+        "seconds": round(time.perf_counter() - started, 3),
+        "ok": ok,
+    }
 
-    last_error = None
-    for action in actions:
-        if action.get("type") != "download":
-            run_steps([_step(action)])
-            continue
-
-        selector = action["selector"]
-        attempts = int(action.get("attempts", 3))
-        reload_before_click = bool(action.get("reload_before_click", False))
-        for attempt in range(1, attempts + 1):
-            print(f"⬇️ Попытка скачивания {attempt}/{attempts}")
-            try:
-                if reload_before_click:
-                    page.reload(wait_until="networkidle")
-                    page.wait_for_selector(selector)
-                    sleep_action_delay()
-
-                with page.expect_download(timeout=60000) as download_info:
-                    page.click(selector)
-                download = download_info.value
-                download.save_as(excel_path)
-
-                if not os.path.exists(excel_path) or os.path.getsize(excel_path) <= 0:
-                    raise RuntimeError("Скачанный файл отсутствует или пустой")
-
-                print(f"✅ Скачивание успешно: {excel_path}")
-                return excel_path
-            except Exception as exc:
-                last_error = exc
-                print(f"⚠️ Скачивание не удалось: {exc}")
-                if attempt < attempts:
-                    print("🔄 Перезагружаю страницу и пробую снова...")
-                    page.reload(wait_until="networkidle")
-                    page.wait_for_selector(selector)
-                    locator = page.locator(selector)
-                    locator.scroll_into_view_if_needed()
-                    locator.wait_for(state="visible", timeout=30000)
-                    expect(locator).to_be_enabled(timeout=30000)
-                    sleep_action_delay()
-                    continue
-                break
-
-        raise RuntimeError(
-            f"Не удалось скачать Excel за {attempts} попытки. Последняя ошибка: {last_error}"
-        )
 
+def report_timings(stage: str, timings: list[dict], top: int = 5) -> None:
+    """
+    Печатает сводку по шагам и дописывает их в PORTAL_TIMINGS_FILE (JSON lines,
+    по умолчанию portal_timings.jsonl; пусто — не писать).
+    """
+    if not timings:
+        return
+    total = sum(t["seconds"] for t in timings)
+    print(f"⏱️ {stage}: шагов {len(timings)}, {total:.1f} с")
+    for t in sorted(timings, key=lambda t: -t["seconds"])[:top]:
+        mark = "" if t["ok"] else " (ошибка)"
+        print(f"   {t['seconds']:6.2f} с  {t['type']} {t['selector']}{mark}")
+
+    timings_file = os.getenv("PORTAL_TIMINGS_FILE", "portal_timings.jsonl").strip()
+    if not timings_file:
+        return
+    try:
+        with open(timings_file, "a", encoding="utf-8") as f:
+            for t in timings:
+                f.write(json.dumps({"run": _RUN_ID, "stage": stage, **t}, ensure_ascii=False) + "\n")
+    except OSError as exc:
+        print(f"⚠️ Тайминги не записаны в {timings_file}: {exc}")
+
+
+def _plan_action(action: dict, timings: list[dict] | None = None) -> Plan:
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield from _action_ops(action)
+        ok = True
+    finally:
+        if timings is not None:
+            timings.append(_timing(action["type"], _action_target(action), started, ok=ok))
+    yield from _delay_ops()
+
+
+def _plan_download(action: dict, excel_path: str, timings: list[dict]) -> Plan:
+    selector = action["selector"]
+    attempts = int(action.get("attempts", 3))
+    reload_before_click = bool(action.get("reload_before_click", False))
+    last_error = None
+    for attempt in range(1, attempts + 1):
+        print(f"⬇️ Попытка скачивания {attempt}/{attempts}")
+        started = time.perf_counter()
+        try:
+            if reload_before_click:
+                yield ("reload", "networkidle")
+                yield ("wait_for_selector", selector, None)
+                yield from _delay_ops()
+
+            yield ("download", selector, excel_path)
+            if not os.path.exists(excel_path) or os.path.getsize(excel_path) <= 0:
+                raise RuntimeError("Скачанный файл отсутствует или пустой")
+
+            timings.append(_timing("download", selector, started, attempt=attempt))
+            print(f"✅ Скачивание успешно: {excel_path}")
+            return excel_path
+        except Exception as exc:
+            timings.append(_timing("download", selector, started, attempt=attempt, ok=False))
+            last_error = exc
+            print(f"⚠️ Скачивание не удалось: {exc}")
+            if attempt < attempts:
+                print("🔄 Перезагружаю страницу и пробую снова...")
+                yield ("reload", "networkidle")
+                yield ("wait_for_selector", selector, None)
+                yield ("scroll_into_view", selector)
+                yield ("wait_enabled", selector, 30000)
+                yield from _delay_ops()
+                continue
+            break
+
+    raise RuntimeError(f"Не удалось скачать Excel за {attempts} попытки. Последняя ошибка: {last_error}")
+
+
+def _plan_actions(actions: Iterable[dict], excel_path: str, stage: str = "Шаги портала") -> Plan:
+    timings: list[dict] = []
+    try:
+        for action in actions:
+            if action.get("type") != "download":
+                yield from _plan_action(action, timings)
+                continue
+            return (yield from _plan_download(action, excel_path, timings))
+    finally:
+        report_timings(stage, timings)
     raise RuntimeError("В сценарии действий отсутствует шаг download")
+
+
+def plan_login(site_username: str, site_password: str, session_file: str = "", suffix: str = "") -> Plan:
+    """
+    Логин; если сессия из session_file восстановлена и кабинет открывается — без ввода логина.
+    После логина сессия сохраняется в session_file (если задан).
+    """
+    if session_file and os.path.exists(session_file):
+        # ждём либо кнопку отчёта (сессия жива), либо форму логина (сессия истекла)
+        yield ("goto", LOGIN_URL, "domcontentloaded")
+        try:
+            yield ("wait_for_selector", f"{REPORT_BUTTON}, #Username", 30000)
+            alive = yield ("is_visible", REPORT_BUTTON)
+        except Exception:
+            alive = False
+        if alive:
+            print(f"🔑 Сессия портала восстановлена{suffix} — логин пропущен.")
+            return
+
+    timings: list[dict] = []
+    try:
+        for action in build_login_actions(site_username, site_password):
+            yield from _plan_action(action, timings)
+    finally:
+        report_timings(f"Логин{suffix}", timings)
+    if session_file:
+        yield ("wait_for_selector", REPORT_BUTTON, None)
+        yield ("save_storage_state", session_file)
+        print(f"🔑 Сессия портала сохранена{suffix}: {session_file}")
+
+
+def plan_export(first_day: str, excel_path: str, suffix: str = "") -> Plan:
+    """
+    Выгрузка отчёта за месяц с first_day. Если форма отчёта уже на странице —
+    только меняем дату, без повторного входа в отчёт.
+    """
+    open_report = not (yield ("is_visible", DATE_INPUT))
+    actions = build_report_actions(first_day, open_report=open_report)
+    return (yield from _plan_actions(actions, excel_path, stage=f"Шаги портала{suffix}"))
+
+
+def drive(plan: Plan, driver):
+    """
+    Выполняет план синхронным драйвером; ошибка операции бросается внутрь плана.
+    """
+    step, value = plan.send, None
+    while True:
+        try:
+            op = step(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, step = getattr(driver, op[0])(*op[1:]), plan.send
+        except Exception as exc:
+            value, step = exc, plan.throw
+
+
+class _SyncDriver:
+    """
+    Операции плана на sync-странице Playwright.
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+    def goto(self, url: str, wait_until: str) -> None:
+        self.page.goto(url, wait_until=wait_until)
+
+    def wait_for_selector(self, selector: str, timeout: float | None) -> None:
+        self.page.wait_for_selector(selector, timeout=timeout)
+
+    def wait_enabled(self, selector: str, timeout: float) -> None:
+        locator = self.page.locator(selector)
+        locator.wait_for(state="visible", timeout=timeout)
+        expect(locator).to_be_enabled(timeout=timeout)
+
+    def wait_for_function(self, js: str, timeout: float) -> None:
+        self.page.wait_for_function(js, timeout=timeout)
+
+    def wait_response(self, pattern: str, timeout: float) -> None:
+        self.page.wait_for_event("response", lambda r: pattern in r.url, timeout=timeout)
+
+    def fill(self, selector: str, value: str) -> None:
+        self.page.fill(selector, value)
+
+    def click(self, selector: str, wait_response: str | None, timeout: float) -> None:
+        if not wait_response:
+            self.page.click(selector)
+            return
+        with self.page.expect_response(lambda r: wait_response in r.url, timeout=timeout):
+            self.page.click(selector)
+
+    def reload(self, wait_until: str) -> None:
+        self.page.reload(wait_until=wait_until)
+
+    def press(self, key: str) -> None:
+        self.page.keyboard.press(key)
+
+    def wait_load_state(self, state: str) -> None:
+        self.page.wait_for_load_state(state)
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def is_visible(self, selector: str) -> bool:
+        return self.page.locator(selector).is_visible()
+
+    def scroll_into_view(self, selector: str) -> None:
+        self.page.locator(selector).scroll_into_view_if_needed()
+
+    def download(self, selector: str, excel_path: str) -> None:
+        with self.page.expect_download(timeout=60000) as download_info:
+            self.page.click(selector)
+        download_info.value.save_as(excel_path)
+
+    def save_storage_state(self, path: str) -> None:
+        self.page.context.storage_state(path=path)
+
+
+def run_action(page, action: dict, timings: list[dict] | None = None) -> None:
+    drive(_plan_action(action, timings), _SyncDriver(page))
+
+
+def run_actions(page, actions: Iterable[dict], excel_path: str) -> str:
+    return drive(_plan_actions(actions, excel_path), _SyncDriver(page))
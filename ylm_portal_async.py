@@ -0,0 +1,240 @@
+"""
+Выгрузка Excel для нескольких сотрудников параллельно (async Playwright).
+
+Один процесс Chromium, у каждого сотрудника свой контекст браузера (cookies не
+пересекаются). Одновременно открыто не больше pool_size контекстов, поэтому
+время выгрузки команды растёт с числом сотрудников / pool_size.
+
+Сценарий и движок — общие с ylm_portal (планы plan_login / plan_export),
+здесь только async-драйвер операций страницы. Кэш сессии (session_file) и
+TRACE_MODE работают так же, как в PortalSession.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from playwright.async_api import async_playwright, expect
+
+from ylm_portal import Plan, plan_export, plan_login, tracing_enabled
+
+
+async def drive_async(plan: Plan, driver: "_AsyncDriver"):
+    """
+    Выполняет план async-драйвером (см. ylm_portal.drive).
+    """
+    step, value = plan.send, None
+    while True:
+        try:
+            op = step(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, step = await getattr(driver, op[0])(*op[1:]), plan.send
+        except Exception as exc:
+            value, step = exc, plan.throw
+
+
+class _AsyncDriver:
+    """
+    Операции плана на async-странице Playwright.
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+    async def goto(self, url: str, wait_until: str) -> None:
+        await self.page.goto(url, wait_until=wait_until)
+
+    async def wait_for_selector(self, selector: str, timeout: float | None) -> None:
+        await self.page.wait_for_selector(selector, timeout=timeout)
+
+    async def wait_enabled(self, selector: str, timeout: float) -> None:
+        locator = self.page.locator(selector)
+        await locator.wait_for(state="visible", timeout=timeout)
+        await expect(locator).to_be_enabled(timeout=timeout)
+
+    async def wait_for_function(self, js: str, timeout: float) -> None:
+        await self.page.wait_for_function(js, timeout=timeout)
+
+    async def wait_response(self, pattern: str, timeout: float) -> None:
+        await self.page.wait_for_event("response", lambda r: pattern in r.url, timeout=timeout)
+
+    async def fill(self, selector: str, value: str) -> None:
+        await self.page.fill(selector, value)
+
+    async def click(self, selector: str, wait_response: str | None, timeout: float) -> None:
+        if not wait_response:
+            await self.page.click(selector)
+            return
+        async with self.page.expect_response(lambda r: wait_response in r.url, timeout=timeout):
+            await self.page.click(selector)
+
+    async def reload(self, wait_until: str) -> None:
+        await self.page.reload(wait_until=wait_until)
+
+    async def press(self, key: str) -> None:
+        await self.page.keyboard.press(key)
+
+    async def wait_load_state(self, state: str) -> None:
+        await self.page.wait_for_load_state(state)
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def is_visible(self, selector: str) -> bool:
+        return await self.page.locator(selector).is_visible()
+
+    async def scroll_into_view(self, selector: str) -> None:
+        await self.page.locator(selector).scroll_into_view_if_needed()
+
+    async def download(self, selector: str, excel_path: str) -> None:
+        async with self.page.expect_download(timeout=60000) as download_info:
+            await self.page.click(selector)
+        download = await download_info.value
+        await download.save_as(excel_path)
+
+    async def save_storage_state(self, path: str) -> None:
+        await self.page.context.storage_state(path=path)
+
+
+class AsyncPortal:
+    """
+    Общий Chromium для нескольких выгрузок.
+
+        async with AsyncPortal(headless=True, pool_size=3) as portal:
+            await portal.export(user, password, "01/12/2025", "team/anna.xlsx", name="anna")
+    """
+
+    def __init__(self, headless: bool = False, pool_size: int = 3):
+        self.headless = headless
+        self.pool = asyncio.Semaphore(max(1, pool_size))
+        self._playwright = None
+        self.browser = None
+
+    async def __aenter__(self) -> "AsyncPortal":
+        self._playwright = await async_playwright().start()
+        try:
+            self.browser = await self._playwright.chromium.launch(headless=self.headless)
+        except Exception:
+            await self._playwright.stop()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            await self.browser.close()
+        finally:
+            await self._playwright.stop()
+
+    async def _new_context(self, session_file: str):
+        if not (session_file and os.path.exists(session_file)):
+            return await self.browser.new_context()
+        try:
+            return await self.browser.new_context(storage_state=session_file)
+        except Exception as exc:
+            print(f"⚠️ Сохранённая сессия {session_file} не загружена: {exc}")
+            return await self.browser.new_context()
+
+    async def export(
+        self,
+        site_username: str,
+        site_password: str,
+        first_day: str,
+        excel_path: str,
+        name: str = "",
+        session_file: str = "",
+    ) -> str:
+        """
+        Логин и выгрузка отчёта в отдельном контексте браузера.
+        session_file — кэш сессии этого сотрудника (как в PortalSession).
+        При ошибке сохраняет debug_screen_<name>.png, при TRACE_MODE=always/sample —
+        трейс в debug_trace_<name>.zip.
+        """
+        async with self.pool:
+            context = await self._new_context(session_file)
+            page = await context.new_page()
+            page.set_default_timeout(120000)
+            page.set_default_navigation_timeout(120000)
+            tag = name or "async"
+            suffix = f" ({name})" if name else ""
+
+            tracing = tracing_enabled()
+            if tracing:
+                await context.tracing.start(screenshots=True, snapshots=True, sources=True)
+            driver = _AsyncDriver(page)
+            try:
+                await drive_async(plan_login(site_username, site_password, session_file, suffix), driver)
+                return await drive_async(plan_export(first_day, excel_path, suffix), driver)
+            except Exception:
+                try:
+                    await page.screenshot(path=f"debug_screen_{tag}.png", full_page=True)
+                except Exception:
+                    pass
+                raise
+            finally:
+                if tracing:
+                    try:
+                        await context.tracing.stop(path=f"debug_trace_{tag}.zip")
+                        print(f"🧵 Трейс сохранён: debug_trace_{tag}.zip")
+                    except Exception:
+                        pass
+                await context.close()
+
+
+async def download_excel_pool(
+    jobs: dict[str, dict],
+    headless: bool = False,
+    pool_size: int = 3,
+    on_download: Callable[[str, str | None, BaseException | None], None] | None = None,
+) -> dict[str, str | BaseException]:
+    """
+    jobs: name -> {"site_username", "site_password", "first_day", "excel_path"[, "session_file"]}.
+    on_download(name, excel_path, error) вызывается сразу по готовности каждой выгрузки —
+    следующий этап (синхронизация таблицы) не ждёт остальных.
+    Возвращает name -> путь к файлу или исключение (ошибка одного не останавливает других).
+    """
+    results: dict[str, str | BaseException] = {}
+
+    async with AsyncPortal(headless=headless, pool_size=pool_size) as portal:
+
+        async def _one(name: str, job: dict) -> None:
+            try:
+                path = await portal.export(
+                    job["site_username"],
+                    job["site_password"],
+                    job["first_day"],
+                    job["excel_path"],
+                    name=name,
+                    session_file=job.get("session_file", ""),
+                )
+            except Exception as exc:
+                print(f"❌ Выгрузка не удалась ({name}): {exc}")
+                results[name] = exc
+                if on_download:
+                    on_download(name, None, exc)
+                return
+            results[name] = path
+            if on_download:
+                on_download(name, path, None)
+
+        tasks: list[Awaitable[None]] = [_one(name, job) for name, job in jobs.items()]
+        await asyncio.gather(*tasks)
+    return results
+
+
+async def download_excel_async(
+    site_username: str,
+    site_password: str,
+    first_day: str,
+    excel_path: str,
+    headless: bool = False,
+    session_file: str = "",
+) -> str:
+    """
+    Одна выгрузка через async API — чтобы в run.py --async выгрузка шла
+    параллельно с подготовкой Google Sheets в том же event loop.
+    """
+    async with AsyncPortal(headless=headless, pool_size=1) as portal:
+        return await portal.export(site_username, site_password, first_day, excel_path, session_file=session_file)
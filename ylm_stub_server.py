@@ -0,0 +1,89 @@
+"""
+Локальный стенд портала для HTTP-выгрузки: отдаёт записанные в рецепте ответы.
+
+    python ylm_stub_server.py portal_recipe.json --port 8765
+    PORTAL_FETCHER=http PORTAL_BASE_URL=http://127.0.0.1:8765 SKIP_DOWNLOAD=0 python run.py
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from ylm_http import load_recipe
+
+# Даты и токены в записанных URL — любое значение сегмента
+# (в дате DD/MM/YYYY бывают "/", поэтому для неё — любое значение параметра)
+_PLACEHOLDER_RE = re.compile(r"\\\{\\\{([^}]*)\\\}\\\}")
+
+
+def _placeholder_pattern(match: re.Match) -> str:
+    return r"[^&?]*" if match.group(1).endswith(("first_day", "last_day")) else r"[^/&?]*"
+
+
+def _route(url_template: str) -> re.Pattern:
+    path = url_template.replace("{{origin}}", "", 1)
+    parts = urlsplit(path)
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    return re.compile("^" + _PLACEHOLDER_RE.sub(_placeholder_pattern, re.escape(target)) + "$")
+
+
+def make_server(recipe_file: str, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    recipe = load_recipe(recipe_file)
+    recipe_dir = os.path.dirname(os.path.abspath(recipe_file))
+
+    routes = []
+    for entry in recipe["requests"]:
+        response = entry["response"]
+        body = b""
+        if response.get("body_file"):
+            with open(os.path.join(recipe_dir, response["body_file"]), "rb") as f:
+                body = f.read()
+        routes.append((entry["method"].upper(), _route(entry["url"]), response["status"], response["content_type"], body))
+
+    class Handler(BaseHTTPRequestHandler):
+        def _serve(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            for method, pattern, status, content_type, body in routes:
+                if method == self.command and pattern.match(self.path):
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+            # строка статуса — только latin-1, русский текст — в теле (UTF-8)
+            self.send_error(404, "No recorded response", "Нет записанного ответа")
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, fmt: str, *args) -> None:
+            print(f"🧪 {self.command} {self.path} — {fmt % args}")
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recipe", help="Файл рецепта (HTTP_RECIPE_FILE)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = make_server(args.recipe, args.host, args.port)
+    print(f"🧪 Стенд портала: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()